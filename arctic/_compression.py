@@ -1,20 +1,41 @@
 import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
 from multiprocessing.pool import ThreadPool
 
+import numpy as np
+
 try:
     from lz4.block import compress as lz4_compress, decompress as lz4_decompress
     lz4_compressHC = lambda _str: lz4_compress(_str, mode='high_compression')
 except ImportError as e:
     from lz4 import compress as lz4_compress, compressHC as lz4_compressHC, decompress as lz4_decompress
 
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # ENABLE_PARALLEL mutated in global_scope. Do not remove.
 from ._config import ENABLE_PARALLEL, LZ4_HIGH_COMPRESSION, LZ4_WORKERS, LZ4_N_PARALLEL, LZ4_MINSZ_PARALLEL, \
-    BENCHMARK_MODE  # noqa # pylint: disable=unused-import
+    BENCHMARK_MODE, ADAPTIVE_COMPRESSION  # noqa # pylint: disable=unused-import
 
 logger = logging.getLogger(__name__)
 
 
 _compress_thread_pool = None
+_compress_pool_size = LZ4_WORKERS
+
+# Registered codecs: name -> (compress(_str, level, typesize), decompress(_str, typesize))
+_CODECS = {}
 
 
 def enable_parallel_lz4(mode):
@@ -49,14 +70,342 @@ def set_compression_pool_size(pool_size):
     if pool_size < 1:
         raise ValueError("The compression thread pool size cannot be of size {}".format(pool_size))
 
-    global _compress_thread_pool
+    global _compress_thread_pool, _compress_pool_size
     if _compress_thread_pool is not None:
         _compress_thread_pool.close()
         _compress_thread_pool.join()
     _compress_thread_pool = ThreadPool(pool_size)
+    _compress_pool_size = pool_size
+
+
+def _get_pool():
+    global _compress_thread_pool
+    if _compress_thread_pool is None:
+        _compress_thread_pool = ThreadPool(_compress_pool_size)
+    return _compress_thread_pool
+
+
+class CompressionPolicy(object):
+    """
+    Decides how many workers of the compression thread pool (de)compress a list of strings, 1 meaning serially.
+    By default it follows the module configuration (ENABLE_PARALLEL, LZ4_N_PARALLEL and LZ4_MINSZ_PARALLEL),
+    read at the time of the call, as compress_array and decompress_array always have:
+        compress: in parallel the slow codecs (LZ4HC) if ENABLE_PARALLEL, and more than LZ4_N_PARALLEL strings
+            the first of which is larger than LZ4_MINSZ_PARALLEL bytes
+        decompress: in parallel more than LZ4_N_PARALLEL strings, if ENABLE_PARALLEL
+
+    Parameters
+    ----------
+        parallel: `bool`
+            Whether the thread pool may be used, overriding ENABLE_PARALLEL. False never uses it.
+        workers: `int`
+            The maximum number of workers for a single call (capped by the size of the pool).
+        n_parallel: `int`
+            Use the thread pool for more than this number of strings.
+        minsz_parallel: `int`
+            Use the thread pool to compress strings, the first of which is larger than this number of bytes.
+    """
+
+    def __init__(self, parallel=None, workers=None, n_parallel=None, minsz_parallel=None):
+        self.parallel = parallel
+        self.max_workers = workers
+        self.n_parallel = n_parallel
+        self.minsz_parallel = minsz_parallel
+
+    def _max_workers(self, str_list):
+        max_workers = _compress_pool_size if self.max_workers is None else min(self.max_workers, _compress_pool_size)
+        return max(1, min(max_workers, len(str_list)))
+
+    def _parallel(self):
+        return ENABLE_PARALLEL if self.parallel is None else self.parallel
+
+    def workers(self, op, str_list, slow=False):
+        """
+        Return the number of workers to (de)compress str_list with.
+
+        Parameters
+        ----------
+            op: `str`
+                'compress' or 'decompress'
+            str_list: `list[str]`
+                The strings about to be processed.
+            slow: `bool`
+                True for the slow codecs (e.g. LZ4HC), which are always worth the thread pool.
+        """
+        if self.parallel is False:
+            return 1
+        n_parallel = LZ4_N_PARALLEL if self.n_parallel is None else self.n_parallel
+        minsz_parallel = LZ4_MINSZ_PARALLEL if self.minsz_parallel is None else self.minsz_parallel
+        if op == 'decompress':
+            use_parallel = self._parallel() and len(str_list) > n_parallel
+        else:
+            use_parallel = BENCHMARK_MODE or (self._parallel() and slow) or \
+                (len(str_list) > n_parallel and len(str_list[0]) > minsz_parallel)
+        return self._max_workers(str_list) if use_parallel else 1
+
+    def record(self, op, str_list, workers, elapsed):
+        """
+        Called with the time it took to (de)compress str_list with the given number of workers.
+        """
+        pass
+
+
+class AdaptiveCompressionPolicy(CompressionPolicy):
+    """
+    Measures the throughput of the serial and parallel executions (1, 2, 4... workers) per operation and
+    chunk size bucket (powers of 2), and picks the fastest. Every candidate is tried a few times first,
+    and the least tried one again every so often, to follow changes in the load of the machine.
+
+    Parameters
+    ----------
+        parallel: `bool`
+            Whether the thread pool may be used.
+        workers: `int`
+            The maximum number of workers for a single call (capped by the size of the pool).
+        explore: `int`
+            The number of times each candidate is measured before picking the fastest.
+        retry_every: `int`
+            Measure the least tried candidate again every retry_every calls.
+        decay: `float`
+            The weight of a new measurement in the throughput moving average.
+    """
+
+    def __init__(self, parallel=None, workers=None, explore=3, retry_every=100, decay=0.2):
+        super(AdaptiveCompressionPolicy, self).__init__(parallel=parallel, workers=workers)
+        self.explore = explore
+        self.retry_every = retry_every
+        self.decay = decay
+        self._lock = threading.Lock()
+        self._calls = {}
+        # (op, bucket) -> {workers: [count, throughput]}
+        self._stats = {}
+
+    @staticmethod
+    def _bucket(str_list):
+        return int(math.log(max(1, sum(len(x) for x in str_list) // len(str_list)), 2))
+
+    def workers(self, op, str_list, slow=False):
+        if BENCHMARK_MODE:
+            return self._max_workers(str_list)
+        if not self._parallel() or len(str_list) <= 1:
+            return 1
+        max_workers = self._max_workers(str_list)
+        candidates = [1]
+        while candidates[-1] * 2 < max_workers:
+            candidates.append(candidates[-1] * 2)
+        if max_workers > 1:
+            candidates.append(max_workers)
+
+        key = (op, self._bucket(str_list))
+        with self._lock:
+            stats = self._stats.setdefault(key, {})
+            calls = self._calls[key] = self._calls.get(key, 0) + 1
+            least_tried = min(candidates, key=lambda c: stats.get(c, (0,))[0])
+            if stats.get(least_tried, (0,))[0] < self.explore or calls % self.retry_every == 0:
+                return least_tried
+            return max(candidates, key=lambda c: stats[c][1])
+
+    def record(self, op, str_list, workers, elapsed):
+        throughput = sum(len(x) for x in str_list) / max(elapsed, 1e-9)
+        with self._lock:
+            stats = self._stats.setdefault((op, self._bucket(str_list)), {})
+            count, avg = stats.get(workers, (0, throughput))
+            stats[workers] = [count + 1, avg + self.decay * (throughput - avg) if count else throughput]
+
+
+_default_policy = AdaptiveCompressionPolicy() if ADAPTIVE_COMPRESSION else CompressionPolicy()
+_thread_policy = threading.local()
+
+
+def set_compression_policy(policy):
+    """
+    Set the process wide compression policy (see CompressionPolicy and AdaptiveCompressionPolicy).
+    """
+    global _default_policy
+    _default_policy = policy
+
+
+def get_compression_policy():
+    """
+    Return the compression policy in effect in the current thread.
+    """
+    return getattr(_thread_policy, 'policy', None) or _default_policy
+
+
+@contextmanager
+def compression_policy(policy=None, **kwargs):
+    """
+    Context manager overriding the compression policy of the current thread only, e.g. for a latency
+    sensitive reader, while other threads keep using the process wide policy:
+
+        with compression_policy(parallel=False):
+            library.read('symbol')
+
+    Parameters
+    ----------
+        policy: `CompressionPolicy`
+            The policy to use, or None to build a CompressionPolicy out of kwargs.
+    """
+    previous = getattr(_thread_policy, 'policy', None)
+    _thread_policy.policy = policy if policy is not None else CompressionPolicy(**kwargs)
+    try:
+        yield _thread_policy.policy
+    finally:
+        _thread_policy.policy = previous
+
+
+def _apply(fn, str_list):
+    return [fn(s) for s in str_list]
+
+
+def _split(str_list, workers):
+    step = int(math.ceil(float(len(str_list)) / workers))
+    return [str_list[i:i + step] for i in range(0, len(str_list), step)]
+
+
+def _map(op, fn, str_list, slow=False):
+    """
+    Apply fn to all the strings, serially or in the thread pool as decided by the compression policy.
+    """
+    policy = get_compression_policy()
+    workers = policy.workers(op, str_list, slow=slow)
+    start = time.time()
+    if workers <= 1:
+        rtn = _apply(fn, str_list)
+    elif workers >= min(len(str_list), _compress_pool_size):
+        rtn = _get_pool().map(fn, str_list)
+    else:
+        # Only use some of the workers, by handing each a contiguous slice of the strings
+        rtn = [x for batch in _get_pool().map(partial(_apply, fn), _split(str_list, workers)) for x in batch]
+    policy.record(op, str_list, workers, time.time() - start)
+    return rtn
+
+
+def _map_async(op, fn, str_list):
+    """
+    As _map, without waiting for the thread pool. Returns a callable blocking until the result is available.
+    The time from the submission to the completion in the thread pool is recorded by the compression policy.
+    """
+    policy = get_compression_policy()
+    workers = policy.workers(op, str_list)
+    start = time.time()
+
+    def _record(_):
+        policy.record(op, str_list, workers, time.time() - start)
+
+    if workers <= 1:
+        def _serial():
+            # Nothing runs until called, so only the call itself is timed
+            serial_start = time.time()
+            rtn = _apply(fn, str_list)
+            policy.record(op, str_list, workers, time.time() - serial_start)
+            return rtn
+        return _serial
+    if workers >= min(len(str_list), _compress_pool_size):
+        return _get_pool().map_async(fn, str_list, callback=_record).get
+    result = _get_pool().map_async(partial(_apply, fn), _split(str_list, workers), callback=_record)
+    return lambda: [x for batch in result.get() for x in batch]
+
+
+def register_codec(name, compress_fn, decompress_fn):
+    """
+    Register a compression codec, which libraries can then be configured to use.
 
+    Parameters
+    ----------
+        name: `str`
+            The name of the codec, recorded on the data compressed with it.
+        compress_fn: `callable`
+            compress_fn(_str, level, typesize) returns the compressed string.
+            level is None for the codec's default, typesize is the size in bytes of the items in _str.
+        decompress_fn: `callable`
+            decompress_fn(_str, typesize) returns the decompressed string.
+    """
+    _CODECS[name] = (compress_fn, decompress_fn)
+
+
+def parse_codec(spec):
+    """
+    Parse a codec specification of the form 'name' or 'name:level', e.g. 'zstd:9'
+
+    Returns
+    -------
+    `tuple(str, int)`
+    The codec name (None for the default LZ4) and the compression level (None for the codec's default).
+    """
+    if not spec:
+        return None, None
+    name, _, level = spec.partition(':')
+    if name not in _CODECS:
+        raise ValueError("Unknown compression codec {} (available codecs: {})".format(name, sorted(_CODECS)))
+    return name, int(level) if level else None
+
+
+def _is_lz4(codec):
+    return codec is None or codec == 'lz4'
+
+
+def _shuffle(_str, typesize):
+    """
+    Byte shuffle: store together the first bytes of all the items of size typesize, then the second bytes, etc.
+    Numeric columns compress much better this way, as the high order bytes change rarely.
+    """
+    arr = np.frombuffer(_str, dtype=np.uint8)
+    n = len(arr) // typesize * typesize
+    return arr[:n].reshape(-1, typesize).T.tostring() + arr[n:].tostring()
+
+
+def _unshuffle(_str, typesize):
+    arr = np.frombuffer(_str, dtype=np.uint8)
+    n = len(arr) // typesize * typesize
+    return arr[:n].reshape(typesize, -1).T.tostring() + arr[n:].tostring()
+
+
+def _lz4_compress(_str, level, typesize):
+    return lz4_compressHC(_str) if level else lz4_compress(_str)
+
+
+def _lz4_decompress(_str, typesize):
+    return lz4_decompress(_str)
+
+
+def _shuffle_lz4_compress(_str, level, typesize):
+    return _lz4_compress(_shuffle(_str, typesize), level, typesize)
 
-def compress_array(str_list, withHC=LZ4_HIGH_COMPRESSION):
+
+def _shuffle_lz4_decompress(_str, typesize):
+    return _unshuffle(lz4_decompress(_str), typesize)
+
+
+register_codec('lz4', _lz4_compress, _lz4_decompress)
+register_codec('shuffle_lz4', _shuffle_lz4_compress, _shuffle_lz4_decompress)
+
+if lz4_frame is not None:
+    register_codec('lz4_frame',
+                   lambda _str, level, typesize: lz4_frame.compress(_str, compression_level=level or 0),
+                   lambda _str, typesize: lz4_frame.decompress(_str))
+
+if zstandard is not None:
+    def _zstd_compress(_str, level, typesize):
+        # Compressor objects aren't thread safe, so use one per call
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(_str)
+
+    def _zstd_decompress(_str, typesize):
+        return zstandard.ZstdDecompressor().decompress(_str)
+
+    register_codec('zstd', _zstd_compress, _zstd_decompress)
+    register_codec('shuffle_zstd',
+                   lambda _str, level, typesize: _zstd_compress(_shuffle(_str, typesize), level, typesize),
+                   lambda _str, typesize: _unshuffle(_zstd_decompress(_str, typesize), typesize))
+
+
+def _decompress_fn(codec, typesize):
+    if _is_lz4(codec):
+        return lz4_decompress
+    return partial(_CODECS[codec][1], typesize=typesize)
+
+
+def compress_array(str_list, withHC=LZ4_HIGH_COMPRESSION, codec=None, level=None, typesize=1):
     """
     Compress an array of strings
 
@@ -66,30 +415,29 @@ def compress_array(str_list, withHC=LZ4_HIGH_COMPRESSION):
             The input list of strings which need to be compressed.
         withHC: `bool`
             This flag controls whether lz4HC will be used.
+        codec: `str`
+            The name of a registered codec to use instead of LZ4.
+        level: `int`
+            The compression level of the codec (LZ4HC is used for any level with LZ4).
+        typesize: `int`
+            The size in bytes of the items in the strings, used by the shuffle codecs.
 
     Returns
     -------
     `list[str`
     The list of the compressed strings.
     """
-    global _compress_thread_pool
-
     if not str_list:
         return str_list
 
-    do_compress = lz4_compressHC if withHC else lz4_compress
+    if _is_lz4(codec):
+        withHC = withHC or level is not None
+        do_compress = lz4_compressHC if withHC else lz4_compress
+    else:
+        do_compress = partial(_CODECS[codec][0], level=level, typesize=typesize)
 
-    def can_parallelize_strlist(strlist):
-        return len(strlist) > LZ4_N_PARALLEL and len(strlist[0]) > LZ4_MINSZ_PARALLEL
-
-    use_parallel = (ENABLE_PARALLEL and withHC) or can_parallelize_strlist(str_list)
-
-    if BENCHMARK_MODE or use_parallel:
-        if _compress_thread_pool is None:
-            _compress_thread_pool = ThreadPool(LZ4_WORKERS)
-        return _compress_thread_pool.map(do_compress, str_list)
-
-    return [do_compress(s) for s in str_list]
+    # LZ4HC and the other codecs are slow enough to always be worth the thread pool
+    return _map('compress', do_compress, str_list, slow=withHC or not _is_lz4(codec))
 
 
 def compress(_str):
@@ -123,18 +471,24 @@ def decompress(_str):
     return lz4_decompress(_str)
 
 
-def decompress_array(str_list):
+def decompress_array(str_list, codec=None, typesize=1):
     """
-    Decompress a list of strings
+    Decompress a list of strings, compressed with codec (LZ4 by default)
     """
-    global _compress_thread_pool
-
     if not str_list:
         return str_list
 
-    if not ENABLE_PARALLEL or len(str_list) <= LZ4_N_PARALLEL:
-        return [lz4_decompress(chunk) for chunk in str_list]
+    return _map('decompress', _decompress_fn(codec, typesize), str_list)
 
-    if _compress_thread_pool is None:
-        _compress_thread_pool = ThreadPool(LZ4_WORKERS)
-    return _compress_thread_pool.map(lz4_decompress, str_list)
+
+def decompress_array_async(str_list, codec=None, typesize=1):
+    """
+    Submit a list of strings, compressed with codec (LZ4 by default), for decompression to the thread pool,
+    without waiting for the result.
+
+    Returns
+    -------
+    `callable`
+    Blocks until the decompression is done and returns the list of the decompressed strings.
+    """
+    return _map_async('decompress', _decompress_fn(codec, typesize), str_list)
@@ -20,6 +20,21 @@ STRICT_WRITE_HANDLER_MATCH = bool(os.environ.get('STRICT_WRITE_HANDLER_MATCH'))
 # Extra sanity checks for corruption during appends. Introduces a 5-7% performance hit (off by default)
 CHECK_CORRUPTION_ON_APPEND = bool(os.environ.get('CHECK_CORRUPTION_ON_APPEND'))
 
+# Seconds for which the background pruner collects the symbols written with asynchronous prunes, to prune them together
+ARCTIC_ASYNC_PRUNE_INTERVAL = float(os.environ.get('ARCTIC_ASYNC_PRUNE_INTERVAL', 1))
+
+# Number of latest version documents cached in memory by each VersionStore (0, the default, disables the cache)
+ARCTIC_VERSION_CACHE_SIZE = int(os.environ.get('ARCTIC_VERSION_CACHE_SIZE', 0))
+
+# Seconds for which a version document is served from the VersionStore cache
+ARCTIC_VERSION_CACHE_TTL = int(os.environ.get('ARCTIC_VERSION_CACHE_TTL', 60))
+
+# Path of an sqlite file used as a local cache of segments (by SHA) for the reads of data with forward pointers
+ARCTIC_SEGMENT_CACHE = os.environ.get('ARCTIC_SEGMENT_CACHE')
+
+# Size in bytes above which the least recently used segments are evicted from the local segment cache (default 1GB)
+ARCTIC_SEGMENT_CACHE_SIZE = int(os.environ.get('ARCTIC_SEGMENT_CACHE_SIZE', 1024 ** 3))
+
 
 # -----------------------------
 # Serialization configuration
@@ -75,13 +90,17 @@ LZ4_HIGH_COMPRESSION = bool(os.environ.get('LZ4_HIGH_COMPRESSION'))
 #     arctic/benchmarks/lz4_tuning/README.txt
 # The size of the compression thread pool.
 # Rule of thumb: use 2 for non HC (VersionStore/NDarrayStore/PandasStore, and 8 for HC (TickStore).
-LZ4_WORKERS = os.environ.get('LZ4_WORKERS', 2)
+LZ4_WORKERS = int(os.environ.get('LZ4_WORKERS', 2))
 
 # The minimum required number of chunks to use parallel compression
-LZ4_N_PARALLEL = os.environ.get('LZ4_N_PARALLEL', 16)
+LZ4_N_PARALLEL = int(os.environ.get('LZ4_N_PARALLEL', 16))
 
 # Minimum data size to use parallel compression
-LZ4_MINSZ_PARALLEL = os.environ.get('LZ4_MINSZ_PARALLEL', 0.5 * 1024 ** 2)  # 0.5 MB
+LZ4_MINSZ_PARALLEL = int(os.environ.get('LZ4_MINSZ_PARALLEL', 0.5 * 1024 ** 2))  # 0.5 MB
+
+# Measure the compression throughput at runtime, to choose between serial and parallel (and how many workers),
+# rather than using the fixed thresholds above
+ADAPTIVE_COMPRESSION = bool(os.environ.get('ARCTIC_ADAPTIVE_COMPRESSION'))
 
 # Enable this when you run the benchmark_lz4.py
 BENCHMARK_MODE = False
@@ -0,0 +1,70 @@
+from __future__ import print_function
+
+import logging
+import optparse
+import time
+
+import pymongo
+
+from .utils import do_db_auth, setup_logging
+from ..arctic import Arctic, ArcticLibraryBinding
+from ..hooks import get_mongodb_uri
+
+logger = logging.getLogger(__name__)
+
+
+def compact(lib, symbols, min_append_count, max_bytes_per_sec):
+    compacted = lib.compact_all(symbols=symbols, min_append_count=min_append_count,
+                                max_bytes_per_sec=max_bytes_per_sec)
+    logger.info("Compacted %s symbols" % len(compacted))
+
+
+def main():
+    usage = """usage: %prog [options]
+
+    Compacts the segments appended to the symbols of a library into full compressed segments, for symbols with
+    at least min-appends appended segments, so that appenders (e.g. with compaction={'deferred': True}) don't
+    have to. Must be used on a Arctic VersionStore library instance.
+
+    Example:
+        arctic_compact --host=hostname --library=arctic_jblackburn.my_library --max-mb-per-sec=20 --interval=600
+    """
+    setup_logging()
+
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option("--host", default='localhost', help="Hostname, or clustername. Default: localhost")
+    parser.add_option("--library", help="The name of the library. e.g. 'arctic_jblackburn.library'")
+    parser.add_option("--symbols", help="The symbols to compact - comma separated (default all)")
+    parser.add_option("--min-appends", default=10, type='int',
+                      help="Compact symbols with at least min-appends appended segments. Default: 10")
+    parser.add_option("--max-mb-per-sec", default=None, type='float',
+                      help="Rate limit of the data rewritten, in MB per second. Default: unlimited")
+    parser.add_option("--interval", default=0, type='int',
+                      help="Keep compacting, every interval seconds. Default: 0, compact once")
+
+    (opts, _) = parser.parse_args()
+
+    if not opts.library:
+        parser.error('Must specify the Arctic library e.g. arctic_jblackburn.library!')
+    db_name, _ = ArcticLibraryBinding._parse_db_lib(opts.library)
+
+    print("Compacting appended symbols in : %s on mongo %s" % (opts.library, opts.host))
+    c = pymongo.MongoClient(get_mongodb_uri(opts.host))
+
+    if not do_db_auth(opts.host, c, db_name):
+        logger.error('Authentication Failed. Exiting.')
+        return
+    lib = Arctic(c)[opts.library]
+
+    symbols = opts.symbols.split(',') if opts.symbols else None
+    max_bytes_per_sec = int(opts.max_mb_per_sec * 1024 * 1024) if opts.max_mb_per_sec else None
+    while True:
+        compact(lib, symbols, opts.min_appends, max_bytes_per_sec)
+        if not opts.interval:
+            break
+        time.sleep(opts.interval)
+    logger.info("Done")
+
+
+if __name__ == '__main__':
+    main()
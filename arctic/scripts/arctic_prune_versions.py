@@ -12,12 +12,11 @@ from ..hooks import get_mongodb_uri
 logger = logging.getLogger(__name__)
 
 
-def prune_versions(lib, symbols, keep_mins):
+def prune_versions(lib, symbols, keep_mins, workers=1):
     logger.info("Fixing snapshot pointers")
     lib._cleanup_orphaned_versions(dry_run=False)
-    for symbol in symbols:
-        logger.info("Pruning %s" % symbol)
-        lib._prune_previous_versions(symbol, keep_mins=keep_mins)
+    pruned = lib.prune_all(keep_mins=keep_mins, symbols=symbols, workers=workers)
+    logger.info("Pruned %s versions" % pruned)
 
 
 def main():
@@ -35,7 +34,10 @@ def main():
     parser.add_option("--host", default='localhost', help="Hostname, or clustername. Default: localhost")
     parser.add_option("--library", help="The name of the library. e.g. 'arctic_jblackburn.library'")
     parser.add_option("--symbols", help="The symbols to prune - comma separated (default all)")
-    parser.add_option("--keep-mins", default=10, help="Ensure there's a version at least keep-mins old. Default:10")
+    parser.add_option("--keep-mins", default=10, type='int',
+                      help="Ensure there's a version at least keep-mins old. Default:10")
+    parser.add_option("--workers", default=1, type='int',
+                      help="Number of threads deleting the versions and their data. Default: 1")
 
     (opts, _) = parser.parse_args()
 
@@ -52,13 +54,8 @@ def main():
         return
     lib = Arctic(c)[opts.library]
 
-    if opts.symbols:
-        symbols = opts.symbols.split(',')
-    else:
-        symbols = lib.list_symbols(all_symbols=True)
-        logger.info("Found %s symbols" % len(symbols))
-
-    prune_versions(lib, symbols, opts.keep_mins)
+    symbols = opts.symbols.split(',') if opts.symbols else None
+    prune_versions(lib, symbols, opts.keep_mins, workers=opts.workers)
     logger.info("Done")
 
 
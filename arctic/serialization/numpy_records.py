@@ -255,7 +255,55 @@ class DataFrameSerializer(PandasSerializer):
         else:
             return columns, column_vals, None
 
-    def deserialize(self, item):
+    @staticmethod
+    def project(item, columns):
+        """
+        Return a view of the records item with the index and the given columns only.
+        The view is strided over the fields of item, so none of the data is copied.
+
+        Parameters
+        ----------
+        item: `numpy.recarray`
+            records, as serialised by this serializer
+        columns: `list`
+            names of the columns to keep, in the order they should have
+        """
+        metadata = dict(item.dtype.metadata)
+        all_columns = metadata['columns']
+        positions = DataFrameSerializer._column_positions(item, columns)
+        metadata['columns'] = [all_columns[i] for i in positions]
+        if metadata.get('multi_column') is not None:
+            multi_column = metadata['multi_column']
+            metadata['multi_column'] = {'names': multi_column['names'],
+                                        'values': [[level[i] for i in positions] for level in multi_column['values']]}
+        names = [str(x) for x in metadata['index']] + metadata['columns']
+        dtype = np.dtype({'names': names,
+                          'formats': [item.dtype.fields[x][0] for x in names],
+                          'offsets': [item.dtype.fields[x][1] for x in names],
+                          'itemsize': item.dtype.itemsize},
+                         metadata=metadata)
+        return item.view(type=np.ndarray, dtype=dtype)
+
+    @staticmethod
+    def _column_positions(item, columns):
+        all_columns = item.dtype.metadata['columns']
+        positions = []
+        for column in columns:
+            try:
+                positions.append(all_columns.index(str(column)))
+            except ValueError:
+                raise KeyError("Column %r not found, columns are: %s" % (column, all_columns))
+        return positions
+
+    def deserialize(self, item, columns=None):
+        if columns is not None:
+            positions = self._column_positions(item, columns)
+            all_columns = item.dtype.metadata['columns']
+            names = [str(x) for x in item.dtype.metadata['index']] + [all_columns[i] for i in positions]
+            if len(set(names)) != len(names):
+                # A view can't have the same field twice: the columns are picked from the whole DataFrame
+                return self.deserialize(item).iloc[:, positions]
+            item = self.project(item, columns)
         index = self._index_from_records(item)
         column_fields = [x for x in item.dtype.names if x not in item.dtype.metadata['index']]
         multi_column = item.dtype.metadata.get('multi_column')
@@ -1,5 +1,6 @@
 import hashlib
 import logging
+import numbers
 from operator import itemgetter
 
 import numpy as np
@@ -8,8 +9,10 @@ from bson.binary import Binary
 from pymongo.errors import OperationFailure, DuplicateKeyError
 from six.moves import xrange
 
+from ._segment_cache import get_segment_cache
 from ._version_store_utils import checksum, version_base_or_id, _fast_check_corruption
-from .._compression import compress_array, decompress
+from .._compression import compress, decompress, compress_array, decompress_array, decompress_array_async, \
+    parse_codec
 # CHECK_CORRUPTION_ON_APPEND used in global scope, do not remove.
 from .._config import CHECK_CORRUPTION_ON_APPEND, FW_POINTERS_CONFIG_KEY, FW_POINTERS_REFS_KEY, \
     ARCTIC_FORWARD_POINTERS_CFG, ARCTIC_FORWARD_POINTERS_RECONCILE, FwPointersCfg
@@ -22,6 +25,11 @@ logger = logging.getLogger(__name__)
 _CHUNK_SIZE = 2 * 1024 * 1024 - 2048  # ~2 MB (a bit less for usePowerOf2Sizes)
 _APPEND_SIZE = 1 * 1024 * 1024  # 1MB
 _APPEND_COUNT = 60  # 1 hour of 1 min data
+_READ_BATCH_SIZE = 8  # ~16MB of segments decompressed in parallel while the next batch is fetched
+_READ_BATCH_SYMBOLS = 100  # symbols whose segments are fetched with a single query by read_batch
+_WRITE_BATCH_SIZE = 8  # ~16MB of chunks compressed and sent to mongo at a time
+_COLUMNAR = 'columnar'  # layout of segments holding their rows field by field, each field compressed separately
+_LAYOUTS = ('row', _COLUMNAR)
 
 
 def _promote_struct_dtypes(dtype1, dtype2):
@@ -113,6 +121,269 @@ def _resize_with_dtype(arr, dtype):
         return arr.astype(dtype)
 
 
+def _rewritten_dtype_history(dtype_history, start):
+    """
+    The dtype history of a version (see NdarrayStore.append) once its rows from start on have been rewritten
+    in the dtype of the version.
+    """
+    rtn = []
+    for x in dtype_history:
+        if (rtn[-1]['up_to'] if rtn else 0) >= start:
+            break
+        rtn.append(dict(x, up_to=min(x['up_to'], start)))
+    return rtn
+
+
+def _batches(iterable, size):
+    """
+    Generator of lists of up to size consecutive items of iterable.
+    """
+    batch = []
+    for x in iterable:
+        batch.append(x)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _rechunk(arrays, chunk_rows=None):
+    """
+    Generator of the rows of arrays in arrays of chunk_rows rows, the last one possibly shorter.
+    Without chunk_rows, the (non-empty) arrays are passed through.
+    """
+    pending, pending_rows = [], 0
+    for rows in arrays:
+        if chunk_rows is None:
+            if len(rows):
+                yield rows if rows.flags.writeable else rows.copy()
+            continue
+        pending.append(rows)
+        pending_rows += len(rows)
+        if pending_rows >= chunk_rows:
+            rows = np.concatenate(pending)
+            for i in xrange(0, len(rows) - chunk_rows + 1, chunk_rows):
+                yield rows[i:i + chunk_rows]
+            pending = [rows[len(rows) - len(rows) % chunk_rows:]]
+            pending_rows = len(pending[0])
+    if pending_rows:
+        yield np.concatenate(pending)
+
+
+def _stats_dtype(dtype):
+    """
+    dtype of the statistics of the segments of a structured array of dtype: the 'segment' (last row) of each
+    segment, with the 'min', 'max' and number of NaNs ('nulls') of each of its numeric fields.
+    None if dtype has no numeric fields.
+    """
+    if dtype.names is None:
+        return None
+    names = [x for x in dtype.names if dtype.fields[x][0].kind in 'iuf' and not dtype.fields[x][0].shape]
+    if not names:
+        return None
+    values = [(x, dtype.fields[x][0]) for x in names]
+    return np.dtype([('segment', 'i8'), ('min', values), ('max', values), ('nulls', [(x, 'u4') for x in names])])
+
+
+def _chunk_stats(chunk, segment, stats_dtype):
+    """
+    The statistics of the rows of chunk, whose last row is segment, as a single row array of stats_dtype.
+    """
+    stats = np.zeros(1, dtype=stats_dtype)
+    stats['segment'] = segment
+    for name in stats_dtype['min'].names:
+        column = chunk[name]
+        if column.dtype.kind == 'f':
+            nulls = np.isnan(column)
+            stats['nulls'][name] = nulls.sum()
+            column = column[~nulls]
+        if len(column):
+            stats['min'][name] = column.min()
+            stats['max'][name] = column.max()
+        else:
+            stats['min'][name] = stats['max'][name] = np.nan
+    return stats
+
+
+def _is_columnar(version, dtype):
+    """
+    Whether the segments of version are written column by column: only structured 1-d arrays can be.
+    """
+    return version.get('layout') == _COLUMNAR and dtype.names is not None and len(version.get('shape', [-1])) == 1
+
+
+def _compress_columns(chunks, dtype, codec=None, level=None):
+    """
+    Compress each of the fields of each of the chunks separately, all the fields of the same item size together.
+
+    Returns
+    -------
+    `list` of (data, offsets) for each chunk: the compressed fields one after the other, and where each ends
+    """
+    by_typesize = {}
+    for i, chunk in enumerate(chunks):
+        for name in dtype.names:
+            typesize = dtype.fields[name][0].base.itemsize
+            by_typesize.setdefault(typesize, []).append((i, name, chunk[name].tostring()))
+    compressed = [{} for _ in chunks]
+    for typesize, columns in by_typesize.items():
+        for (i, name, _), data in zip(columns, compress_array([x for _, _, x in columns], codec=codec, level=level,
+                                                             typesize=typesize)):
+            compressed[i][name] = data
+    rtn = []
+    for columns in compressed:
+        data = [columns[name] for name in dtype.names]
+        rtn.append((b''.join(data), np.cumsum([len(x) for x in data]).tolist()))
+    return rtn
+
+
+def _compress_blocks(chunks, block_rows, codec=None, level=None, typesize=1):
+    """
+    Compress each of the chunks block_rows rows at a time, every block separately.
+
+    Returns
+    -------
+    `list` of (data, offsets, ends) for each chunk: the compressed blocks one after the other, where each ends
+    in the data, and the number of rows up to the end of each
+    """
+    blocks = [[chunk[i:i + block_rows].tostring() for i in xrange(0, len(chunk), block_rows)] for chunk in chunks]
+    compressed = iter(compress_array([x for chunk_blocks in blocks for x in chunk_blocks], codec=codec, level=level,
+                                     typesize=typesize))
+    rtn = []
+    for chunk, chunk_blocks in zip(chunks, blocks):
+        data = [next(compressed) for _ in chunk_blocks]
+        ends = [min(i + block_rows, len(chunk)) for i in xrange(0, len(chunk), block_rows)]
+        rtn.append((b''.join(data), np.cumsum([len(x) for x in data]).tolist(), ends))
+    return rtn
+
+
+def _block_slices(segment, first=0, last=None):
+    """
+    The compressed data of the blocks [first, last) of a segment written in blocks (see _compress_blocks).
+    """
+    data = segment['data']
+    offsets = [0] + segment['block_offsets']
+    last = len(segment['block_offsets']) if last is None else last
+    return [data[offsets[i]:offsets[i + 1]] for i in xrange(first, last)]
+
+
+def _column_slices(segment, dtype, fields=None):
+    """
+    Generator of (name, compressed data) of the fields of a column-major segment, all of them by default.
+    """
+    data = segment['data']
+    for name, start, end in zip(dtype.names, [0] + segment['column_offsets'][:-1], segment['column_offsets']):
+        if fields is None or name in fields:
+            yield name, data[start:end]
+
+
+def _column_rows(columns, dtype):
+    """
+    The number of rows of a column-major segment, read as a `dict` of field name -> bytes.
+    """
+    name = next(iter(columns))
+    return len(columns[name]) // dtype.fields[name][0].itemsize
+
+
+def _fill_columns(rows, columns):
+    """
+    Copy the fields of a column-major segment, a `dict` of field name -> bytes, into the rows of a structured array.
+    """
+    for name, data in columns.items():
+        column = rows[name]
+        column[:] = np.frombuffer(data, dtype=column.dtype.base).reshape(column.shape)
+
+
+def _fields_view(arr, fields):
+    """
+    View of the structured array arr with only the given fields (those it has), without copying the data.
+    """
+    names = [x for x in arr.dtype.names if x in fields]
+    dtype = np.dtype({'names': names,
+                      'formats': [arr.dtype.fields[x][0] for x in names],
+                      'offsets': [arr.dtype.fields[x][1] for x in names],
+                      'itemsize': arr.dtype.itemsize},
+                     metadata=dict(arr.dtype.metadata or {}))
+    return arr.view(dtype)
+
+
+def _read_segments(segments, typesize=1, dtype=None, fields=None, blocks=None, segment_dtypes=None):
+    """
+    Generator of (segment, data) for the segment documents, in the order they are served.
+    Compressed segments are handed to the compression thread pool in batches, so they get decompressed
+    while the next batch is still being fetched from the cursor.
+
+    The data of a column-major segment (see _compress_columns) is a `dict` of field name -> bytes,
+    with only the given fields of dtype (at least one) decompressed.
+
+    Of a segment written in blocks (see _compress_blocks), only the blocks [first, last) given by
+    blocks(segment document) (all of them if blocks is None, or it returns None) are decompressed,
+    the segment yielded being the last row of those blocks.
+
+    Segments whose dtype isn't dtype, as told by segment_dtypes (see NdarrayStore._segment_dtypes), are
+    decompressed with the item size of their own dtype.
+    """
+    if fields is not None and dtype is not None:
+        fields = [x for x in dtype.names if x in fields] or list(dtype.names[:1])
+
+    def _block_range(x):
+        n = len(x['block_offsets'])
+        first, last = (blocks and blocks(x)) or (0, n)
+        # at least a block, so that the rows of the segment still follow on from one another
+        first = min(max(first, 0), n - 1)
+        return first, min(max(last, first + 1), n)
+
+    def _typesize(x):
+        segment_dtype = segment_dtypes and segment_dtypes(x['segment'])
+        return typesize if segment_dtype is None else segment_dtype.itemsize
+
+    def _submit(batch):
+        by_codec = {}
+        block_ranges = {}
+        for i, x in enumerate(batch):
+            if 'column_offsets' in x:
+                for name, data in _column_slices(x, dtype, fields):
+                    by_codec.setdefault((x.get('codec'), dtype.fields[name][0].base.itemsize), []).append(data)
+            elif 'block_offsets' in x:
+                block_ranges[i] = _block_range(x)
+                by_codec.setdefault((x.get('codec'), _typesize(x)), []).extend(_block_slices(x, *block_ranges[i]))
+            elif x['compressed']:
+                by_codec.setdefault((x.get('codec'), _typesize(x)), []).append(x['data'])
+        return batch, block_ranges, {(codec, size): decompress_array_async(data, codec=codec, typesize=size)
+                                     for (codec, size), data in by_codec.items()}
+
+    def _collect(batch, block_ranges, decompressed):
+        decompressed = {key: iter(result()) for key, result in decompressed.items()}
+        for i, x in enumerate(batch):
+            if 'column_offsets' in x:
+                yield x['segment'], {name: next(decompressed[(x.get('codec'), dtype.fields[name][0].base.itemsize)])
+                                     for name, _ in _column_slices(x, dtype, fields)}
+            elif 'block_offsets' in x:
+                first, last = block_ranges[i]
+                data = decompressed[(x.get('codec'), _typesize(x))]
+                yield (x['segment'] - x['block_ends'][-1] + x['block_ends'][last - 1],
+                       b''.join(next(data) for _ in xrange(first, last)))
+            else:
+                yield x['segment'], next(decompressed[(x.get('codec'), _typesize(x))]) if x['compressed'] else x['data']
+
+    pending = []
+    batch = []
+    for x in segments:
+        batch.append(x)
+        if len(batch) == _READ_BATCH_SIZE:
+            pending.append(_submit(batch))
+            batch = []
+            if len(pending) > 1:
+                for rtn in _collect(*pending.pop(0)):
+                    yield rtn
+    if batch:
+        pending.append(_submit(batch))
+    for p in pending:
+        for rtn in _collect(*p):
+            yield rtn
+
+
 def set_corruption_check_on_append(enable):
     global CHECK_CORRUPTION_ON_APPEND
     CHECK_CORRUPTION_ON_APPEND = bool(enable)
@@ -208,6 +479,67 @@ def _fw_pointers_convert_append_to_write(previous_version):
     return prev_fw_config is FwPointersCfg.ENABLED and ARCTIC_FORWARD_POINTERS_CFG is not FwPointersCfg.ENABLED
 
 
+class _WriteBatch(object):
+    """
+    Gathers the segment writes of many symbols, so that they are sent with a single bulk_write
+    and verified with a single query, rather than a few round trips per symbol.
+    """
+
+    def __init__(self, collection, symbols):
+        self.collection = collection
+        self.bulk = []
+        self.versions = {}
+        self._previous_shas = {}
+        if symbols:
+            for x in collection.find({'symbol': {'$in': list(symbols)}}, projection={'symbol': 1, 'sha': 1, '_id': 0}):
+                self._previous_shas.setdefault(x['symbol'], set()).add(Binary(x['sha']))
+
+    def previous_shas(self, symbol):
+        return self._previous_shas.get(symbol, set())
+
+    def add(self, symbol, version, bulk):
+        self.bulk.extend(bulk)
+        self.versions[symbol] = version
+
+    def execute(self):
+        """
+        Write the gathered segments and check they are all in place.
+
+        Returns
+        -------
+        `dict` of symbol -> exception, for the symbols which failed the check
+        """
+        if self.bulk:
+            self.collection.bulk_write(self.bulk, ordered=False)
+            self.bulk = []
+
+        specs = {}
+        for symbol, version in self.versions.items():
+            if version.get(FW_POINTERS_CONFIG_KEY) == FwPointersCfg.DISABLED.name:
+                specs[symbol] = {'symbol': symbol, 'parent': version_base_or_id(version)}
+            else:
+                specs[symbol] = {'symbol': symbol, 'sha': {'$in': version[FW_POINTERS_REFS_KEY]}}
+
+        seen_chunks = {}
+        if specs:
+            seen_chunks = {x['_id']: x['count'] for x in self.collection.aggregate([
+                {'$match': {'$or': list(specs.values())}},
+                {'$group': {'_id': '$symbol', 'count': {'$sum': 1}}},
+            ])}
+
+        failed = {}
+        for symbol, version in self.versions.items():
+            try:
+                if seen_chunks.get(symbol, 0) != version['segment_count'] or \
+                        (version.get(FW_POINTERS_CONFIG_KEY) == FwPointersCfg.HYBRID.name and
+                         ARCTIC_FORWARD_POINTERS_RECONCILE):
+                    # Let the full check raise the detailed error (and reconcile the reverse pointers)
+                    NdarrayStore.check_written(self.collection, symbol, version)
+            except OperationFailure as e:
+                failed[symbol] = e
+        return failed
+
+
 class NdarrayStore(object):
     """Chunked store for arbitrary ndarrays, supporting append.
 
@@ -243,6 +575,9 @@ class NdarrayStore(object):
       u'base_version_id': ObjectId('55fa9a7781f12654382e58b8'), # _id of version 1
       u'dtype': u'float64',
       u'dtype_metadata': {},
+      # had the append promoted the dtype with upcast_on_read=True, the rows before it would have kept theirs,
+      # upcast when read:
+      # u'dtype_history': [{u'up_to': 10, u'dtype': u'int64', u'dtype_metadata': {}}],
       u'segment_count': 2, #2 segments included in this version
       }
       ]
@@ -253,15 +588,22 @@ class NdarrayStore(object):
      #first chunk written:
      {u'_id': ObjectId('55fa9a778b376a68efdd10e3'),
       u'compressed': True, #data is lz4 compressed on write()
+                           #(or with the library's codec, named in a u'codec' field, e.g. u'zstd')
       u'data': Binary('...........', 0),
       u'parent': [ObjectId('55fa9a7781f12654382e58b8')],
       u'segment': 9, #10 rows in the data up to this segment, so last row is 9
+      # with layout='columnar' (structured arrays only), the data holds each field compressed on its own
+      # and the end offset of each field in the data is kept, e.g. u'column_offsets': [310, 1024, 1422],
+      # with block_rows=N, the data holds blocks of N rows each compressed on its own: the end offset of each
+      # block in the data, u'block_offsets': [502, 977, 1210], the row count up to the end of each block,
+      # u'block_ends': [4, 8, 10], and for DataFrames and Series the datetime of their last rows, u'block_index'
       u'sha': Binary('.............', 0), # checksum of (symbol, {'data':.., 'compressed':.., 'segment':...})
       u'symbol': u'test'},
 
      #second chunk appended:
      {u'_id': ObjectId('55fa9aa98b376a68efdd10e6'),
       u'compressed': False, # no initial compression for append()
+                            # (unless the compaction policy compresses appends: True, with u'appended': True)
       u'data': Binary('...........', 0),
       u'parent': [ObjectId('55fa9a7781f12654382e58b8')],
       u'segment': 19, #20 rows in the data up to this segment, so last row is 19
@@ -308,7 +650,7 @@ class NdarrayStore(object):
     def can_write_type(data):
         return isinstance(data, np.ndarray)
 
-    def can_write(self, version, symbol, data):
+    def can_write(self, version, symbol, data, **kwargs):
         return self.can_write_type(data) and not data.dtype.hasobject
 
     def _dtype(self, string, metadata=None):
@@ -327,6 +669,13 @@ class NdarrayStore(object):
             from_index = from_version['up_to']
         return from_index, None
 
+    def _blocks(self, index_range, **kwargs):
+        """
+        Function of a segment document written in blocks giving the [first, last) range of its blocks
+        which hold the rows read, None for all of them - numpy arrays have no index to tell.
+        """
+        return None
+
     def get_info(self, version):
         ret = {}
         dtype = self._dtype(version['dtype'], version.get('dtype_metadata', {}))
@@ -343,40 +692,276 @@ class NdarrayStore(object):
     def read_options():
         return ['from_version']
 
-    def read(self, arctic_lib, version, symbol, read_preference=None, **kwargs):
+    def read(self, arctic_lib, version, symbol, read_preference=None, segments=None, fields=None, **kwargs):
         index_range = self._index_range(version, symbol, **kwargs)
         collection = arctic_lib.get_top_level_collection()
         if read_preference:
             collection = collection.with_options(read_preference=read_preference)
-        return self._do_read(collection, version, symbol, index_range=index_range)
+        return self._do_read(collection, version, symbol, index_range=index_range, segments=segments, fields=fields,
+                             blocks=self._blocks(index_range, **kwargs))
 
-    def _do_read(self, collection, version, symbol, index_range=None):
+    def read_batch(self, arctic_lib, versions, read_preference=None, **kwargs):
         """
-        index_range is a 2-tuple of integers - a [from, to) range of segments to be read.
-            Either from or to can be None, indicating no bound.
+        Read many symbols at once, fetching the segments of several symbols with each query.
+
+        Parameters
+        ----------
+        versions: `dict`
+            symbol -> version document to read
+        kwargs:
+            read options, passed through to read()
+
+        Returns
+        -------
+        `dict` of symbol -> data, or the exception raised while reading that symbol
+        """
+        collection = arctic_lib.get_top_level_collection()
+        if read_preference:
+            collection = collection.with_options(read_preference=read_preference)
+
+        rtn = {}
+        symbols = list(versions)
+        for i in xrange(0, len(symbols), _READ_BATCH_SYMBOLS):
+            specs = {}
+            for symbol in symbols[i:i + _READ_BATCH_SYMBOLS]:
+                try:
+                    index_range = self._index_range(versions[symbol], symbol, **kwargs)
+                    specs[symbol] = self._read_spec(versions[symbol], symbol, index_range)[0]
+                except Exception as e:
+                    rtn[symbol] = e
+            if not specs:
+                continue
+
+            batch = [symbol for symbol in symbols[i:i + _READ_BATCH_SYMBOLS] if symbol in specs]
+            segments = {symbol: [] for symbol in batch}
+            for x in collection.find({'$or': [specs[symbol] for symbol in batch]}):
+                segments[x['symbol']].append(x)
+
+            # Decompress the LZ4 segments of all the symbols in the batch together, in the thread pool
+            try:
+                self._decompress_segments([x for symbol in batch for x in segments[symbol]])
+            except Exception:
+                # A corrupt segment fails only its own symbol
+                for symbol in batch:
+                    try:
+                        self._decompress_segments(segments[symbol])
+                    except Exception as e:
+                        rtn[symbol] = e
+                batch = [symbol for symbol in batch if symbol not in rtn]
+
+            for symbol in batch:
+                try:
+                    rtn[symbol] = self.read(arctic_lib, versions[symbol], symbol, read_preference=read_preference,
+                                            segments=segments.pop(symbol), **kwargs)
+                except Exception as e:
+                    rtn[symbol] = e
+        return rtn
+
+    @staticmethod
+    def _decompress_segments(segments):
+        """
+        Decompress the whole-segment LZ4 data of segments in place, in the thread pool.
+        """
+        compressed = [x for x in segments if x['compressed'] and 'codec' not in x and 'column_offsets' not in x
+                      and 'block_offsets' not in x]
+        for x, data in zip(compressed, decompress_array([x['data'] for x in compressed])):
+            x['data'] = data
+            x['compressed'] = False
+
+    def iterator(self, arctic_lib, version, symbol, chunk_rows=None, read_preference=None, **kwargs):
+        """
+        Generator of the data of version, chunk_rows rows at a time (by default a segment at a time).
+        """
+        return _rechunk(self._iter_rows(arctic_lib, version, symbol, read_preference=read_preference, **kwargs),
+                        chunk_rows)
+
+    def _iter_rows(self, arctic_lib, version, symbol, read_preference=None, fields=None, skip_segments=None,
+                   **kwargs):
+        """
+        Generator of the rows of each of the segments of version in the range given by the read options,
+        but for the segments (by their last row, 'segment') in skip_segments.
+
+        Only the segment ids are fetched upfront; the segments themselves are fetched _READ_BATCH_SIZE at a time
+        and decompressed in the thread pool while the previous batch is being consumed, so memory use is
+        bounded by a couple of batches whatever the size of the data.
+        """
+        index_range = self._index_range(version, symbol, **kwargs)
+        collection = arctic_lib.get_top_level_collection()
+        if read_preference:
+            collection = collection.with_options(read_preference=read_preference)
+
+        spec, from_index, to_index = self._read_spec(version, symbol, index_range)
+        dtype = self._dtype(version['dtype'], version.get('dtype_metadata', {}))
+        shape = version.get('shape', [-1])
+        segment_dtypes = self._segment_dtypes(version)
+
+        ids = sorted(collection.find(spec, projection={'segment': 1}), key=itemgetter('segment'))
+        if from_index is None and len(ids) != version.get('segment_count'):
+            raise OperationFailure("Incorrect number of segments returned for {}:{}.  Expected: {}, but got {}. {}".format(
+                                   symbol, version['version'], version.get('segment_count'), len(ids),
+                                   collection.database.name + '.' + collection.name))
+        if skip_segments:
+            ids = [x for x in ids if x['segment'] not in skip_segments]
+
+        def _segments():
+            for batch in _batches(ids, _READ_BATCH_SIZE):
+                for x in sorted(collection.find({'symbol': symbol,  # hit only the right shard
+                                                 '_id': {'$in': [x['_id'] for x in batch]}}),
+                                key=itemgetter('segment')):
+                    yield x
+
+        expected = None
+        for segment, chunk in _read_segments(_segments(), typesize=dtype.itemsize, dtype=dtype, fields=fields,
+                                             blocks=self._blocks(index_range, **kwargs),
+                                             segment_dtypes=segment_dtypes):
+            segment_dtype = segment_dtypes and segment_dtypes(segment)
+            if isinstance(chunk, dict):
+                rows = np.empty(_column_rows(chunk, dtype), dtype=dtype)
+                _fill_columns(rows, chunk)
+            elif segment_dtype is not None:
+                rows = _resize_with_dtype(np.frombuffer(chunk, dtype=segment_dtype).reshape(shape), dtype)
+            else:
+                rows = np.frombuffer(chunk, dtype=dtype).reshape(shape)
+            start = segment + 1 - len(rows)
+            if expected is not None and start != expected and not skip_segments:
+                raise OperationFailure("Segment {} of {}:{} doesn't follow on from row {}".format(
+                                       segment, symbol, version['version'], expected))
+            expected = segment + 1
+            if fields is not None and dtype.names is not None:
+                rows = _fields_view(rows, fields)
+            yield rows[:max(0, to_index - start)]
+
+    def _read_spec(self, version, symbol, index_range=None):
+        """
+        Return the query spec for the segments in index_range, the [from, to) range of segments to be read,
+        along with the from and to bounds.
         """
         from_index = index_range[0] if index_range else None
         to_index = version['up_to']
         if index_range and index_range[1] and index_range[1] < version['up_to']:
             to_index = index_range[1]
-        segment_count = version.get('segment_count') if from_index is None else None
+        return _spec_fw_pointers_aware(symbol, version, from_index, to_index), from_index, to_index
 
-        spec = _spec_fw_pointers_aware(symbol, version, from_index, to_index)
+    def _do_read(self, collection, version, symbol, index_range=None, segments=None, fields=None, blocks=None):
+        """
+        index_range is a 2-tuple of integers - a [from, to) range of segments to be read.
+            Either from or to can be None, indicating no bound.
+        segments are the already fetched segment documents of index_range, if any.
+        fields are the names of the fields of a structured array to read, the array returned being a view with
+            only those fields. The other fields of column-major segments aren't even decompressed.
+        blocks, if given, picks the blocks to decompress of the first and last segments written in blocks
+            (see _blocks), the rows of the other blocks being left out.
+        """
+        spec, from_index, to_index = self._read_spec(version, symbol, index_range)
+        segment_count = version.get('segment_count') if from_index is None else None
 
-        data = bytearray()
+        dtype = self._dtype(version['dtype'], version.get('dtype_metadata', {}))
+        row_size = int(dtype.itemsize * np.prod(version.get('shape', [-1])[1:]))
+        segment_dtypes = self._segment_dtypes(version)
+
+        if segments is None:
+            segments = self._cached_segments(collection, version, spec)
+
+        if segments is not None:
+            segments = sorted(segments, key=itemgetter('segment'))
+        elif 'parent' in spec:
+            # Served in segment order straight off the (symbol, parent, segment) index
+            segments = collection.find(spec, sort=[('segment', pymongo.ASCENDING)])
+        elif from_index is None:
+            # A server-side sort on the SHAs can't use an index, but for a full read the position
+            # of each segment follows from its 'segment' (last row) field, so arrival order doesn't matter
+            segments = collection.find(spec)
+        else:
+            segments = sorted(collection.find(spec), key=itemgetter('segment'))
+
+        # For a full read the final size is known upfront, so the output is allocated once and every
+        # segment is copied straight into its slice as soon as it has been decompressed.
+        # For a partial read the offset of the first row is only known once the first segment has arrived.
+        data = np.empty(to_index * row_size, dtype=np.uint8) if from_index is None and blocks is None else None
+        offset = 0
+        end = 0
         i = -1
-        for i, x in enumerate(sorted(collection.find(spec), key=itemgetter('segment'))):
-            data.extend(decompress(x['data']) if x['compressed'] else x['data'])
+        for i, (segment, chunk) in enumerate(_read_segments(segments, typesize=dtype.itemsize, dtype=dtype,
+                                                            fields=fields, blocks=blocks,
+                                                            segment_dtypes=segment_dtypes)):
+            segment_dtype = segment_dtypes and segment_dtypes(segment)
+            if isinstance(chunk, dict):
+                size = _column_rows(chunk, dtype) * row_size
+            else:
+                if segment_dtype is not None:
+                    chunk = _resize_with_dtype(np.frombuffer(chunk, dtype=segment_dtype)
+                                               .reshape(version.get('shape', (-1))), dtype).tostring()
+                chunk = np.frombuffer(chunk, dtype=np.uint8)
+                size = len(chunk)
+            start = (segment + 1) * row_size - size
+            if data is None:
+                offset = start
+                data = np.empty(to_index * row_size - offset, dtype=np.uint8)
+            start -= offset
+            if start < 0 or start + size > len(data):
+                raise OperationFailure("Segment {} is out of the range of {}:{} ({} rows)".format(
+                                       segment, symbol, version['version'], to_index))
+            if isinstance(chunk, dict):
+                _fill_columns(data[start:start + size].view(dtype), chunk)
+            else:
+                data[start:start + size] = chunk
+            end = max(end, start + size)
 
         # Check that the correct number of segments has been returned
         if segment_count is not None and i + 1 != segment_count:
             raise OperationFailure("Incorrect number of segments returned for {}:{}.  Expected: {}, but got {}. {}".format(
                                    symbol, version['version'], segment_count, i + 1, collection.database.name + '.' + collection.name))
 
-        dtype = self._dtype(version['dtype'], version.get('dtype_metadata', {}))
-        rtn = np.frombuffer(data, dtype=dtype).reshape(version.get('shape', (-1)))
+        if data is None:
+            data = np.empty(0, dtype=np.uint8)
+        rtn = data[:end].view(dtype).reshape(version.get('shape', (-1)))
+        if fields is not None and dtype.names is not None:
+            rtn = _fields_view(rtn, fields)
         return rtn
 
+    @staticmethod
+    def _cached_segments(collection, version, spec):
+        """
+        The segment documents matching spec, served from the local segment cache where possible: only the
+        segments missing from the cache are fetched, by the SHAs in the forward pointers of version.
+        Returns None when there's no segment cache, or version has no forward pointers.
+        """
+        cache = get_segment_cache()
+        if cache is None or FW_POINTERS_REFS_KEY not in version:
+            return None
+
+        cached = cache.get_many(version[FW_POINTERS_REFS_KEY])
+        # A range read only needs the cached segments in that range
+        bounds = spec.get('segment', {})
+        segments = [x for x in cached.values()
+                    if bounds.get('$gte', x['segment']) <= x['segment'] < bounds.get('$lt', x['segment'] + 1)]
+
+        missing = [sha for sha in version[FW_POINTERS_REFS_KEY] if bytes(sha) not in cached]
+        if missing:
+            spec = dict(spec, sha={'$in': missing})
+            fetched = list(collection.find(spec))
+            cache.put_many(fetched)
+            segments.extend(fetched)
+        return segments
+
+    def _segment_dtypes(self, version):
+        """
+        Function of a segment (its last row) giving its dtype if it isn't that of version, None otherwise:
+        the segments appended before a change of dtype keep their own (see append) and are upcast when read.
+        None if all the segments of version have its dtype.
+        """
+        if not version.get('dtype_history'):
+            return None
+        history = [(x['up_to'], self._dtype(x['dtype'], x.get('dtype_metadata', {})))
+                   for x in version['dtype_history']]
+
+        def _segment_dtype(segment):
+            for up_to, dtype in history:
+                if segment < up_to:
+                    return dtype
+            return None
+        return _segment_dtype
+
     def _promote_types(self, dtype, dtype_str):
         if dtype_str == str(dtype):
             return dtype
@@ -388,8 +973,15 @@ class NdarrayStore(object):
         rtn = np.dtype(rtn, metadata=dict(dtype.metadata or {}))
         return rtn
 
-    def append(self, arctic_lib, version, symbol, item, previous_version, dtype=None, dirty_append=True):
+    def append(self, arctic_lib, version, symbol, item, previous_version, dtype=None, dirty_append=True,
+               compression=None, layout=None, segment_stats=False, block_rows=None, compaction=None,
+               upcast_on_read=False):
         collection = arctic_lib.get_top_level_collection()
+        if compression:
+            version['compression'] = compression
+        # Rewrites of the appended data keep the layout and blocks of the symbol, unless told otherwise
+        self._set_layout(version, layout or previous_version.get('layout'))
+        self._set_block_rows(version, block_rows or previous_version.get('block_rows'))
         if previous_version.get('shape', [-1]) != [-1, ] + list(item.shape)[1:]:
             raise UnhandledDtypeException()
 
@@ -410,8 +1002,13 @@ class NdarrayStore(object):
         version['type'] = self.TYPE
         version[FW_POINTERS_CONFIG_KEY] = ARCTIC_FORWARD_POINTERS_CFG.name
 
-        if str(dtype) != previous_version['dtype'] or \
-                _fw_pointers_convert_append_to_write(previous_version):
+        dtype_changed = str(dtype) != previous_version['dtype']
+        # If asked to, the segments of the previous dtype are kept as they are, to be upcast when read, but for
+        # column-major segments and segment statistics, which go by the dtype of the version. Versions with a
+        # dtype_history can't be read by arctic versions predating it, hence the rewrite by default.
+        upcast_on_read = upcast_on_read and previous_version['up_to'] > 0 and not _is_columnar(version, dtype) \
+            and 'segment_stats' not in previous_version
+        if (dtype_changed and not upcast_on_read) or _fw_pointers_convert_append_to_write(previous_version):
             logger.debug('Converting %s from %s to %s' % (symbol, previous_version['dtype'], str(dtype)))
             if item.dtype.hasobject:
                 raise UnhandledDtypeException()
@@ -427,10 +1024,25 @@ class NdarrayStore(object):
             version['up_to'] = len(item)
             version['sha'] = self.checksum(item)
             version['base_sha'] = version['sha']
-            self._do_write(collection, version, symbol, item, previous_version)
+            self._do_write(collection, version, symbol, item, previous_version,
+                           segment_stats=segment_stats or 'segment_stats' in previous_version)
         else:
-            version['dtype'] = previous_version['dtype']
-            version['dtype_metadata'] = previous_version['dtype_metadata']
+            if dtype_changed:
+                logger.debug('Appending %s to %s, upcasting the rows so far from %s when read' %
+                             (str(dtype), symbol, previous_version['dtype']))
+                if item.dtype.hasobject:
+                    raise UnhandledDtypeException()
+                version['dtype'] = str(dtype)
+                version['dtype_metadata'] = dict(dtype.metadata or {})
+                version['dtype_history'] = previous_version.get('dtype_history', []) + [{
+                    'up_to': previous_version['up_to'],
+                    'dtype': previous_version['dtype'],
+                    'dtype_metadata': previous_version['dtype_metadata']}]
+            else:
+                version['dtype'] = previous_version['dtype']
+                version['dtype_metadata'] = previous_version['dtype_metadata']
+                if 'dtype_history' in previous_version:
+                    version['dtype_history'] = previous_version['dtype_history']
 
             # Verify (potential) corruption with append
             if CHECK_CORRUPTION_ON_APPEND and _fast_check_corruption(
@@ -440,9 +1052,38 @@ class NdarrayStore(object):
                                 "Converting append to concat and rewrite".format(symbol, previous_version['version']))
                 dirty_append = True  # force a concat and re-write (use new base version id)
 
-            self._do_append(collection, version, symbol, item, previous_version, dirty_append)
+            self._do_append(collection, version, symbol, item, previous_version, dirty_append, compaction=compaction)
+
+    def compact(self, arctic_lib, version, symbol, previous_version, **kwargs):
+        """
+        Rewrite the segments appended to previous_version (along with the last compressed segment) into
+        compressed segments of the full size, as an append reaching the limits of the compaction policy does.
+        """
+        dtype = self._dtype(previous_version['dtype'], previous_version.get('dtype_metadata', {}))
+        item = np.empty([0] + list(previous_version.get('shape', [-1]))[1:], dtype=dtype)
+        NdarrayStore.append(self, arctic_lib, version, symbol, item, previous_version, dirty_append=True, **kwargs)
 
-    def _do_append(self, collection, version, symbol, item, previous_version, dirty_append):
+    @staticmethod
+    def _compaction_policy(compaction=None):
+        """
+        The compaction policy of appends, given the settings overriding the defaults:
+            append_count: the number of appends after which they are compacted (_APPEND_COUNT)
+            append_size: the size in bytes of the appends after which they are compacted (_APPEND_SIZE)
+            compress_appends: whether to compress every appended segment as it's written (False)
+            deferred: whether to leave the compaction to compact() rather than to the append reaching
+                the limits (False)
+        """
+        policy = {'append_count': _APPEND_COUNT, 'append_size': _APPEND_SIZE,
+                  'compress_appends': False, 'deferred': False}
+        unknown = set(compaction or {}) - set(policy)
+        if unknown:
+            raise ValueError("Unknown compaction settings {}, expected some of {}".format(sorted(unknown),
+                                                                                        sorted(policy)))
+        policy.update(compaction or {})
+        return policy
+
+    def _do_append(self, collection, version, symbol, item, previous_version, dirty_append, compaction=None):
+        policy = self._compaction_policy(compaction)
         data = item.tostring()
         # Compatibility with Arctic 1.22.0 that didn't write base_sha into the version document
         version['base_sha'] = previous_version.get('base_sha', Binary(b''))
@@ -458,11 +1099,20 @@ class NdarrayStore(object):
 
         # _CHUNK_SIZE is probably too big if we're only appending single rows of data - perhaps something smaller,
         # or also look at number of appended segments?
-        if not dirty_append and version['append_count'] < _APPEND_COUNT and version['append_size'] < _APPEND_SIZE:
+        if not dirty_append and (policy['deferred'] or (version['append_count'] < policy['append_count'] and
+                                                        version['append_size'] < policy['append_size'])):
             version['base_version_id'] = version_base_or_id(previous_version)
 
             if len(item) > 0:
                 segment = {'data': Binary(data), 'compressed': False, 'segment': version['up_to'] - 1}
+                if policy['compress_appends']:
+                    # marked as appended, to be compacted all the same
+                    codec, level = parse_codec(version.get('compression'))
+                    segment.update(data=Binary(compress_array([data], codec=codec, level=level,
+                                                              typesize=item.dtype.itemsize)[0]),
+                                   compressed=True, appended=True)
+                    if codec not in (None, 'lz4'):
+                        segment['codec'] = codec
                 sha = checksum(symbol, segment)
                 try:
                     # TODO: We could have a common handling with conditional spec-construction for the update spec.
@@ -497,16 +1147,23 @@ class NdarrayStore(object):
                     return
 
                 if 'segment_index' in previous_version:
-                    segment_index = self._segment_index(item,
+                    segment_index = self._segment_index(item[-1:],
                                                         existing_index=previous_version.get('segment_index'),
                                                         start=previous_version['up_to'],
                                                         new_segments=[segment['segment'], ])
                     if segment_index:
                         version['segment_index'] = segment_index
+                if 'segment_stats' in previous_version:
+                    stats_dtype = _stats_dtype(item.dtype)
+                    stats = _chunk_stats(item, segment['segment'], stats_dtype)
+                    version['segment_stats'] = self._segment_stats([stats], previous_version['segment_stats'],
+                                                                   previous_version['up_to'], stats_dtype)
                 logger.debug("Appended segment %d for parent %s" % (segment['segment'], version['_id']))
             else:
                 if 'segment_index' in previous_version:
                     version['segment_index'] = previous_version['segment_index']
+                if 'segment_stats' in previous_version:
+                    version['segment_stats'] = previous_version['segment_stats']
 
         else:  # Too much data has been appended now, so rewrite (and compress/chunk).
             self._concat_and_rewrite(collection, version, symbol, item, previous_version)
@@ -519,12 +1176,13 @@ class NdarrayStore(object):
         spec = _spec_fw_pointers_aware(symbol, previous_version)
 
         read_index_range = [0, None]
-        # The unchanged segments are the compressed ones (apart from the last compressed)
+        # The unchanged segments are the compressed ones (apart from the last compressed), but for appended ones
         unchanged_segments = []
-        for segment in sorted(collection.find(spec, projection={'_id': 1, 'segment': 1, 'compressed': 1, 'sha': 1}),
+        for segment in sorted(collection.find(spec, projection={'_id': 1, 'segment': 1, 'compressed': 1, 'sha': 1,
+                                                                'appended': 1}),
                               key=itemgetter('segment')):
-            # We want to stop iterating when we find the first uncompressed chunks
-            if not segment['compressed']:
+            # We want to stop iterating when we find the first uncompressed (or appended) chunks
+            if not segment['compressed'] or segment.get('appended'):
                 # We include the last compressed chunk in the recompression
                 if unchanged_segments:
                     unchanged_segments.pop()
@@ -543,17 +1201,23 @@ class NdarrayStore(object):
 
         # Only read back the section that needs to be compressed here (index_range=...)
         old_arr = self._do_read(collection, previous_version, symbol, index_range=read_index_range)
+        segment_stats = 'segment_stats' in previous_version
         if len(item) == 0:
             logger.debug('Rewrite and compress/chunk item %s, rewrote old_arr' % symbol)
-            self._do_write(collection, version, symbol, old_arr, previous_version, segment_offset=read_index_range[0])
+            self._do_write(collection, version, symbol, old_arr, previous_version, segment_offset=read_index_range[0],
+                           segment_stats=segment_stats)
         elif len(old_arr) == 0:
             logger.debug('Rewrite and compress/chunk item %s, wrote item' % symbol)
-            self._do_write(collection, version, symbol, item, previous_version, segment_offset=read_index_range[0])
+            self._do_write(collection, version, symbol, item, previous_version, segment_offset=read_index_range[0],
+                           segment_stats=segment_stats)
         else:
             logger.debug("Rewrite and compress/chunk %s, np.concatenate %s to %s" % (symbol,
                                                                                      item.dtype, old_arr.dtype))
+            if old_arr.dtype != item.dtype:
+                # The previous version is read in its own dtype, which this append may have promoted
+                old_arr = _resize_with_dtype(old_arr, item.dtype)
             self._do_write(collection, version, symbol, np.concatenate([old_arr, item]), previous_version,
-                           segment_offset=read_index_range[0])
+                           segment_offset=read_index_range[0], segment_stats=segment_stats)
         if unchanged_segments:
             if version.get(FW_POINTERS_CONFIG_KEY) != FwPointersCfg.ENABLED.name:
                 _attempt_update_unchanged(symbol, unchanged_segments, collection, version, previous_version)
@@ -597,8 +1261,13 @@ class NdarrayStore(object):
         sha.update(item.tostring())
         return Binary(sha.digest())
 
-    def write(self, arctic_lib, version, symbol, item, previous_version, dtype=None):
+    def write(self, arctic_lib, version, symbol, item, previous_version, dtype=None, batch=None, compression=None,
+              layout=None, segment_stats=False, block_rows=None):
         collection = arctic_lib.get_top_level_collection()
+        if compression:
+            version['compression'] = compression
+        self._set_layout(version, layout)
+        self._set_block_rows(version, block_rows)
         if item.dtype.hasobject:
             raise UnhandledDtypeException()
 
@@ -623,106 +1292,292 @@ class NdarrayStore(object):
                 return
 
         version['base_sha'] = version['sha']
-        self._do_write(collection, version, symbol, item, previous_version)
+        self._do_write(collection, version, symbol, item, previous_version, batch=batch, segment_stats=segment_stats)
+
+    def _write_incremental(self, arctic_lib, version, symbol, serializer, previous_version, batch=None,
+                           compression=None, layout=None, segment_stats=False, block_rows=None):
+        """
+        As write(), with the data coming from a LazyIncrementalSerializer: its chunks are serialised one at a time
+        and go straight into compression and mongo, so the whole array never has to be held in memory.
+        """
+        collection = arctic_lib.get_top_level_collection()
+        if compression:
+            version['compression'] = compression
+        self._set_layout(version, layout)
+        self._set_block_rows(version, block_rows)
+
+        dtype = serializer.dtype
+        version['dtype'] = str(dtype)
+        version['shape'] = (-1,) + serializer.shape[1:]
+        version['dtype_metadata'] = dict(dtype.metadata or {})
+        version['type'] = self.TYPE
+        version['up_to'] = len(serializer)
+        version[FW_POINTERS_CONFIG_KEY] = ARCTIC_FORWARD_POINTERS_CFG.name
+
+        sha = hashlib.sha1()
+        if previous_version and 'sha' in previous_version \
+                and previous_version['dtype'] == version['dtype'] \
+                and previous_version['up_to'] <= len(serializer):
+            for chunk, _, _, _ in serializer.generator_bytes(to_idx=previous_version['up_to']):
+                sha.update(chunk)
+            if Binary(sha.digest()) == previous_version['sha']:
+                # The first n rows are identical to the previous version, so just append the rest.
+                # Do a 'dirty' append (i.e. concat & start from a new base version) for safety
+                item = [chunk for chunk, _, _, _ in serializer.generator(from_idx=previous_version['up_to'])]
+                item = np.concatenate(item) if item else np.empty(0, dtype=dtype)
+                sha.update(item.tostring())
+                version['sha'] = Binary(sha.digest())
+                self._do_append(collection, version, symbol, item, previous_version, dirty_append=True)
+                return
+            sha = hashlib.sha1()
+
+        chunks = (chunk for chunk, _, _, _ in serializer.generator())
+        self._write_chunks(collection, version, symbol, chunks, dtype, previous_version, batch=batch, sha=sha,
+                           segment_stats=segment_stats)
+        version['sha'] = version['base_sha'] = Binary(sha.digest())
 
-    def _do_write(self, collection, version, symbol, item, previous_version, segment_offset=0):
+    @staticmethod
+    def _set_layout(version, layout):
+        """
+        Record in version the layout of the segments to write: 'row' (the default) for the rows one after the
+        other, or 'columnar' for structured arrays, whose segments then hold the rows field by field.
+        """
+        if layout not in (None,) + _LAYOUTS:
+            raise ValueError("Unknown segment layout {}, expected one of {}".format(layout, _LAYOUTS))
+        if layout == _COLUMNAR:
+            version['layout'] = layout
 
+    @staticmethod
+    def _set_block_rows(version, block_rows):
+        """
+        Record in version the number of rows of the blocks the segments to write are compressed in, if any.
+        A read of part of a segment written in blocks only decompresses the blocks it needs (see _blocks).
+        """
+        if block_rows is None:
+            return
+        if not isinstance(block_rows, numbers.Integral) or block_rows <= 0:
+            raise ValueError("Rows of the segment blocks must be a positive integer, got {}".format(block_rows))
+        version['block_rows'] = int(block_rows)
+
+    def _do_write(self, collection, version, symbol, item, previous_version, segment_offset=0, batch=None,
+                  segment_stats=False):
+        """
+        Chunk, compress and write the segments of item.
+        When a _WriteBatch is given, the segment updates are added to it rather than sent,
+        and the caller is responsible for executing the batch before inserting the version.
+        With segment_stats, the statistics of the segments of structured arrays are kept in the version
+        (see _segment_stats).
+        """
         row_size = int(item.dtype.itemsize * np.prod(item.shape[1:]))
 
         # chunk and store the data by (uncompressed) size
         rows_per_chunk = int(_CHUNK_SIZE / row_size)
+        chunks = (item[i: i + rows_per_chunk] for i in xrange(0, len(item), rows_per_chunk))
+        self._write_chunks(collection, version, symbol, chunks, item.dtype, previous_version,
+                           segment_offset=segment_offset, batch=batch, segment_stats=segment_stats)
 
+    def _write_chunks(self, collection, version, symbol, chunks, dtype, previous_version, segment_offset=0,
+                      batch=None, sha=None, segment_stats=False):
+        """
+        Compress and write a segment for each of the chunks (arrays of dtype), _WRITE_BATCH_SIZE chunks
+        at a time, so that chunks can be streamed in without the whole data being serialised upfront.
+        sha, if given, is updated with the bytes of every chunk.
+        """
         symbol_all_previous_shas, version_shas = set(), set()
-        if previous_version:
+        if batch is not None:
+            symbol_all_previous_shas.update(batch.previous_shas(symbol))
+        elif previous_version:
             symbol_all_previous_shas.update(Binary(x['sha']) for x in
                                             collection.find({'symbol': symbol}, projection={'sha': 1, '_id': 0}))
 
-        length = len(item)
-
         if segment_offset > 0 and 'segment_index' in previous_version:
             existing_index = previous_version['segment_index']
         else:
             existing_index = None
 
+        if 'dtype_history' in version:
+            # the segments from segment_offset on are written in the dtype of the version
+            dtype_history = _rewritten_dtype_history(version['dtype_history'], segment_offset)
+            if dtype_history:
+                version['dtype_history'] = dtype_history
+            else:
+                del version['dtype_history']
+
+        stats_dtype = _stats_dtype(dtype) if segment_stats else None
+        if stats_dtype is not None and segment_offset > 0:
+            existing_stats = previous_version.get('segment_stats')
+        else:
+            existing_stats = None
+
         segment_index = []
+        last_rows = []
+        stats = []
+        segment_count = 0
+        end = segment_offset
 
-        # Compress
-        idxs = xrange(int(np.ceil(float(length) / rows_per_chunk)))
-        chunks = [(item[i * rows_per_chunk: (i + 1) * rows_per_chunk]).tostring() for i in idxs]
-        compressed_chunks = compress_array(chunks)
+        # Compress, with the codec of the library if it isn't the default LZ4
+        codec, level = parse_codec(version.get('compression'))
+        columnar = _is_columnar(version, dtype)
+        # column-major segments are compressed field by field rather than in blocks
+        block_rows = None if columnar else version.get('block_rows')
 
-        # Write
         bulk = []
-        for i, chunk in zip(idxs, compressed_chunks):
-            segment = {
-                'data': Binary(chunk),
-                'compressed': True,
-                'segment': min((i + 1) * rows_per_chunk - 1, length - 1) + segment_offset,
-            }
-            segment_index.append(segment['segment'])
-            sha = checksum(symbol, segment)
-            segment_spec = {'symbol': symbol, 'sha': sha, 'segment': segment['segment']}
-
-            if ARCTIC_FORWARD_POINTERS_CFG is FwPointersCfg.DISABLED:
-                if sha not in symbol_all_previous_shas:
-                    segment['sha'] = sha
-                    bulk.append(pymongo.UpdateOne(segment_spec,
-                                                  {'$set': segment, '$addToSet': {'parent': version['_id']}},
-                                                  upsert=True))
-                else:
-                    bulk.append(pymongo.UpdateOne(segment_spec,
-                                                  {'$addToSet': {'parent': version['_id']}}))
+        for chunk_group in _batches(chunks, _WRITE_BATCH_SIZE):
+            data = [chunk.tostring() for chunk in chunk_group]
+            if sha is not None:
+                for x in data:
+                    sha.update(x)
+            if columnar:
+                compressed_chunks = [x + (None,) for x in _compress_columns(chunk_group, dtype, codec=codec,
+                                                                           level=level)]
+            elif block_rows:
+                compressed_chunks = _compress_blocks(chunk_group, block_rows, codec=codec, level=level,
+                                                     typesize=dtype.itemsize)
             else:
-                version_shas.add(sha)
-
-                # We only keep for the records the ID of the version which created the segment.
-                # We also need the uniqueness of the parent field for the (symbol, parent, segment) index,
-                # because upon mongo_retry "dirty_append == True", we compress and only the SHA changes
-                # which raises DuplicateKeyError if we don't have a unique (symbol, parent, segment).
-                set_spec = {'$addToSet': {'parent': version['_id']}}
-
-                if sha not in symbol_all_previous_shas:
-                    segment['sha'] = sha
-                    set_spec['$set'] = segment
-                    bulk.append(pymongo.UpdateOne(segment_spec, set_spec, upsert=True))
-                elif ARCTIC_FORWARD_POINTERS_CFG is FwPointersCfg.HYBRID:
-                        bulk.append(pymongo.UpdateOne(segment_spec, set_spec))
-                # With FwPointersCfg.ENABLED  we make zero updates on existing segment documents, but:
-                #   - write only the new segment(s) documents
-                #   - write the new version document
-                # This helps with performance as we update as less documents as necessary
-
-        if bulk:
-            collection.bulk_write(bulk, ordered=False)
-
-        segment_index = self._segment_index(item, existing_index=existing_index, start=segment_offset,
+                compressed_chunks = [(x, None, None) for x in compress_array(data, codec=codec, level=level,
+                                                                              typesize=dtype.itemsize)]
+            del data
+
+            # Write
+            for chunk, (compressed_chunk, offsets, block_ends) in zip(chunk_group, compressed_chunks):
+                end += len(chunk)
+                segment_count += 1
+                last_rows.append(chunk[-1:])
+                segment = {
+                    'data': Binary(compressed_chunk),
+                    'compressed': True,
+                    'segment': end - 1,
+                }
+                if columnar:
+                    segment['column_offsets'] = offsets
+                elif block_ends is not None:
+                    segment['block_offsets'] = offsets
+                    segment['block_ends'] = block_ends
+                    block_index = self._block_index(chunk, block_ends)
+                    if block_index is not None:
+                        segment['block_index'] = block_index
+                if stats_dtype is not None:
+                    stats.append(_chunk_stats(chunk, segment['segment'], stats_dtype))
+                if codec not in (None, 'lz4'):
+                    segment['codec'] = codec
+                segment_index.append(segment['segment'])
+                segment_sha = checksum(symbol, segment)
+                segment_spec = {'symbol': symbol, 'sha': segment_sha, 'segment': segment['segment']}
+
+                if ARCTIC_FORWARD_POINTERS_CFG is FwPointersCfg.DISABLED:
+                    if segment_sha not in symbol_all_previous_shas:
+                        segment['sha'] = segment_sha
+                        bulk.append(pymongo.UpdateOne(segment_spec,
+                                                      {'$set': segment, '$addToSet': {'parent': version['_id']}},
+                                                      upsert=True))
+                    else:
+                        bulk.append(pymongo.UpdateOne(segment_spec,
+                                                      {'$addToSet': {'parent': version['_id']}}))
+                else:
+                    version_shas.add(segment_sha)
+
+                    # We only keep for the records the ID of the version which created the segment.
+                    # We also need the uniqueness of the parent field for the (symbol, parent, segment) index,
+                    # because upon mongo_retry "dirty_append == True", we compress and only the SHA changes
+                    # which raises DuplicateKeyError if we don't have a unique (symbol, parent, segment).
+                    set_spec = {'$addToSet': {'parent': version['_id']}}
+
+                    if segment_sha not in symbol_all_previous_shas:
+                        segment['sha'] = segment_sha
+                        set_spec['$set'] = segment
+                        bulk.append(pymongo.UpdateOne(segment_spec, set_spec, upsert=True))
+                    elif ARCTIC_FORWARD_POINTERS_CFG is FwPointersCfg.HYBRID:
+                            bulk.append(pymongo.UpdateOne(segment_spec, set_spec))
+                    # With FwPointersCfg.ENABLED  we make zero updates on existing segment documents, but:
+                    #   - write only the new segment(s) documents
+                    #   - write the new version document
+                    # This helps with performance as we update as less documents as necessary
+
+            if bulk and batch is None:
+                collection.bulk_write(bulk, ordered=False)
+                bulk = []
+
+        last_rows = np.concatenate(last_rows) if last_rows else np.empty(0, dtype=dtype)
+        segment_index = self._segment_index(last_rows, existing_index=existing_index, start=segment_offset,
                                             new_segments=segment_index)
         if segment_index:
             version['segment_index'] = segment_index
-        version['segment_count'] = len(chunks)
+        if stats_dtype is not None:
+            version['segment_stats'] = self._segment_stats(stats, existing_stats, segment_offset, stats_dtype)
+        version['segment_count'] = segment_count
         version['append_size'] = 0
         version['append_count'] = 0
 
         _update_fw_pointers(collection, symbol, version, previous_version, is_append=False, shas_to_add=version_shas)
 
-        self.check_written(collection, symbol, version)
+        if batch is not None:
+            batch.add(symbol, version, bulk)
+        else:
+            self.check_written(collection, symbol, version)
 
-    def _segment_index(self, new_data, existing_index, start, new_segments):
+    def _segment_index(self, last_rows, existing_index, start, new_segments):
         """
         Generate a segment index which can be used in subselect data in _index_range.
         This function must handle both generation of the index and appending to an existing index
 
         Parameters:
         -----------
-        new_data: new data being written (or appended)
+        last_rows: the last row of each of the new segments, of the data being written (or appended)
         existing_index: index field from the versions document of the previous version
         start: first (0-based) offset of the new data
         segments: list of offsets. Each offset is the row index of the
                   the last row of a particular chunk relative to the start of the _original_ item.
-                  array(new_data) - segments = array(offsets in item)
 
         Returns:
         --------
         Library specific index metadata to be stored in the version document.
         """
         pass  # numpy arrays have no index
+
+    def _block_index(self, chunk, block_ends):
+        """
+        Generate the index of the blocks of a segment, kept in the segment document, which _blocks uses
+        to pick the blocks to read.
+
+        Parameters:
+        -----------
+        chunk: the data of the segment
+        block_ends: the number of rows of chunk up to the end of each of its blocks
+
+        Returns:
+        --------
+        Library specific index metadata to be stored in the segment document.
+        """
+        return None  # numpy arrays have no index
+
+    @staticmethod
+    def _segment_stats(new_stats, existing_stats, start, stats_dtype):
+        """
+        Generate the statistics of the segments, which let reads skip the segments with no rows of interest.
+        This function must handle both generation of the statistics and appending to the existing ones.
+
+        Parameters:
+        -----------
+        new_stats: the statistics of each of the new segments (see _chunk_stats)
+        existing_stats: segment_stats field from the versions document of the previous version
+        start: first (0-based) offset of the new data
+        stats_dtype: the dtype of the statistics of the data (see _stats_dtype)
+
+        Returns:
+        --------
+        Binary(compress(array of stats_dtype)), with a row by segment
+        """
+        stats = np.concatenate(new_stats) if new_stats else np.empty(0, dtype=stats_dtype)
+        if existing_stats:
+            existing_stats = np.frombuffer(decompress(existing_stats), dtype=stats_dtype)
+            stats = np.concatenate((existing_stats[existing_stats['segment'] < start], stats))
+        return Binary(compress(stats.tostring()))
+
+    def _read_segment_stats(self, version):
+        """
+        The statistics of the segments of version, None if it has none.
+        """
+        if 'segment_stats' not in version:
+            return None
+        # read-only but never written to
+        return np.frombuffer(decompress(version['segment_stats']), dtype=_stats_dtype(self._dtype(version['dtype'])))
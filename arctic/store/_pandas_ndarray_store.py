@@ -4,10 +4,13 @@ import logging
 import numpy as np
 from bson.binary import Binary
 from pandas import DataFrame, Series, Panel
+from six.moves import xrange
 
 from arctic._util import NP_OBJECT_DTYPE
+from arctic.serialization.incremental import IncrementalPandasToRecArraySerializer
 from arctic.serialization.numpy_records import SeriesSerializer, DataFrameSerializer
-from ._ndarray_store import NdarrayStore
+from ._ndarray_store import NdarrayStore, _CHUNK_SIZE, _fields_view, _rechunk
+from ._where import Where
 from .._compression import compress, decompress
 from ..date._util import to_pandas_closed_closed
 from ..exceptions import ArcticException
@@ -18,21 +21,23 @@ DTN64_DTYPE = 'datetime64[ns]'
 
 INDEX_DTYPE = [('datetime', DTN64_DTYPE), ('index', 'i8')]
 
+# rows compared at a time when checking that a datetime64 column is sorted
+_MONOTONIC_BLOCK = 1 << 20
+
 
 class PandasStore(NdarrayStore):
 
-    def _segment_index(self, recarr, existing_index, start, new_segments):
+    def _segment_index(self, last_rows, existing_index, start, new_segments):
         """
         Generate index of datetime64 -> item offset.
 
         Parameters:
         -----------
-        new_data: new data being written (or appended)
+        last_rows: the last row of each of the new segments, of the data being written (or appended)
         existing_index: index field from the versions document of the previous version
         start: first (0-based) offset of the new data
         segments: list of offsets. Each offset is the row index of the
                   the last row of a particular chunk relative to the start of the _original_ item.
-                  array(new_data) - segments = array(offsets in item)
 
         Returns:
         --------
@@ -40,11 +45,10 @@ class PandasStore(NdarrayStore):
             Where index is the 0-based index of the datetime in the DataFrame
         """
         # find the index of the first datetime64 column
-        idx_col = self._datetime64_index(recarr)
+        idx_col = self._datetime64_index(last_rows)
         # if one exists let's create the index on it
         if idx_col is not None:
             new_segments = np.array(new_segments, dtype='i8')
-            last_rows = recarr[new_segments - start]
             # create numpy index
             index = np.core.records.fromarrays([last_rows[idx_col]] + [new_segments, ], dtype=INDEX_DTYPE)
             # append to existing index if exists
@@ -89,16 +93,51 @@ class PandasStore(NdarrayStore):
                 return int(index['index'][idxstart]), int(index['index'][idxend] + 1)
         return super(PandasStore, self)._index_range(version, symbol, **kwargs)
 
+    def _blocks(self, index_range, date_range=None, **kwargs):
+        """ Given the index_range of a date_range read, the function picking the blocks to read of
+        the first and last segments: those with rows in the date_range, going by the block_index
+        of the datetime of the last row of each block. """
+        if not date_range or not index_range or index_range[0] is None or index_range[1] is None:
+            return None
+
+        def _block_range(segment):
+            if 'block_index' not in segment:
+                return None
+            # index is read-only but it's never written to
+            dts = np.frombuffer(segment['block_index'], dtype=DTN64_DTYPE)
+            start, end = _start_end(date_range, dts)
+            first, last = 0, len(dts)
+            if segment['segment'] == index_range[0]:
+                first = np.searchsorted(dts, start)
+            if segment['segment'] == index_range[1] - 1:
+                last = np.searchsorted(dts, end, side='right') + 1
+            return int(first), int(last)
+        return _block_range
+
+    def _block_index(self, chunk, block_ends):
+        """ Index of the datetime of the last row of each block, if the datetime64 index of chunk is sorted """
+        idx_col = self._datetime64_index(chunk)
+        if idx_col is not None and _is_monotonic(chunk[idx_col]):
+            return Binary(chunk[idx_col][np.array(block_ends) - 1].tostring())
+        return None
+
     def _daterange(self, recarr, date_range):
         """ Given a recarr, slice out the given artic.date.DateRange if a
         datetime64 index exists """
         idx = self._datetime64_index(recarr)
         if idx and len(recarr):
             dts = recarr[idx]
-            mask = Series(np.zeros(len(dts)), index=dts)
             start, end = _start_end(date_range, dts)
-            mask[start:end] = 1.0
-            return recarr[mask.values.astype(bool)]
+            if _is_monotonic(dts):
+                # a view, like the slice of a sorted DatetimeIndex
+                return recarr[np.searchsorted(dts, start):np.searchsorted(dts, end, side='right')]
+            # The first and last rows aren't the earliest and latest ones: only the bounds requested apply
+            mask = np.ones(len(dts), dtype='bool')
+            if date_range.start:
+                mask &= dts >= start
+            if date_range.end:
+                mask &= dts <= end
+            return recarr[mask]
         return recarr
 
     def read(self, arctic_lib, version, symbol, read_preference=None, date_range=None, **kwargs):
@@ -108,6 +147,13 @@ class PandasStore(NdarrayStore):
             item = self._daterange(item, date_range)
         return item
 
+    def _iter_rows(self, arctic_lib, version, symbol, date_range=None, **kwargs):
+        for recarr in super(PandasStore, self)._iter_rows(arctic_lib, version, symbol, date_range=date_range,
+                                                          **kwargs):
+            if date_range:
+                recarr = self._daterange(recarr, date_range)
+            yield recarr
+
     def get_info(self, version):
         """
         parses out the relevant information in version
@@ -134,6 +180,17 @@ def _start_end(date_range, dts):
     return start, end
 
 
+def _is_monotonic(dts):
+    """
+    Whether the datetime64 array dts is sorted, comparing it _MONOTONIC_BLOCK rows at a time.
+    """
+    for i in xrange(0, len(dts) - 1, _MONOTONIC_BLOCK):
+        block = dts[i:i + _MONOTONIC_BLOCK + 1]
+        if (block[1:] < block[:-1]).any():
+            return False
+    return True
+
+
 def _assert_no_timezone(date_range):
     for _dt in (date_range.start, date_range.end):
         if _dt and _dt.tzinfo is not None:
@@ -148,7 +205,7 @@ class PandasSeriesStore(PandasStore):
     def can_write_type(data):
         return isinstance(data, Series)
 
-    def can_write(self, version, symbol, data):
+    def can_write(self, version, symbol, data, **kwargs):
         if self.can_write_type(data):
             # Series has always a single-column
             if data.dtype is NP_OBJECT_DTYPE or data.index.dtype is NP_OBJECT_DTYPE:
@@ -156,9 +213,9 @@ class PandasSeriesStore(PandasStore):
             return True
         return False
 
-    def write(self, arctic_lib, version, symbol, item, previous_version):
+    def write(self, arctic_lib, version, symbol, item, previous_version, **kwargs):
         item, md = self.SERIALIZER.serialize(item)
-        super(PandasSeriesStore, self).write(arctic_lib, version, symbol, item, previous_version, dtype=md)
+        super(PandasSeriesStore, self).write(arctic_lib, version, symbol, item, previous_version, dtype=md, **kwargs)
 
     def append(self, arctic_lib, version, symbol, item, previous_version, **kwargs):
         item, md = self.SERIALIZER.serialize(item)
@@ -167,6 +224,10 @@ class PandasSeriesStore(PandasStore):
     def read_options(self):
         return super(PandasSeriesStore, self).read_options()
 
+    def iterator(self, arctic_lib, version, symbol, **kwargs):
+        for item in super(PandasSeriesStore, self).iterator(arctic_lib, version, symbol, **kwargs):
+            yield self.SERIALIZER.deserialize(item)
+
     def read(self, arctic_lib, version, symbol, **kwargs):
         item = super(PandasSeriesStore, self).read(arctic_lib, version, symbol, **kwargs)
         return self.SERIALIZER.deserialize(item)
@@ -180,27 +241,91 @@ class PandasDataFrameStore(PandasStore):
     def can_write_type(data):
         return isinstance(data, DataFrame)
 
-    def can_write(self, version, symbol, data):
+    def can_write(self, version, symbol, data, **kwargs):
         if self.can_write_type(data):
             if NP_OBJECT_DTYPE in data.dtypes.values or data.index.dtype is NP_OBJECT_DTYPE:
                 return self.SERIALIZER.can_convert_to_records_without_objects(data, symbol)
             return True
         return False
 
-    def write(self, arctic_lib, version, symbol, item, previous_version):
-        item, md = self.SERIALIZER.serialize(item)
-        super(PandasDataFrameStore, self).write(arctic_lib, version, symbol, item, previous_version, dtype=md)
+    @staticmethod
+    def _can_write_incremental(item):
+        """
+        Without object columns the dtype of the records is known upfront, so the frame can be
+        serialised and written chunk by chunk instead of being materialised as a single recarray.
+        """
+        dtypes = list(item.dtypes.values)
+        dtypes.extend(item.index.get_level_values(i).dtype for i in range(item.index.nlevels))
+        # compare by identity: timezone-aware dtypes can't be compared with dtype('O')
+        return len(item) > 0 and not any(dtype is NP_OBJECT_DTYPE for dtype in dtypes)
+
+    def write(self, arctic_lib, version, symbol, item, previous_version, **kwargs):
+        if self._can_write_incremental(item):
+            serializer = IncrementalPandasToRecArraySerializer(self.SERIALIZER, item, _CHUNK_SIZE)
+            self._write_incremental(arctic_lib, version, symbol, serializer, previous_version, **kwargs)
+        else:
+            item, md = self.SERIALIZER.serialize(item)
+            super(PandasDataFrameStore, self).write(arctic_lib, version, symbol, item, previous_version,
+                                                    dtype=md, **kwargs)
 
     def append(self, arctic_lib, version, symbol, item, previous_version, **kwargs):
         item, md = self.SERIALIZER.serialize(item)
         super(PandasDataFrameStore, self).append(arctic_lib, version, symbol, item, previous_version, dtype=md, **kwargs)
 
-    def read(self, arctic_lib, version, symbol, **kwargs):
-        item = super(PandasDataFrameStore, self).read(arctic_lib, version, symbol, **kwargs)
-        return self.SERIALIZER.deserialize(item)
+    @staticmethod
+    def _fields(version, columns):
+        """
+        The fields of the records holding the index and the given columns, None for all of them.
+        """
+        if columns is None:
+            return None
+        return [str(x) for x in version.get('dtype_metadata', {}).get('index', [])] + [str(x) for x in columns]
+
+    def read(self, arctic_lib, version, symbol, columns=None, where=None, **kwargs):
+        if where is None:
+            item = super(PandasDataFrameStore, self).read(arctic_lib, version, symbol,
+                                                          fields=self._fields(version, columns), **kwargs)
+        else:
+            item = list(self._iter_where(arctic_lib, version, symbol, where, columns=columns, **kwargs))
+            item = np.concatenate(item) if item else self._empty(version, self._fields(version, columns))
+        return self.SERIALIZER.deserialize(item, columns=columns)
+
+    def _iter_where(self, arctic_lib, version, symbol, where, columns=None, **kwargs):
+        """
+        Generator of the records of the rows matching the where expression (see Where), a segment at a time,
+        skipping the segments whose statistics rule out any match.
+        """
+        where = Where(where)
+        metadata = version.get('dtype_metadata', {})
+        for column in where.columns:
+            if column not in metadata.get('columns', []):
+                raise KeyError("Column %r not found, columns are: %s" % (column, metadata.get('columns')))
+        fields = self._fields(version, columns)
+        if fields is not None:
+            fields += where.columns
+
+        stats = self._read_segment_stats(version)
+        skip_segments = set(stats['segment'][~where.segments(stats)].tolist()) if stats is not None else None
+        for rows in self._iter_rows(arctic_lib, version, symbol, fields=fields, skip_segments=skip_segments,
+                                    **kwargs):
+            yield rows[where.rows(rows)]
+
+    def _empty(self, version, fields=None):
+        rows = np.empty(0, dtype=self._dtype(version['dtype'], version.get('dtype_metadata', {})))
+        return _fields_view(rows, fields) if fields is not None else rows
 
     def read_options(self):
-        return super(PandasDataFrameStore, self).read_options()
+        return super(PandasDataFrameStore, self).read_options() + ['columns', 'where']
+
+    def iterator(self, arctic_lib, version, symbol, columns=None, where=None, chunk_rows=None, **kwargs):
+        if where is None:
+            items = super(PandasDataFrameStore, self).iterator(arctic_lib, version, symbol, chunk_rows=chunk_rows,
+                                                               fields=self._fields(version, columns), **kwargs)
+        else:
+            items = _rechunk(self._iter_where(arctic_lib, version, symbol, where, columns=columns, **kwargs),
+                             chunk_rows)
+        for item in items:
+            yield self.SERIALIZER.deserialize(item, columns=columns)
 
 
 class PandasPanelStore(PandasDataFrameStore):
@@ -210,7 +335,7 @@ class PandasPanelStore(PandasDataFrameStore):
     def can_write_type(data):
         return isinstance(data, Panel)
 
-    def can_write(self, version, symbol, data):
+    def can_write(self, version, symbol, data, **kwargs):
         if self.can_write_type(data):
             frame = data.to_frame(filter_observations=False)
             if NP_OBJECT_DTYPE in frame.dtypes.values or (hasattr(data, 'index') and data.index.dtype is NP_OBJECT_DTYPE):
@@ -218,7 +343,7 @@ class PandasPanelStore(PandasDataFrameStore):
             return True
         return False
 
-    def write(self, arctic_lib, version, symbol, item, previous_version):
+    def write(self, arctic_lib, version, symbol, item, previous_version, **kwargs):
         if np.product(item.shape) == 0:
             # Currently not supporting zero size panels as they drop indices when converting to dataframes
             # Plan is to find a better solution in due course.
@@ -232,7 +357,7 @@ class PandasPanelStore(PandasDataFrameStore):
             item = DataFrame(item.stack())
         elif item.columns.dtype != np.dtype('object'):
             raise ValueError('Cannot support non-object dtypes for columns')
-        super(PandasPanelStore, self).write(arctic_lib, version, symbol, item, previous_version)
+        super(PandasPanelStore, self).write(arctic_lib, version, symbol, item, previous_version, **kwargs)
 
     def read(self, arctic_lib, version, symbol, **kwargs):
         item = super(PandasPanelStore, self).read(arctic_lib, version, symbol, **kwargs)
@@ -241,7 +366,11 @@ class PandasPanelStore(PandasDataFrameStore):
         return item.to_panel()
 
     def read_options(self):
-        return super(PandasPanelStore, self).read_options()
+        # columns of the frame a panel is stored as aren't the panel's items
+        return super(PandasDataFrameStore, self).read_options()
 
     def append(self, arctic_lib, version, symbol, item, previous_version, **kwargs):
         raise ValueError('Appending not supported for pandas.Panel')
+
+    def iterator(self, arctic_lib, version, symbol, **kwargs):
+        raise ValueError('Iterating not supported for pandas.Panel')
@@ -0,0 +1,97 @@
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class Pruner(object):
+    """
+    Background thread pruning the previous versions of the symbols queued to it, so that writes don't wait for it.
+
+    Each symbol is queued once however many times it's written before being pruned. The symbols queued within
+    interval seconds of one another are pruned together, up to batch_size at a time, by prune(symbols)
+    (e.g. VersionStore.prune_all), which returns the symbols it couldn't prune yet, if any, to be queued again.
+    Symbols still queued when the pruner is closed, or when the process exits, are left for later prunes.
+    """
+
+    def __init__(self, prune, interval=1, batch_size=1000):
+        self._prune = prune
+        self.interval = interval
+        self.batch_size = batch_size
+        self._queue = OrderedDict()
+        self._cond = threading.Condition()
+        self._pruning = 0
+        self._thread = None
+        self._closed = False
+        self._owner = None
+
+    def close_with(self, owner):
+        """
+        Close the pruner once owner is garbage collected.
+        """
+        self._owner = weakref.ref(owner, lambda _: self.close(wait=False))
+
+    def close(self, wait=True):
+        """
+        Stop the thread once the prune in progress, if any, is done. Submitting a symbol starts it again.
+        """
+        with self._cond:
+            self._closed = True
+            thread = self._thread
+            self._cond.notify_all()
+        if wait and thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def submit(self, symbol):
+        with self._cond:
+            self._closed = False
+            self._queue[symbol] = None
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='arctic-pruner')
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the symbols queued to be pruned. Returns whether they were within timeout seconds.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._queue or self._pruning:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+            # let the writes in flight queue their symbols, to prune them in the same batch
+            time.sleep(self.interval)
+            with self._cond:
+                if self._closed:
+                    return
+                symbols = []
+                while self._queue and len(symbols) < self.batch_size:
+                    symbols.append(self._queue.popitem(last=False)[0])
+                self._pruning += 1
+            retry = []
+            try:
+                retry = self._prune(symbols) or []
+            except Exception:
+                logger.exception("Failed to prune the previous versions of %d symbols" % len(symbols))
+            finally:
+                with self._cond:
+                    for symbol in retry:
+                        self._queue[symbol] = None
+                    self._pruning -= 1
+                    self._cond.notify_all()
@@ -0,0 +1,165 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import bson
+from six.moves import xrange
+
+from .._config import ARCTIC_SEGMENT_CACHE, ARCTIC_SEGMENT_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+_SQLITE_MAX_VARIABLES = 500  # shas looked up per query, under SQLITE_MAX_VARIABLE_NUMBER
+_ACCESS_RESOLUTION = 60  # seconds: the access times of cache hits are only updated once they're older than this
+_SIZE_CHECK_EVERY = 100  # puts after which the size of the cache is read from the file again
+_SEGMENT_FIELDS = ('segment', 'sha', 'data', 'compressed', 'codec', 'column_offsets', 'block_offsets', 'block_ends',
+                   'block_index')
+
+_segment_cache = None
+_segment_cache_lock = threading.Lock()
+
+
+class SegmentCache(object):
+    """
+    Local cache of VersionStore segment documents, keyed by their SHA.
+
+    A segment's SHA is the checksum of its contents (see _version_store_utils.checksum), so cached
+    segments never go stale. They are kept in an sqlite file, which can be shared by the processes of a
+    host, and the least recently used segments are evicted once the cache grows above max_size bytes.
+
+    The size of the cache is tracked as segments are put, and only summed up over the file every
+    _SIZE_CHECK_EVERY puts, to count the segments put by other processes, or once it gets above max_size.
+    Access times are kept to the minute, so that hits don't write to the file every time.
+    """
+
+    def __init__(self, path, max_size=ARCTIC_SEGMENT_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        dirname = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS segments "
+                           "(sha BLOB PRIMARY KEY, doc BLOB, size INTEGER, accessed REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS segments_accessed ON segments (accessed)")
+        self._size = self._total_size()
+        self._puts = 0
+
+    def __repr__(self):
+        return "<SegmentCache at %s, %s (max %d bytes)>" % (hex(id(self)), self.path, self.max_size)
+
+    @contextmanager
+    def _transaction(self):
+        # The connection is in autocommit mode, so that each write is committed in one go rather than row by row
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def _total_size(self):
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM segments").fetchone()[0]
+
+    def get_many(self, shas):
+        """
+        Returns
+        -------
+        `dict` of sha -> segment document, for the shas found in the cache
+        """
+        shas = [bytes(sha) for sha in shas]
+        rtn = {}
+        with self._lock:
+            for i in xrange(0, len(shas), _SQLITE_MAX_VARIABLES):
+                batch = shas[i:i + _SQLITE_MAX_VARIABLES]
+                params = ','.join('?' * len(batch))
+                found = self._conn.execute("SELECT sha, doc, accessed FROM segments WHERE sha IN (%s)" % params,
+                                           [sqlite3.Binary(sha) for sha in batch]).fetchall()
+                for sha, doc, _ in found:
+                    rtn[bytes(sha)] = bson.BSON(bytes(doc)).decode()
+                now = time.time()
+                stale = [sha for sha, _, accessed in found if accessed < now - _ACCESS_RESOLUTION]
+                if stale:
+                    params = ','.join('?' * len(stale))
+                    with self._transaction():
+                        self._conn.execute("UPDATE segments SET accessed = ? WHERE sha IN (%s)" % params,
+                                           [now] + stale)
+        return rtn
+
+    def put_many(self, segments):
+        """
+        Add the segment documents to the cache, evicting the least recently used ones if it gets too large.
+        """
+        rows = []
+        for segment in segments:
+            doc = bson.BSON.encode({k: segment[k] for k in _SEGMENT_FIELDS if k in segment})
+            if len(doc) <= self.max_size:
+                rows.append((sqlite3.Binary(bytes(segment['sha'])), sqlite3.Binary(doc), len(doc), time.time()))
+        if not rows:
+            return
+        with self._lock, self._transaction():
+            self._conn.executemany("INSERT OR REPLACE INTO segments (sha, doc, size, accessed) VALUES (?, ?, ?, ?)",
+                                   rows)
+            # Replaced segments are counted twice, which at worst sums up the size over the file sooner
+            self._size += sum(row[2] for row in rows)
+            self._puts += 1
+            if self._size > self.max_size or self._puts % _SIZE_CHECK_EVERY == 0:
+                self._evict()
+
+    def _evict(self):
+        size = self._size = self._total_size()
+        if size <= self.max_size:
+            return
+        evict = []
+        for sha, sze in self._conn.execute("SELECT sha, size FROM segments ORDER BY accessed"):
+            if size <= self.max_size:
+                break
+            evict.append((sha,))
+            size -= sze
+        logger.debug("Evicting %d segments from %s" % (len(evict), self.path))
+        self._conn.executemany("DELETE FROM segments WHERE sha = ?", evict)
+        self._size = size
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM segments")
+            self._size = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def set_segment_cache(path, max_size=ARCTIC_SEGMENT_CACHE_SIZE):
+    """
+    Use a local cache of segments, in the sqlite file at path, for the VersionStore reads of this process.
+
+    Parameters
+    ----------
+    path : `str` or `None`
+        location of the cache file, created if it doesn't exist. None disables the cache.
+    max_size : `int`
+        size in bytes above which the least recently used segments are evicted
+    """
+    global _segment_cache
+    with _segment_cache_lock:
+        if _segment_cache:
+            _segment_cache.close()
+        _segment_cache = SegmentCache(path, max_size) if path else False
+
+
+def get_segment_cache():
+    """
+    The SegmentCache used by VersionStore reads, by default configured by ARCTIC_SEGMENT_CACHE, or None.
+    """
+    global _segment_cache
+    if _segment_cache is None:
+        with _segment_cache_lock:
+            if _segment_cache is None:
+                _segment_cache = SegmentCache(ARCTIC_SEGMENT_CACHE) if ARCTIC_SEGMENT_CACHE else False
+    return _segment_cache or None
@@ -0,0 +1,133 @@
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+import bson
+import pymongo
+from pymongo.errors import OperationFailure, AutoReconnect
+
+logger = logging.getLogger(__name__)
+
+_POLL_INTERVAL = 1  # seconds between two reads of the changes published by other writers
+_RESUME_OVERLAP = 60  # seconds of changes read again when resuming, for the writers whose clocks are behind
+
+
+class VersionCache(object):
+    """
+    LRU cache of the latest version documents of the symbols of a library, each kept for up to ttl seconds.
+
+    Versions written through this process are invalidated as they're written. Versions written by others are
+    invalidated by tailing the library's capped changes collection (see VersionStore._publish_changes) at most
+    every _POLL_INTERVAL seconds; without a changes collection, each cached version is checked against the
+    version number of the latest version (a cheap, projected, query) before being served.
+
+    The tailable cursor is reopened from the last change seen, by _id, as soon as it dies. The _ids of the changes
+    are those of the versions, made by their writers, so the last _RESUME_OVERLAP seconds of changes are read again.
+    """
+
+    def __init__(self, versions, changes=None, max_size=1000, ttl=60):
+        self._versions = versions
+        self._changes = changes
+        self.max_size = max_size
+        self.ttl = ttl
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        self._tail = None
+        self._tail_started = False
+        self._last_change_id = None
+        self._last_poll = 0
+
+    def get(self, symbol):
+        """
+        Return a copy of the cached version document of symbol, or None.
+        """
+        with self._lock:
+            self._poll_changes()
+            entry = self._cache.get(symbol)
+            if entry is None:
+                return None
+            expiry, version = entry
+            if expiry < time.time():
+                del self._cache[symbol]
+                return None
+        # Checked outside of the lock, not to hold up the other threads for the round trip
+        latest = self._changes is not None or self._is_latest(version)
+        with self._lock:
+            if self._cache.get(symbol) is entry:
+                # most recently used go last
+                del self._cache[symbol]
+                if latest:
+                    self._cache[symbol] = entry
+        return copy.deepcopy(version) if latest else None
+
+    def put(self, symbol, version):
+        with self._lock:
+            self._cache.pop(symbol, None)
+            self._cache[symbol] = (time.time() + self.ttl, copy.deepcopy(version))
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def invalidate(self, symbol=None):
+        """
+        Drop symbol, or all the symbols, from the cache.
+        """
+        with self._lock:
+            if symbol is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(symbol, None)
+
+    def _is_latest(self, version):
+        latest = self._versions.find_one({'symbol': version['symbol']}, projection={'version': 1},
+                                         sort=[('version', pymongo.DESCENDING)])
+        return latest is not None and latest['_id'] == version['_id']
+
+    def _open_tail(self):
+        if not self._tail_started:
+            # The changes so far are older than anything cached
+            last = self._changes.find_one(projection={'_id': 1}, sort=[('$natural', pymongo.DESCENDING)])
+            self._last_change_id = last and last['_id']
+            self._tail_started = True
+        if self._last_change_id is None:
+            # There were no changes when the tail started, so all the changes since are new
+            spec = {}
+        else:
+            resume_from = self._last_change_id.generation_time - timedelta(seconds=_RESUME_OVERLAP)
+            spec = {'_id': {'$gt': bson.ObjectId.from_datetime(resume_from)}}
+        return self._changes.find(spec, projection={'symbol': 1}, cursor_type=pymongo.CursorType.TAILABLE)
+
+    def _read_tail(self):
+        if self._tail is None:
+            self._tail = self._open_tail()
+        for change in self._tail:
+            self._last_change_id = change['_id']
+            self._cache.pop(change['symbol'], None)
+        if not self._tail.alive:
+            # Reopened on the next poll, from the last change seen
+            self._tail = None
+
+    def _poll_changes(self):
+        if self._changes is None or time.time() - self._last_poll < _POLL_INTERVAL:
+            return
+        self._last_poll = time.time()
+        try:
+            try:
+                self._read_tail()
+            except (OperationFailure, AutoReconnect) as e:
+                # e.g. the cursor timed out, or the capped collection wrapped around it: reopen it straight away
+                logger.info("Failed to read the published changes, reopening the tailable cursor: %s" % e)
+                self._tail = None
+                if self._last_change_id is not None and \
+                        self._changes.find_one({'_id': self._last_change_id}, projection={'_id': 1}) is None:
+                    # The changes since the last one seen may have been overwritten
+                    self._cache.clear()
+                self._read_tail()
+        except (OperationFailure, AutoReconnect) as e:
+            logger.warning("Failed to read the published changes, dropping the cached versions: %s" % e)
+            self._cache.clear()
+            self._tail = None
+            # Nothing is served from the cache until the changes have been read again
+            self._last_poll = 0
@@ -0,0 +1,132 @@
+import ast
+import operator
+
+import numpy as np
+
+_OPS = {ast.Gt: operator.gt, ast.GtE: operator.ge, ast.Lt: operator.lt, ast.LtE: operator.le,
+        ast.Eq: operator.eq, ast.NotEq: operator.ne}
+# the comparison of a value with a column, as a comparison of the column with the value
+_FLIPPED = {ast.Gt: ast.Lt, ast.GtE: ast.LtE, ast.Lt: ast.Gt, ast.LtE: ast.GtE, ast.Eq: ast.Eq, ast.NotEq: ast.NotEq}
+
+
+class Where(object):
+    """
+    A filter on the rows of a DataFrame, from an expression comparing its columns with literals or with one another,
+    e.g. 'price > 100', 'volume == 0' or '(price > 100) & (volume != 0)'. Comparisons are combined with
+    and / or / not, or & / | / ~.
+
+    Besides filtering rows, it tells the segments that can't have any matching rows from their statistics
+    (see NdarrayStore._segment_stats).
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        try:
+            self._tree = ast.parse(expression.strip(), mode='eval').body
+        except SyntaxError as e:
+            raise ValueError("Invalid where expression %r: %s" % (expression, e))
+        self.columns = []
+        self._check(self._tree)
+
+    def __repr__(self):
+        return "Where(%r)" % self.expression
+
+    def _check(self, node):
+        if isinstance(node, ast.Name):
+            if node.id not in self.columns:
+                self.columns.append(node.id)
+        elif isinstance(node, ast.BoolOp):
+            for value in node.values:
+                self._check(value)
+        elif isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr)):
+            self._check(node.left)
+            self._check(node.right)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.Invert)):
+            self._check(node.operand)
+        elif isinstance(node, ast.Compare) and all(type(op) in _OPS for op in node.ops):
+            for operand in [node.left] + node.comparators:
+                if isinstance(operand, ast.Name):
+                    self._check(operand)
+                else:
+                    self._literal(operand)
+        else:
+            raise ValueError("Unsupported where expression %r" % self.expression)
+
+    def _literal(self, node):
+        try:
+            return ast.literal_eval(node)
+        except ValueError:
+            raise ValueError("Unsupported value in where expression %r, only columns and literals can be compared"
+                             % self.expression)
+
+    def rows(self, recarr):
+        """
+        Boolean mask of the rows of the structured array recarr that match.
+        """
+        return np.asarray(self._rows(self._tree, recarr), dtype=bool) & np.ones(len(recarr), dtype=bool)
+
+    def _rows(self, node, recarr):
+        if isinstance(node, ast.Name):
+            return recarr[node.id]
+        if isinstance(node, ast.BoolOp) or isinstance(node, ast.BinOp):
+            values = node.values if isinstance(node, ast.BoolOp) else [node.left, node.right]
+            combine = np.logical_and if isinstance(node.op, (ast.And, ast.BitAnd)) else np.logical_or
+            rtn = np.asarray(self._rows(values[0], recarr), dtype=bool)
+            for value in values[1:]:
+                rtn = combine(rtn, self._rows(value, recarr))
+            return rtn
+        if isinstance(node, ast.UnaryOp):
+            return ~np.asarray(self._rows(node.operand, recarr), dtype=bool)
+        if isinstance(node, ast.Compare):
+            operands = [self._rows(x, recarr) if isinstance(x, ast.Name) else self._literal(x)
+                        for x in [node.left] + node.comparators]
+            rtn = True
+            with np.errstate(invalid='ignore'):
+                for op, left, right in zip(node.ops, operands[:-1], operands[1:]):
+                    rtn = np.logical_and(rtn, _OPS[type(op)](left, right))
+            return rtn
+
+    def segments(self, stats):
+        """
+        Boolean mask of the segments, given their statistics (a structured array with the 'min', 'max'
+        and 'nulls' of their numeric columns, see NdarrayStore._segment_stats), that may have matching rows.
+        """
+        return np.asarray(self._segments(self._tree, stats), dtype=bool) & np.ones(len(stats), dtype=bool)
+
+    def _segments(self, node, stats):
+        if isinstance(node, ast.BoolOp) or isinstance(node, ast.BinOp):
+            values = node.values if isinstance(node, ast.BoolOp) else [node.left, node.right]
+            combine = np.logical_and if isinstance(node.op, (ast.And, ast.BitAnd)) else np.logical_or
+            rtn = self._segments(values[0], stats)
+            for value in values[1:]:
+                rtn = combine(rtn, self._segments(value, stats))
+            return rtn
+        if isinstance(node, ast.Compare):
+            operands = [node.left] + node.comparators
+            rtn = True
+            for op, left, right in zip(node.ops, operands[:-1], operands[1:]):
+                if isinstance(right, ast.Name) and not isinstance(left, ast.Name):
+                    left, right, op = right, left, _FLIPPED[type(op)]()
+                if isinstance(left, ast.Name) and not isinstance(right, ast.Name) and \
+                        left.id in (stats.dtype['min'].names or ()):
+                    rtn = np.logical_and(rtn, self._may_match(stats, left.id, type(op), self._literal(right)))
+            return rtn
+        # columns compared with one another, negations and bare columns can't be ruled out from the statistics
+        return True
+
+    @staticmethod
+    def _may_match(stats, column, op, value):
+        lo, hi = stats['min'][column], stats['max'][column]
+        with np.errstate(invalid='ignore'):
+            if op is ast.Gt:
+                return hi > value
+            if op is ast.GtE:
+                return hi >= value
+            if op is ast.Lt:
+                return lo < value
+            if op is ast.LtE:
+                return lo <= value
+            if op is ast.Eq:
+                return (lo <= value) & (hi >= value)
+            # NaNs are != to everything
+            return ~((lo == value) & (hi == value)) | (stats['nulls'][column] > 0)
@@ -1,16 +1,28 @@
+import functools
 import logging
+import threading
+import time
+import weakref
+from contextlib import contextmanager
 from datetime import datetime as dt, timedelta
+from multiprocessing.pool import ThreadPool
 
 import bson
 import pymongo
 import six
+from bson.son import SON
 from pymongo import ReadPreference
-from pymongo.errors import OperationFailure, AutoReconnect, DuplicateKeyError
+from pymongo.errors import OperationFailure, AutoReconnect, DuplicateKeyError, BulkWriteError
 
+from ._ndarray_store import NdarrayStore, _WriteBatch, _CHUNK_SIZE
 from ._pickle_store import PickleStore
+from ._pruner import Pruner
+from ._version_cache import VersionCache
 from ._version_store_utils import cleanup, get_symbol_alive_shas, _get_symbol_pointer_cfgs
 from .versioned_item import VersionedItem
-from .._config import STRICT_WRITE_HANDLER_MATCH, FW_POINTERS_REFS_KEY, FW_POINTERS_CONFIG_KEY, FwPointersCfg
+from .._compression import parse_codec
+from .._config import STRICT_WRITE_HANDLER_MATCH, FW_POINTERS_REFS_KEY, FW_POINTERS_CONFIG_KEY, FwPointersCfg, \
+    ARCTIC_VERSION_CACHE_SIZE, ARCTIC_VERSION_CACHE_TTL, ARCTIC_ASYNC_PRUNE_INTERVAL
 from .._util import indent, enable_sharding, mongo_count, get_fwptr_config
 from ..date import mktz, datetime_to_ms, ms_to_datetime
 from ..decorators import mongo_retry
@@ -24,6 +36,9 @@ VERSION_STORE_TYPE = 'VersionStore'
 _TYPE_HANDLERS = []
 ARCTIC_VERSION = None
 ARCTIC_VERSION_NUMERICAL = None
+_DUPLICATE_KEY_ERROR = 11000
+# Number of version ids deleted per query by prune_all
+_PRUNE_BATCH_SIZE = 5000
 
 
 def register_version(version, numerical):
@@ -42,6 +57,18 @@ def register_versioned_storage(storageClass):
     return storageClass
 
 
+def _writes_in_flight(f):
+    """
+    Decorator registering the symbols written by the method, its first argument (a symbol, or a dict of symbols),
+    as being written until it returns, for the background pruner to leave them alone until then.
+    """
+    @functools.wraps(f)
+    def wrapper(self, symbol, *args, **kwargs):
+        with self._writing(list(symbol) if isinstance(symbol, dict) else [symbol]):
+            return f(self, symbol, *args, **kwargs)
+    return wrapper
+
+
 class VersionStore(object):
 
     _bson_handler = PickleStore()
@@ -58,6 +85,43 @@ class VersionStore(object):
             arctic_lib.set_library_metadata('STRICT_WRITE_HANDLER_MATCH',
                                             bool(kwargs.pop('strict_write_handler')))
 
+        if 'compression' in kwargs:
+            # The codec of the array segments, e.g. 'zstd:9' (see arctic._compression)
+            compression = kwargs.pop('compression')
+            parse_codec(compression)
+            arctic_lib.set_library_metadata('COMPRESSION', compression)
+
+        if 'layout' in kwargs:
+            # The layout of the array segments: 'row' or 'columnar' (see NdarrayStore)
+            layout = kwargs.pop('layout')
+            NdarrayStore._set_layout({}, layout)
+            arctic_lib.set_library_metadata('LAYOUT', layout)
+
+        if 'segment_stats' in kwargs:
+            # Whether to keep the min, max and NaN count of the numeric columns of each segment
+            arctic_lib.set_library_metadata('SEGMENT_STATS', bool(kwargs.pop('segment_stats')))
+
+        if 'compaction' in kwargs:
+            # The compaction policy of the appends to the array stores (see NdarrayStore._compaction_policy)
+            compaction = kwargs.pop('compaction')
+            NdarrayStore._compaction_policy(compaction)
+            arctic_lib.set_library_metadata('COMPACTION', compaction)
+
+        if 'block_rows' in kwargs:
+            # The rows of the blocks the array segments are compressed in, for date range reads of part of a segment
+            block_rows = kwargs.pop('block_rows')
+            NdarrayStore._set_block_rows({}, block_rows)
+            arctic_lib.set_library_metadata('BLOCK_ROWS', block_rows)
+
+        if 'upcast_on_read' in kwargs:
+            # Whether appends promoting the dtype keep the segments so far, upcast when read, rather than rewriting
+            # them. The versions they write can't be read by arctic versions predating it.
+            arctic_lib.set_library_metadata('UPCAST_ON_READ', bool(kwargs.pop('upcast_on_read')))
+
+        if 'async_prune' in kwargs:
+            # Whether the previous versions are pruned by a background thread, rather than by the writes
+            arctic_lib.set_library_metadata('ASYNC_PRUNE', bool(kwargs.pop('async_prune')))
+
         for th in _TYPE_HANDLERS:
             th.initialize_library(arctic_lib, **kwargs)
         VersionStore._bson_handler.initialize_library(arctic_lib, **kwargs)
@@ -91,6 +155,12 @@ class VersionStore(object):
         self._arctic_lib = arctic_lib
         # Do we allow reading from secondaries
         self._allow_secondary = self._arctic_lib.arctic._allow_secondary
+        self._version_cache_size = ARCTIC_VERSION_CACHE_SIZE
+        self._version_cache_ttl = ARCTIC_VERSION_CACHE_TTL
+        self._pruner = None
+        # Number of writes in progress, by symbol
+        self._writes = {}
+        self._writes_lock = threading.Lock()
         self._reset()
         self._with_strict_handler = None
 
@@ -101,6 +171,62 @@ class VersionStore(object):
             self._with_strict_handler = STRICT_WRITE_HANDLER_MATCH if strict_meta is None else strict_meta
         return self._with_strict_handler
 
+    @property
+    def _compression(self):
+        if self._compression_codec is None:
+            self._compression_codec = self._arctic_lib.get_library_metadata('COMPRESSION') or ''
+        return self._compression_codec
+
+    @property
+    def _layout(self):
+        if self._segment_layout is None:
+            self._segment_layout = self._arctic_lib.get_library_metadata('LAYOUT') or ''
+        return self._segment_layout
+
+    @property
+    def _segment_stats(self):
+        if self._with_segment_stats is None:
+            self._with_segment_stats = bool(self._arctic_lib.get_library_metadata('SEGMENT_STATS'))
+        return self._with_segment_stats
+
+    @property
+    def _block_rows(self):
+        if self._segment_block_rows is None:
+            self._segment_block_rows = self._arctic_lib.get_library_metadata('BLOCK_ROWS') or 0
+        return self._segment_block_rows
+
+    @property
+    def _compaction(self):
+        if self._compaction_settings is None:
+            self._compaction_settings = self._arctic_lib.get_library_metadata('COMPACTION') or {}
+        return self._compaction_settings
+
+    @property
+    def _upcast_on_read(self):
+        if self._with_upcast_on_read is None:
+            self._with_upcast_on_read = bool(self._arctic_lib.get_library_metadata('UPCAST_ON_READ'))
+        return self._with_upcast_on_read
+
+    @property
+    def _async_prune(self):
+        if self._with_async_prune is None:
+            self._with_async_prune = bool(self._arctic_lib.get_library_metadata('ASYNC_PRUNE'))
+        return self._with_async_prune
+
+    def _handler_write_kwargs(self, handler, kwargs):
+        # The array stores compress their segments with the codec of the library
+        if self._compression and isinstance(handler, NdarrayStore):
+            kwargs = dict(kwargs, compression=self._compression)
+        # and lay them out, keep their statistics and compress them in blocks as the library does, unless told
+        # otherwise by the write
+        if self._layout and isinstance(handler, NdarrayStore) and 'layout' not in kwargs:
+            kwargs = dict(kwargs, layout=self._layout)
+        if self._segment_stats and isinstance(handler, NdarrayStore) and 'segment_stats' not in kwargs:
+            kwargs = dict(kwargs, segment_stats=True)
+        if self._block_rows and isinstance(handler, NdarrayStore) and 'block_rows' not in kwargs:
+            kwargs = dict(kwargs, block_rows=self._block_rows)
+        return kwargs
+
     @mongo_retry
     def _reset(self):
         # The default collections
@@ -112,6 +238,47 @@ class VersionStore(object):
         self._publish_changes = '%s.changes' % self._collection.name in self._collection.database.list_collection_names()
         if self._publish_changes:
             self._changes = self._collection.changes
+        # The library's compression codec, segment layout, statistics, blocks, compaction, upcast and prune settings
+        # are re-read on reset
+        self._compression_codec = None
+        self._segment_layout = None
+        self._with_segment_stats = None
+        self._segment_block_rows = None
+        self._compaction_settings = None
+        self._with_upcast_on_read = None
+        self._with_async_prune = None
+        # Cached version documents are dropped on reset
+        self._version_cache = None
+        if self._version_cache_size:
+            self._version_cache = VersionCache(self._versions, self._changes if self._publish_changes else None,
+                                               max_size=self._version_cache_size, ttl=self._version_cache_ttl)
+
+    def set_version_cache(self, max_size, ttl=ARCTIC_VERSION_CACHE_TTL):
+        """
+        Cache in memory the latest version documents of up to max_size symbols, used by read, read_metadata,
+        iterator and get_info when reading the latest version. has_symbol, snapshot and the writes always read
+        the versions from the database.
+
+        Versions written by other processes are picked up from the library's published changes
+        (or, if it doesn't publish changes, by checking the latest version number), and after ttl seconds at most.
+
+        Parameters
+        ----------
+        max_size : `int`
+            number of symbols whose latest version is cached, 0 disables the cache
+        ttl : `int`
+            seconds for which a version document is served from the cache
+        """
+        self._version_cache_size = max_size
+        self._version_cache_ttl = ttl
+        self._version_cache = None
+        if max_size:
+            self._version_cache = VersionCache(self._versions, self._changes if self._publish_changes else None,
+                                               max_size=max_size, ttl=ttl)
+
+    def _invalidate_version_cache(self, symbol):
+        if self._version_cache is not None:
+            self._version_cache.invalidate(symbol)
 
     def __getstate__(self):
         return {'arctic_lib': self._arctic_lib}
@@ -359,6 +526,13 @@ class VersionStore(object):
         date_range: `arctic.date.DateRange`
             DateRange to read data for.  Applies to Pandas data, with a DateTime index
             returns only the part of the data that falls in the DateRange.
+        columns: `list`
+            Names of the columns to read, in order.  Applies to Pandas DataFrames only, whose index is
+            always read.  Raises KeyError if a column doesn't exist.
+        where: `str`
+            Filter on the rows to read, comparing columns with numbers or with one another, e.g. 'price > 100'
+            or '(volume == 0) | (bid > ask)'.  Applies to Pandas DataFrames only.  The segments of data written
+            with segment_stats=True are skipped when their statistics show they have no matching rows.
         allow_secondary : `bool` or `None`
             Override the default behavior for allowing reads from secondary members of a cluster:
             `None` : use the settings from the top-level `Arctic` object used to query this version store.
@@ -371,12 +545,14 @@ class VersionStore(object):
         """
         try:
             read_preference = self._read_preference(allow_secondary)
-            _version = self._read_metadata(symbol, as_of=as_of, read_preference=read_preference)
+            _version = self._read_metadata(symbol, as_of=as_of, read_preference=read_preference, cached=True)
             return self._do_read(symbol, _version, from_version,
                                  date_range=date_range, read_preference=read_preference, **kwargs)
         except (OperationFailure, AutoReconnect) as e:
             # Log the exception so we know how often this is happening
             log_exception('read', e, 1)
+            # The cached version may have been pruned in the meantime
+            self._invalidate_version_cache(symbol)
             # If we've failed to read from the secondary, then it's possible the
             # secondary has lagged.  In this case direct the query to the primary.
             _version = mongo_retry(self._read_metadata)(symbol, as_of=as_of,
@@ -389,6 +565,160 @@ class VersionStore(object):
             log_exception('read', e, 1)
             raise
 
+    def read_batch(self, symbols, as_of=None, date_range=None, allow_secondary=None, **kwargs):
+        """
+        Read data for many symbols at once. The version documents are fetched with a single query and the
+        data segments of many symbols with each query, which saves a couple of round trips per symbol.
+
+        Parameters
+        ----------
+        symbols : `list` of `str`
+            symbol names for the items
+        as_of : `str` or `int` or `datetime.datetime`
+            Return the data as it was as_of the point in time, for all the symbols.
+            `int` : specific version number
+            `str` : snapshot name which contains the version
+            `datetime.datetime` : the version of the data that existed as_of the requested point in time
+        date_range: `arctic.date.DateRange`
+            DateRange to read data for.  Applies to Pandas data, with a DateTime index
+            returns only the part of the data that falls in the DateRange.
+        columns: `list`
+            Names of the columns to read, in order.  Applies to Pandas DataFrames only, whose index is
+            always read.  Raises KeyError if a column doesn't exist.
+        where: `str`
+            Filter on the rows to read, comparing columns with numbers or with one another, e.g. 'price > 100'
+            or '(volume == 0) | (bid > ask)'.  Applies to Pandas DataFrames only.  The segments of data written
+            with segment_stats=True are skipped when their statistics show they have no matching rows.
+        allow_secondary : `bool` or `None`
+            Override the default behavior for allowing reads from secondary members of a cluster:
+            `None` : use the settings from the top-level `Arctic` object used to query this version store.
+            `True` : allow reads from secondary members
+            `False` : only allow reads from primary members
+
+        Returns
+        -------
+        `dict` of symbol -> VersionedItem namedtuple, or the exception raised while reading that symbol
+        """
+        read_preference = self._read_preference(allow_secondary)
+        versions = self._read_metadata_batch(symbols, as_of=as_of, read_preference=read_preference)
+
+        rtn = {}
+        by_handler = {}
+        for symbol in symbols:
+            version = versions.get(symbol)
+            if version is None or version.get('deleted'):
+                rtn[symbol] = NoDataFoundException("No data found for %s in library %s" %
+                                                   (symbol, self._arctic_lib.get_name()))
+                continue
+            try:
+                handler = self._read_handler(version, symbol)
+            except Exception as e:
+                rtn[symbol] = e
+                continue
+            if self._with_strict_handler_match and date_range and \
+                    not self.handler_supports_read_option(handler, 'date_range'):
+                rtn[symbol] = ArcticException("Date range arguments not supported by handler in %s" % symbol)
+                continue
+            if kwargs.get('columns') is not None and not self.handler_supports_read_option(handler, 'columns'):
+                rtn[symbol] = ArcticException("Column selection not supported by handler in %s" % symbol)
+                continue
+            if kwargs.get('where') is not None and not self.handler_supports_read_option(handler, 'where'):
+                rtn[symbol] = ArcticException("Where filters not supported by handler in %s" % symbol)
+                continue
+            by_handler.setdefault(id(handler), (handler, {}))[1][symbol] = version
+
+        for handler, handler_versions in by_handler.values():
+            data = None
+            if hasattr(handler, 'read_batch'):
+                try:
+                    data = handler.read_batch(self._arctic_lib, handler_versions, read_preference=read_preference,
+                                              date_range=date_range, **kwargs)
+                except Exception as e:
+                    # Fall back to reading the symbols one by one, so that each gets its own result
+                    log_exception('read_batch', e, 1)
+            if data is None:
+                data = {}
+                for symbol, version in six.iteritems(handler_versions):
+                    try:
+                        data[symbol] = handler.read(self._arctic_lib, version, symbol, read_preference=read_preference,
+                                                    date_range=date_range, **kwargs)
+                    except Exception as e:
+                        data[symbol] = e
+
+            for symbol, version in six.iteritems(handler_versions):
+                if isinstance(data[symbol], (OperationFailure, AutoReconnect)):
+                    # As for read(), the secondary may have lagged, so retry this symbol on the primary
+                    log_exception('read_batch', data[symbol], 1)
+                    try:
+                        rtn[symbol] = self.read(symbol, as_of=as_of, date_range=date_range, allow_secondary=False,
+                                                **kwargs)
+                    except Exception as e:
+                        rtn[symbol] = e
+                elif isinstance(data[symbol], Exception):
+                    rtn[symbol] = data[symbol]
+                else:
+                    rtn[symbol] = VersionedItem(symbol=symbol, library=self._arctic_lib.get_name(),
+                                                version=version['version'], metadata=version.pop('metadata', None),
+                                                data=data[symbol], host=self._arctic_lib.arctic.mongo_host)
+        return rtn
+
+    def iterator(self, symbol, as_of=None, chunk_rows=None, date_range=None, allow_secondary=None, **kwargs):
+        """
+        Iterate over the data of the named symbol a piece at a time, rather than reading it all into
+        memory at once. Supported for numpy and pandas (Series and DataFrame) data.
+
+        Parameters
+        ----------
+        symbol : `str`
+            symbol name for the item
+        as_of : `str` or `int` or `datetime.datetime`
+            Return the data as it was as_of the point in time.
+            `int` : specific version number
+            `str` : snapshot name which contains the version
+            `datetime.datetime` : the version of the data that existed as_of the requested point in time
+        chunk_rows : `int`
+            Number of rows in each of the pieces, the default being the rows of each stored segment.
+            With a date_range the first and last pieces may be shorter.
+        date_range: `arctic.date.DateRange`
+            DateRange to read data for.  Applies to Pandas data, with a DateTime index
+            returns only the part of the data that falls in the DateRange.
+        columns: `list`
+            Names of the columns to read, in order.  Applies to Pandas DataFrames only, whose index is
+            always read.  Raises KeyError if a column doesn't exist.
+        where: `str`
+            Filter on the rows to read, comparing columns with numbers or with one another, e.g. 'price > 100'
+            or '(volume == 0) | (bid > ask)'.  Applies to Pandas DataFrames only.  The segments of data written
+            with segment_stats=True are skipped when their statistics show they have no matching rows.
+        allow_secondary : `bool` or `None`
+            Override the default behavior for allowing reads from secondary members of a cluster:
+            `None` : use the settings from the top-level `Arctic` object used to query this version store.
+            `True` : allow reads from secondary members
+            `False` : only allow reads from primary members
+
+        Returns
+        -------
+        Generator of the pieces of the data (ndarray, Series or DataFrame), in order.
+        """
+        if chunk_rows is not None and chunk_rows < 1:
+            raise ValueError("chunk_rows must be positive: {}".format(chunk_rows))
+        read_preference = self._read_preference(allow_secondary)
+        version = self._read_metadata(symbol, as_of=as_of, read_preference=read_preference, cached=True)
+        if version.get('deleted'):
+            raise NoDataFoundException("No data found for %s in library %s" % (symbol, self._arctic_lib.get_name()))
+        handler = self._read_handler(version, symbol)
+        if not hasattr(handler, 'iterator'):
+            raise ArcticException("Iterating is not supported by handler %s in %s" %
+                                  (handler.__class__.__name__, symbol))
+        if self._with_strict_handler_match and date_range and \
+                not self.handler_supports_read_option(handler, 'date_range'):
+            raise ArcticException("Date range arguments not supported by handler in %s" % symbol)
+        if kwargs.get('columns') is not None and not self.handler_supports_read_option(handler, 'columns'):
+            raise ArcticException("Column selection not supported by handler in %s" % symbol)
+        if kwargs.get('where') is not None and not self.handler_supports_read_option(handler, 'where'):
+            raise ArcticException("Where filters not supported by handler in %s" % symbol)
+        return handler.iterator(self._arctic_lib, version, symbol, chunk_rows=chunk_rows, date_range=date_range,
+                                read_preference=read_preference, **kwargs)
+
     @mongo_retry
     def get_info(self, symbol, as_of=None):
         """
@@ -408,7 +738,7 @@ class VersionStore(object):
         -------
         dictionary of the information (specific to the type of data)
         """
-        version = self._read_metadata(symbol, as_of=as_of, read_preference=None)
+        version = self._read_metadata(symbol, as_of=as_of, read_preference=None, cached=True)
         handler = self._read_handler(version, symbol)
         if handler and hasattr(handler, 'get_info'):
             return handler.get_info(version)
@@ -456,6 +786,10 @@ class VersionStore(object):
                 kwargs.get('date_range') and \
                 not self.handler_supports_read_option(handler, 'date_range'):
             raise ArcticException("Date range arguments not supported by handler in %s" % symbol)
+        if kwargs.get('columns') is not None and not self.handler_supports_read_option(handler, 'columns'):
+            raise ArcticException("Column selection not supported by handler in %s" % symbol)
+        if kwargs.get('where') is not None and not self.handler_supports_read_option(handler, 'where'):
+            raise ArcticException("Where filters not supported by handler in %s" % symbol)
 
         data = handler.read(self._arctic_lib, version, symbol, from_version=from_version, **kwargs)
         return VersionedItem(symbol=symbol, library=self._arctic_lib.get_name(), version=version['version'],
@@ -484,12 +818,21 @@ class VersionStore(object):
             `True` : allow reads from secondary members
             `False` : only allow reads from primary members
         """
-        _version = self._read_metadata(symbol, as_of=as_of, read_preference=self._read_preference(allow_secondary))
+        _version = self._read_metadata(symbol, as_of=as_of, read_preference=self._read_preference(allow_secondary),
+                                       cached=True)
         return VersionedItem(symbol=symbol, library=self._arctic_lib.get_name(), version=_version['version'],
                              metadata=_version.pop('metadata', None), data=None,
                              host=self._arctic_lib.arctic.mongo_host)
 
-    def _read_metadata(self, symbol, as_of=None, read_preference=None):
+    def _read_metadata(self, symbol, as_of=None, read_preference=None, cached=False):
+        # The latest version is served from the version cache, if enabled, to the reads asking for it (cached=True).
+        # The others (e.g. has_symbol, snapshot, the writes) read their writes from the database.
+        version_cache = getattr(self, '_version_cache', None) if cached and as_of is None else None
+        if version_cache is not None:
+            _version = version_cache.get(symbol)
+            if _version is not None:
+                return _version
+
         if read_preference is None:
             # We want to hit the PRIMARY if querying secondaries is disabled.  If we're allowed to query secondaries,
             # then we want to hit the secondary for metadata.  We maintain ordering of chunks vs. metadata, such that
@@ -525,8 +868,57 @@ class VersionStore(object):
         if metadata is not None and metadata.get('deleted', False) is True:
             raise NoDataFoundException("No data found for %s in library %s" % (symbol, self._arctic_lib.get_name()))
 
+        if version_cache is not None:
+            version_cache.put(symbol, _version)
         return _version
 
+    @mongo_retry
+    def _read_metadata_batch(self, symbols, as_of=None, read_preference=None):
+        """
+        Return the (not deleted) version documents of many symbols, fetched with a single query.
+        """
+        if read_preference is None:
+            read_preference = ReadPreference.PRIMARY_PREFERRED if not self._allow_secondary else ReadPreference.SECONDARY_PREFERRED
+
+        versions_coll = self._versions.with_options(read_preference=read_preference)
+
+        query = {'symbol': {'$in': list(symbols)}}
+        if as_of is None or isinstance(as_of, dt):
+            if as_of is not None:
+                # as_of refers to a datetime
+                if not as_of.tzinfo:
+                    as_of = as_of.replace(tzinfo=mktz())
+                query['_id'] = {'$lt': bson.ObjectId.from_datetime(as_of + timedelta(seconds=1))}
+            cursor = self._latest_versions(versions_coll, query)
+        elif isinstance(as_of, six.string_types):
+            # as_of is a snapshot
+            snapshot = self._snapshots.find_one({'name': as_of})
+            if not snapshot:
+                return {}
+            query['parent'] = snapshot['_id']
+            cursor = versions_coll.find(query)
+        else:
+            # Backward compatibility - as of is a version number
+            query['version'] = as_of
+            cursor = versions_coll.find(query)
+
+        # if the item has been deleted, don't return any metadata
+        return {v['symbol']: v for v in cursor
+                if not (v.get('metadata') is not None and v['metadata'].get('deleted', False) is True)}
+
+    @staticmethod
+    def _latest_versions(versions_coll, query):
+        """
+        Generator of the latest version document of each symbol matching query,
+        served by the (symbol, version) index.
+        """
+        for x in versions_coll.aggregate([
+            {'$match': query},
+            {'$sort': SON([('symbol', pymongo.ASCENDING), ('version', pymongo.DESCENDING)])},
+            {'$group': {'_id': '$symbol', 'version': {'$first': '$$ROOT'}}},
+        ], allowDiskUse=True):
+            yield x['version']
+
     def _insert_version(self, version):
         try:
             # Keep here the mongo_retry to avoid incrementing versions and polluting the DB with garbage segments,
@@ -534,11 +926,13 @@ class VersionStore(object):
             # If, however, we get a DuplicateKeyError, suppress it and raise OperationFailure, so that the method-scoped
             # mongo_retry re-tries and creates a new version, to overcome the issue.
             mongo_retry(self._versions.insert_one)(version)
+            self._invalidate_version_cache(version['symbol'])
         except DuplicateKeyError as err:
             logger.exception(err)
             raise OperationFailure("A version with the same _id exists, force a clean retry")
 
     @mongo_retry
+    @_writes_in_flight
     def append(self, symbol, data, metadata=None, prune_previous_version=True, upsert=True, **kwargs):
         """
         Append 'data' under the specified 'symbol' name to this library.
@@ -552,11 +946,17 @@ class VersionStore(object):
             to be persisted
         metadata : `dict`
             an optional dictionary of metadata to persist along with the symbol.
-        prune_previous_version : `bool`
-            Removes previous (non-snapshotted) versions from the database.
+        prune_previous_version : `bool` or 'async'
+            Removes previous (non-snapshotted) versions from the database, in the background (see wait_for_prunes)
+            if 'async' or if the library prunes asynchronously (see initialize_library's async_prune).
             Default: True
         upsert : `bool`
             Write 'data' if no previous version exists.
+        kwargs :
+            passed through to the write handler, e.g. compaction={'deferred': True} to leave the compaction
+            of the appends to compact(), rather than to the compaction policy of the library, or
+            upcast_on_read=True to keep the segments so far when the append promotes the dtype, rather than
+            rewriting them, in a version arctic versions predating it can't read
         """
         self._arctic_lib.check_quota()
         version = {'_id': bson.ObjectId()}
@@ -606,14 +1006,19 @@ class VersionStore(object):
             version['metadata'] = previous_version['metadata']
 
         if handler and hasattr(handler, 'append') and callable(handler.append):
-            handler.append(self._arctic_lib, version, symbol, data,
-                           previous_version, dirty_append=dirty_append, **kwargs)
+            kwargs = self._handler_write_kwargs(handler, kwargs)
+            # Appends are compacted as the library's policy says, unless told otherwise
+            if self._compaction and isinstance(handler, NdarrayStore) and 'compaction' not in kwargs:
+                kwargs = dict(kwargs, compaction=self._compaction)
+            # and promote the dtype as the library does
+            if self._upcast_on_read and isinstance(handler, NdarrayStore) and 'upcast_on_read' not in kwargs:
+                kwargs = dict(kwargs, upcast_on_read=True)
+            handler.append(self._arctic_lib, version, symbol, data, previous_version, dirty_append=dirty_append,
+                           **kwargs)
         else:
             raise Exception("Append not implemented for handler %s" % handler)
 
-        self._publish_change(symbol, version)
-
-        if prune_previous_version and previous_version:
+        if prune_previous_version and previous_version and not self._prunes_async(prune_previous_version):
             # Does not allow prune to remove the base of the new version
             self._prune_previous_versions(symbol, keep_version=version.get('base_version_id'),
                                           new_version_shas=version.get(FW_POINTERS_REFS_KEY))
@@ -621,16 +1026,120 @@ class VersionStore(object):
         # Insert the new version into the version DB
         version['version'] = next_ver
         self._insert_version(version)
+        self._publish_change(symbol, version)
+
+        if prune_previous_version and previous_version and self._prunes_async(prune_previous_version):
+            self._queue_prune(symbol)
 
         return VersionedItem(symbol=symbol, library=self._arctic_lib.get_name(), version=version['version'],
                              metadata=version.pop('metadata', None), data=None,
                              host=self._arctic_lib.arctic.mongo_host)
 
+    @mongo_retry
+    @_writes_in_flight
+    def compact(self, symbol, prune_previous_version=True):
+        """
+        Compact the segments appended to 'symbol' into compressed segments of the full size, in a new version,
+        as an append does once it reaches the limits of the compaction policy.
+        Appends whose compaction is deferred (see initialize_library's compaction) are left for this to do.
+
+        Parameters
+        ----------
+        symbol : `str`
+            symbol name for the item
+        prune_previous_version : `bool` or 'async'
+            Removes previous (non-snapshotted) versions from the database, in the background (see wait_for_prunes)
+            if 'async' or if the library prunes asynchronously (see initialize_library's async_prune).
+            Default: True
+
+        Returns
+        -------
+        VersionedItem named tuple containing the metadata and version number of the compacted version,
+        or of the latest version if it has no appended segments.
+        """
+        previous_version = self._versions.find_one({'symbol': symbol}, sort=[('version', pymongo.DESCENDING)])
+        if previous_version is None:
+            raise NoDataFoundException("No data found for %s in library %s" % (symbol, self._arctic_lib.get_name()))
+
+        handler = self._read_handler(previous_version, symbol)
+        if not previous_version.get('append_count') or not hasattr(handler, 'compact'):
+            return VersionedItem(symbol=symbol, library=self._arctic_lib.get_name(),
+                                 version=previous_version['version'], metadata=previous_version.get('metadata'),
+                                 data=None, host=self._arctic_lib.arctic.mongo_host)
+
+        self._arctic_lib.check_quota()
+        version = {'_id': bson.ObjectId()}
+        version['arctic_version'] = ARCTIC_VERSION_NUMERICAL
+        version['symbol'] = symbol
+        if 'metadata' in previous_version:
+            version['metadata'] = previous_version['metadata']
+        next_ver = self._version_nums.find_one_and_update({'symbol': symbol, },
+                                                          {'$inc': {'version': 1}},
+                                                          upsert=False, new=True)['version']
+
+        handler.compact(self._arctic_lib, version, symbol, previous_version,
+                        **self._handler_write_kwargs(handler, {}))
+
+        if prune_previous_version and not self._prunes_async(prune_previous_version):
+            self._prune_previous_versions(symbol, new_version_shas=version.get(FW_POINTERS_REFS_KEY))
+
+        version['version'] = next_ver
+        self._insert_version(version)
+        self._publish_change(symbol, version)
+
+        if prune_previous_version and self._prunes_async(prune_previous_version):
+            self._queue_prune(symbol)
+
+        return VersionedItem(symbol=symbol, library=self._arctic_lib.get_name(), version=version['version'],
+                             metadata=version.pop('metadata', None), data=None,
+                             host=self._arctic_lib.arctic.mongo_host)
+
+    def compact_all(self, symbols=None, min_append_count=1, max_bytes_per_sec=None, prune_previous_version=True):
+        """
+        Compact (see compact()) the symbols whose latest version has at least min_append_count appended segments,
+        at no more than max_bytes_per_sec of data rewritten (and read back) on average.
+
+        Parameters
+        ----------
+        symbols : `list` of `str`
+            the symbols to look at, all of them by default
+        min_append_count : `int`
+            the number of appended segments from which a symbol is compacted
+        max_bytes_per_sec : `int`
+            the rate limit of the compaction, unlimited by default
+        prune_previous_version : `bool` or 'async'
+            Removes previous (non-snapshotted) versions from the database, in the background (see wait_for_prunes)
+            if 'async' or if the library prunes asynchronously (see initialize_library's async_prune).
+            Default: True
+
+        Returns
+        -------
+        `list` of the symbols compacted
+        """
+        query = {'symbol': {'$in': list(symbols)}} if symbols is not None else {}
+        to_compact = [(x['symbol'], x.get('append_size', 0)) for x in self._latest_versions(self._versions, query)
+                      if x.get('append_count', 0) >= max(min_append_count, 1)
+                      and not (x.get('metadata') or {}).get('deleted')]
+        logger.info("Compacting %d symbols in %s" % (len(to_compact), self._arctic_lib.get_name()))
+
+        start = time.time()
+        compacted = 0
+        rtn = []
+        for symbol, append_size in sorted(to_compact):
+            self.compact(symbol, prune_previous_version=prune_previous_version)
+            rtn.append(symbol)
+            if max_bytes_per_sec:
+                # the appends are rewritten along with the last compressed segment
+                compacted += append_size + _CHUNK_SIZE
+                time.sleep(max(0, compacted / float(max_bytes_per_sec) - (time.time() - start)))
+        return rtn
+
     def _publish_change(self, symbol, version):
         if self._publish_changes:
             mongo_retry(self._changes.insert_one)(version)
 
     @mongo_retry
+    @_writes_in_flight
     def write(self, symbol, data, metadata=None, prune_previous_version=True, **kwargs):
         """
         Write 'data' under the specified 'symbol' name to this library.
@@ -644,11 +1153,15 @@ class VersionStore(object):
         metadata : `dict`
             an optional dictionary of metadata to persist along with the symbol.
             Default: None
-        prune_previous_version : `bool`
-            Removes previous (non-snapshotted) versions from the database.
+        prune_previous_version : `bool` or 'async'
+            Removes previous (non-snapshotted) versions from the database, in the background (see wait_for_prunes)
+            if 'async' or if the library prunes asynchronously (see initialize_library's async_prune).
             Default: True
         kwargs :
-            passed through to the write handler
+            passed through to the write handler, e.g. layout='columnar' to store the segments of a DataFrame
+            column by column, rather than in the layout of the library, segment_stats=True to keep the
+            statistics of the numeric columns of each segment, for reads with a where filter, or block_rows=N
+            to compress the segments N rows at a time, for date range reads decompressing only the blocks they need
 
         Returns
         -------
@@ -668,15 +1181,19 @@ class VersionStore(object):
                                                    sort=[('version', pymongo.DESCENDING)])
 
         handler = self._write_handler(version, symbol, data, **kwargs)
-        handler.write(self._arctic_lib, version, symbol, data, previous_version, **kwargs)
+        handler.write(self._arctic_lib, version, symbol, data, previous_version,
+                      **self._handler_write_kwargs(handler, kwargs))
 
-        if prune_previous_version and previous_version:
+        if prune_previous_version and previous_version and not self._prunes_async(prune_previous_version):
             self._prune_previous_versions(symbol, new_version_shas=version.get(FW_POINTERS_REFS_KEY))
 
-        self._publish_change(symbol, version)
-
         # Insert the new version into the version DB
         self._insert_version(version)
+        # and publish it once it can be read, for the version caches not to pick up the previous one again
+        self._publish_change(symbol, version)
+
+        if prune_previous_version and previous_version and self._prunes_async(prune_previous_version):
+            self._queue_prune(symbol)
 
         logger.debug('Finished writing versions for %s', symbol)
 
@@ -684,6 +1201,119 @@ class VersionStore(object):
                              metadata=version.pop('metadata', None), data=None,
                              host=self._arctic_lib.arctic.mongo_host)
 
+    @_writes_in_flight
+    def write_batch(self, items, metadata=None, prune_previous_version=True):
+        """
+        Write many symbols to this library at once.
+        The version numbers are reserved, the previous versions looked up, and the segments
+        and version documents written for all the symbols with a handful of bulk operations,
+        rather than a few round trips per symbol.
+        Symbols which can't be written in the batch (e.g. on a concurrent write) are retried with write().
+
+        Parameters
+        ----------
+        items : `dict`
+            symbol name -> data to be persisted
+        metadata : `dict`
+            an optional dictionary of symbol name -> metadata to persist along with each symbol.
+            Default: None
+        prune_previous_version : `bool` or 'async'
+            Removes previous (non-snapshotted) versions from the database, in the background (see wait_for_prunes)
+            if 'async' or if the library prunes asynchronously (see initialize_library's async_prune).
+            Default: True
+
+        Returns
+        -------
+        `dict` of symbol name -> VersionedItem named tuple containing the metadata and version number
+        of the written symbol in the store, or the exception raised when writing the symbol.
+        """
+        self._arctic_lib.check_quota()
+        metadata = metadata or {}
+        symbols = list(items)
+        rtn = {}
+        if not symbols:
+            return rtn
+
+        # Reserve a version number for each of the symbols
+        self._version_nums.bulk_write([pymongo.UpdateOne({'symbol': symbol}, {'$inc': {'version': 1}}, upsert=True)
+                                       for symbol in symbols], ordered=False)
+        version_nums = {x['symbol']: x['version'] for x in self._version_nums.find({'symbol': {'$in': symbols}})}
+        previous_versions = {x['symbol']: x for x in
+                             self._latest_versions(self._versions, {'symbol': {'$in': symbols}})}
+
+        batch = _WriteBatch(self._collection, [s for s in symbols if s in previous_versions])
+        versions = {}
+        retry = set()
+        for symbol in symbols:
+            version = {'_id': bson.ObjectId()}
+            version['arctic_version'] = ARCTIC_VERSION_NUMERICAL
+            version['symbol'] = symbol
+            version['version'] = version_nums[symbol]
+            version['metadata'] = metadata.get(symbol)
+
+            previous_version = previous_versions.get(symbol)
+            if previous_version is not None and previous_version['version'] >= version['version']:
+                # Another process has written this symbol in the meantime
+                retry.add(symbol)
+                continue
+
+            try:
+                handler = self._write_handler(version, symbol, items[symbol])
+                kwargs = {'batch': batch} if isinstance(handler, NdarrayStore) else {}
+                handler.write(self._arctic_lib, version, symbol, items[symbol], previous_version,
+                              **self._handler_write_kwargs(handler, kwargs))
+                versions[symbol] = version
+            except Exception as e:
+                rtn[symbol] = e
+
+        for symbol, e in six.iteritems(batch.execute()):
+            rtn[symbol] = e
+            del versions[symbol]
+
+        if prune_previous_version and not self._prunes_async(prune_previous_version):
+            for symbol in [s for s in versions if s in previous_versions]:
+                try:
+                    self._prune_previous_versions(symbol, new_version_shas=versions[symbol].get(FW_POINTERS_REFS_KEY))
+                except Exception as e:
+                    rtn[symbol] = e
+                    del versions[symbol]
+
+        if versions:
+            new_versions = list(versions.values())
+
+            # Insert the new versions into the version DB
+            try:
+                self._versions.insert_many(new_versions, ordered=False)
+            except BulkWriteError as e:
+                for error in e.details['writeErrors']:
+                    symbol = new_versions[error['index']]['symbol']
+                    del versions[symbol]
+                    if error['code'] == _DUPLICATE_KEY_ERROR:
+                        retry.add(symbol)
+                    else:
+                        rtn[symbol] = OperationFailure(error['errmsg'], error['code'])
+            if self._publish_changes and versions:
+                mongo_retry(self._changes.insert_many)(list(versions.values()))
+
+        for symbol, version in six.iteritems(versions):
+            self._invalidate_version_cache(symbol)
+            if prune_previous_version and symbol in previous_versions and self._prunes_async(prune_previous_version):
+                self._queue_prune(symbol)
+            rtn[symbol] = VersionedItem(symbol=symbol, library=self._arctic_lib.get_name(), version=version['version'],
+                                        metadata=version.pop('metadata', None), data=None,
+                                        host=self._arctic_lib.arctic.mongo_host)
+
+        for symbol in retry:
+            try:
+                rtn[symbol] = self.write(symbol, items[symbol], metadata=metadata.get(symbol),
+                                         prune_previous_version=prune_previous_version)
+            except Exception as e:
+                rtn[symbol] = e
+
+        logger.debug('Finished writing versions for %d symbols', len(symbols))
+        return rtn
+
+    @_writes_in_flight
     def _add_new_version_using_reference(self, symbol, new_version, reference_version, prune_previous_version):
         # Attention: better not use this method following an append.
         # It is dangerous because if it deletes the version at the last_look, the segments added by the
@@ -713,13 +1343,17 @@ class VersionStore(object):
         if last_look is None or last_look.get('deleted'):
             # Revert the change
             mongo_retry(self._versions.delete_one)({'_id': new_version['_id']})
+            self._invalidate_version_cache(symbol)
             # Indicate the failure
             raise OperationFailure("Failed to write metadata for symbol %s. "
                                    "The previous version (%s, %d) has been removed during the update" %
                                    (symbol, str(reference_version['_id']), reference_version['version']))
 
         if prune_previous_version and reference_version:
-            self._prune_previous_versions(symbol, new_version_shas=new_version.get(FW_POINTERS_REFS_KEY))
+            if self._prunes_async(prune_previous_version):
+                self._queue_prune(symbol)
+            else:
+                self._prune_previous_versions(symbol, new_version_shas=new_version.get(FW_POINTERS_REFS_KEY))
 
         logger.debug('Finished updating versions with new metadata for %s', symbol)
 
@@ -745,8 +1379,9 @@ class VersionStore(object):
             symbol name for the item
         metadata : `dict` or `None`
             dictionary of metadata to persist along with the symbol
-        prune_previous_version : `bool`
-            Removes previous (non-snapshotted) versions from the database.
+        prune_previous_version : `bool` or 'async'
+            Removes previous (non-snapshotted) versions from the database, in the background (see wait_for_prunes)
+            if 'async' or if the library prunes asynchronously (see initialize_library's async_prune).
             Default: True
         kwargs :
             passed through to the write handler (only used if symbol does not already exist or is deleted)
@@ -758,6 +1393,8 @@ class VersionStore(object):
         """
         # Make a normal write with empty data and supplied metadata if symbol does not exist
         try:
+            # The new version is based on the latest version in the database, not on a cached one
+            self._invalidate_version_cache(symbol)
             previous_version = self._read_metadata(symbol)
         except NoDataFoundException:
             return self.write(symbol, data=None, metadata=metadata,
@@ -793,8 +1430,9 @@ class VersionStore(object):
             `int` : specific version number
             `str` : snapshot name which contains the version
             `datetime.datetime` : the version of the data that existed as_of the requested point in time
-        prune_previous_version : `bool`
-            Removes previous (non-snapshotted) versions from the database.
+        prune_previous_version : `bool` or 'async'
+            Removes previous (non-snapshotted) versions from the database, in the background (see wait_for_prunes)
+            if 'async' or if the library prunes asynchronously (see initialize_library's async_prune).
             Default: True
 
         Returns
@@ -826,6 +1464,76 @@ class VersionStore(object):
                               data=item.data, metadata=item.metadata, prune_previous_version=prune_previous_version)
         return new_item
 
+    def _prunes_async(self, prune_previous_version):
+        # The background pruner prunes the previous versions once the new version is inserted, which protects
+        # its base and segments from the prune
+        return prune_previous_version == 'async' or (bool(prune_previous_version) and self._async_prune)
+
+    @contextmanager
+    def _writing(self, symbols):
+        with self._writes_lock:
+            for symbol in symbols:
+                self._writes[symbol] = self._writes.get(symbol, 0) + 1
+        try:
+            yield
+        finally:
+            with self._writes_lock:
+                for symbol in symbols:
+                    self._writes[symbol] -= 1
+                    if not self._writes[symbol]:
+                        del self._writes[symbol]
+
+    def _prune_queued(self, symbols):
+        # The segments of the versions pruned may be those of a version being written, not inserted yet: the
+        # symbols being written are left to be pruned once they're not
+        with self._writes_lock:
+            writing = [symbol for symbol in symbols if symbol in self._writes]
+        idle = [symbol for symbol in symbols if symbol not in writing]
+        if idle:
+            self.prune_all(symbols=idle)
+        return writing
+
+    def _queue_prune(self, symbol):
+        if self._pruner is None:
+            # The pruner's thread only holds a weak reference to the store, and stops once it's garbage collected
+            store = weakref.ref(self)
+
+            def prune(symbols):
+                rtn = store()
+                return rtn._prune_queued(symbols) if rtn is not None else []
+            self._pruner = Pruner(prune, interval=ARCTIC_ASYNC_PRUNE_INTERVAL)
+            self._pruner.close_with(self)
+        self._pruner.submit(symbol)
+
+    def close_pruner(self, wait=True):
+        """
+        Stop the background pruner, once the prune in progress, if any, is done. The symbols still queued are left
+        for later prunes. Writes pruning asynchronously start it again.
+
+        Parameters
+        ----------
+        wait : `bool`
+            whether to wait for the prune in progress
+        """
+        if self._pruner is not None:
+            self._pruner.close(wait)
+
+    def wait_for_prunes(self, timeout=None):
+        """
+        Wait for the background pruner to prune the previous versions of the symbols written with
+        prune_previous_version='async' (or to a library pruning asynchronously).
+
+        Parameters
+        ----------
+        timeout : `float`
+            seconds to wait for at most, forever by default
+
+        Returns
+        -------
+        `bool` whether all the prunes queued are done
+        """
+        return self._pruner.wait(timeout) if self._pruner is not None else True
+
     @mongo_retry
     def _find_prunable_version_ids(self, symbol, keep_mins):
         """
@@ -836,18 +1544,8 @@ class VersionStore(object):
         """
         read_preference = ReadPreference.SECONDARY_PREFERRED if keep_mins > 0 else ReadPreference.PRIMARY
         versions = self._versions.with_options(read_preference=read_preference)
-        query = {'symbol': symbol,
-                 # Not snapshotted
-                 '$or': [{'parent': {'$exists': False}}, {'parent': []}],
-                 # At least 'keep_mins' old
-                 '_id': {'$lt': bson.ObjectId.from_datetime(dt.utcnow()
-                                                            # Add one second as the ObjectId
-                                                            # str has random fuzz
-                                                            + timedelta(seconds=1)
-                                                            - timedelta(minutes=keep_mins)
-                                                            )
-                         }
-                 }
+        query = VersionStore._prunable_versions_query(keep_mins)
+        query['symbol'] = symbol
         cursor = versions.find(query,
                                # Using version number here instead of _id as there's a very unlikely case
                                # where the versions are created on different hosts or processes at exactly
@@ -860,6 +1558,21 @@ class VersionStore(object):
         return {v['_id']: ([bson.binary.Binary(x) for x in v.get(FW_POINTERS_REFS_KEY, [])], get_fwptr_config(v))
                 for v in cursor}
 
+    @staticmethod
+    def _prunable_versions_query(keep_mins):
+        return {
+            # Not snapshotted
+            '$or': [{'parent': {'$exists': False}}, {'parent': []}],
+            # At least 'keep_mins' old
+            '_id': {'$lt': bson.ObjectId.from_datetime(dt.utcnow()
+                                                       # Add one second as the ObjectId
+                                                       # str has random fuzz
+                                                       + timedelta(seconds=1)
+                                                       - timedelta(minutes=keep_mins)
+                                                       )
+                    }
+        }
+
     @mongo_retry
     def _find_base_version_ids(self, symbol, version_ids):
         """
@@ -906,6 +1619,108 @@ class VersionStore(object):
                              shas_to_delete=shas_to_delete,
                              pointers_cfgs=[v[1] for v in prunable_ids_to_shas.values()])
 
+    @mongo_retry
+    def _find_all_prunable_version_ids(self, keep_mins, symbols=None):
+        """
+        _find_prunable_version_ids of all the symbols (or of the given symbols), less the versions that are the base
+        of a version kept, with a single aggregation grouping the versions by symbol.
+        """
+        read_preference = ReadPreference.SECONDARY_PREFERRED if keep_mins > 0 else ReadPreference.PRIMARY
+        versions = self._versions.with_options(read_preference=read_preference)
+        prunable = VersionStore._prunable_versions_query(keep_mins)
+        pipeline = [{'$match': {'symbol': {'$in': list(symbols)}}}] if symbols is not None else []
+        pipeline.extend([
+            {'$sort': {'symbol': pymongo.ASCENDING, 'version': pymongo.DESCENDING}},
+            {'$group': {
+                '_id': '$symbol',
+                'versions': {'$push': {
+                    '_id': '$_id',
+                    'base_version_id': '$base_version_id',
+                    FW_POINTERS_REFS_KEY: '$' + FW_POINTERS_REFS_KEY,
+                    FW_POINTERS_CONFIG_KEY: '$' + FW_POINTERS_CONFIG_KEY,
+                    # The aggregation expression of _prunable_versions_query
+                    'prunable': {'$and': [{'$eq': [{'$ifNull': ['$parent', []]}, []]},
+                                          {'$lt': ['$_id', prunable['_id']['$lt']]}]},
+                }},
+            }},
+            {'$project': {
+                'versions': True,
+                'candidates': {'$filter': {'input': '$versions', 'as': 'v', 'cond': '$$v.prunable'}},
+            }},
+            {'$project': {
+                # Guarantees at least one version is kept: the most recent candidate
+                'prunable': {'$slice': ['$candidates', 1, {'$max': [1, {'$size': '$candidates'}]}]},
+                # The bases of the versions kept
+                'base_version_ids': {'$setUnion': [
+                    {'$map': {'input': {'$filter': {'input': '$versions', 'as': 'v', 'cond': {'$not': ['$$v.prunable']}}},
+                              'as': 'v',
+                              'in': '$$v.base_version_id'}},
+                    [{'$let': {'vars': {'kept': {'$arrayElemAt': ['$candidates', 0]}},
+                               'in': '$$kept.base_version_id'}}],
+                ]},
+            }},
+            {'$match': {'prunable': {'$ne': []}}},
+        ])
+        rtn = {}
+        # We may hit the group memory limit (100MB), so use allowDiskUse to circumvent this
+        for x in versions.aggregate(pipeline, allowDiskUse=True):
+            base_version_ids = set(x['base_version_ids'])
+            ids_to_shas = {v['_id']: ([bson.binary.Binary(s) for s in v.get(FW_POINTERS_REFS_KEY, [])],
+                                      get_fwptr_config(v))
+                           for v in x['prunable'] if v['_id'] not in base_version_ids}
+            if ids_to_shas:
+                rtn[x['_id']] = ids_to_shas
+        return rtn
+
+    def prune_all(self, keep_mins=120, symbols=None, workers=1):
+        """
+        Prune the versions of all the symbols of the library (or of the given symbols) not pointed at by snapshots
+        and at least keep_mins old, like _prune_previous_versions does for a symbol. Prune will never remove all
+        the versions of a symbol.
+
+        The prunable versions of all the symbols are found with one aggregation, their documents deleted in batches
+        of ids and the segments they leave unreferenced cleaned up symbol by symbol, across a pool of workers threads.
+
+        Parameters
+        ----------
+        keep_mins : `int`
+            the age, in minutes, of the most recent version kept
+        symbols : `list` of `str`
+            the symbols to prune, all of them by default
+        workers : `int`
+            the number of threads deleting the versions and their segments, 1 meaning serially
+
+        Returns
+        -------
+        `int` the number of versions pruned
+        """
+        to_prune = self._find_all_prunable_version_ids(keep_mins, symbols)
+        version_ids = [i for ids in to_prune.values() for i in ids]
+        logger.info("Pruning %d versions of %d symbols in %s" % (len(version_ids), len(to_prune),
+                                                                 self._arctic_lib.get_name()))
+
+        def delete_versions(batch):
+            mongo_retry(self._versions.delete_many)({'_id': {'$in': batch}})
+
+        def cleanup_symbol(symbol):
+            ids_to_shas = to_prune[symbol]
+            mongo_retry(cleanup)(self._arctic_lib, symbol, list(ids_to_shas), self._versions,
+                                 shas_to_delete=[sha for v in ids_to_shas.values() for sha in v[0]],
+                                 pointers_cfgs=[v[1] for v in ids_to_shas.values()])
+
+        pool = ThreadPool(workers) if workers > 1 else None
+        try:
+            run = pool.map if pool else lambda f, args: [f(x) for x in args]
+            # The version documents go first: the segments are cleaned up from the versions left
+            run(delete_versions, [version_ids[i:i + _PRUNE_BATCH_SIZE]
+                                  for i in range(0, len(version_ids), _PRUNE_BATCH_SIZE)])
+            run(cleanup_symbol, sorted(to_prune))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        return len(version_ids)
+
     @mongo_retry
     def _delete_version(self, symbol, version_num, do_cleanup=True):
         """
@@ -925,6 +1740,7 @@ class VersionStore(object):
                                                                                     snap_name))
                 return
         self._versions.delete_one({'_id': version['_id']})
+        self._invalidate_version_cache(symbol)
         # TODO: for FW pointers, if the above statement fails, they we have no way to delete the orphaned segments.
         #       This would be possible only via FSCK, or by moving the above statement at the end of this method,
         #       but with the risk of failing to delelte the version catastrophically, and ending up with a corrupted v.
@@ -2,7 +2,11 @@ from __future__ import print_function
 
 import copy
 import logging
+import numbers
+import threading
+from collections import OrderedDict, deque
 from datetime import datetime as dt, timedelta
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 import pandas as pd
@@ -90,6 +94,21 @@ META = 'md'
 
 CHUNK_VERSION_NUMBER = 3
 
+_BUCKETS_AHEAD = 4  # buckets fetched per worker while their row masks are being decoded
+
+# Thread pools decoding the buckets, by number of workers, shared by the reads of the process
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(workers):
+    if workers <= 1:
+        return None
+    with _pools_lock:
+        if workers not in _pools:
+            _pools[workers] = ThreadPool(workers)
+        return _pools[workers]
+
 
 class TickStore(object):
 
@@ -257,7 +276,7 @@ class TickStore(object):
         return ReadPreference.NEAREST if allow_secondary else ReadPreference.PRIMARY
 
     def read(self, symbol, date_range=None, columns=None, include_images=False, allow_secondary=None,
-             _target_tick_count=0):
+             workers=1, _target_tick_count=0):
         """
         Read data for the named symbol.  Returns a VersionedItem object with
         a data and metdata element (as passed into write).
@@ -277,18 +296,105 @@ class TickStore(object):
             `None` : use the settings from the top-level `Arctic` object used to query this version store.
             `True` : allow reads from secondary members
             `False` : only allow reads from primary members
+        workers : `int`
+            Number of threads decoding the buckets, 1 meaning serially. The thread pools are shared by the reads
+            of the process asking for the same number of workers.
 
         Returns
         -------
         pandas.DataFrame of data
         """
         perf_start = dt.now()
-        rtn = {}
-        column_set = set()
 
         multiple_symbols = not isinstance(symbol, string_types)
 
         date_range = to_pandas_closed_closed(date_range)
+        query, projection = self._read_query(symbol, date_range, columns)
+
+        # First the buckets and the rows read from each, known from their row masks, before decoding any data: the
+        # columns are sized and typed from all of them. The masks are decoded by the pool while the cursor is read.
+        buckets = []
+        ticks_read = 0
+        pool = _get_pool(workers)
+        data_coll = self._collection.with_options(read_preference=self._read_preference(allow_secondary))
+        cursor = data_coll.find(query, projection=projection).sort([(START, pymongo.ASCENDING)],)
+        for b, union_mask, masks, image in self._read_bucket_rows(cursor, include_images, pool, workers):
+            buckets.append((b, union_mask, masks, image, ticks_read))
+            ticks_read += np.count_nonzero(union_mask) + (image is not None)
+            # For testing
+            if _target_tick_count and ticks_read > _target_tick_count:
+                break
+
+        if not buckets:
+            raise NoDataFoundException("No Data found for {} in range: {}".format(symbol, date_range))
+        return self._buckets_to_dataframe(buckets, ticks_read, columns, multiple_symbols, date_range, pool,
+                                          perf_start)
+
+    def iterator(self, symbol, date_range=None, columns=None, include_images=False, allow_secondary=None,
+                 rows_per_batch=100000, workers=1):
+        """
+        Iterate over the data of the named symbol, a group of buckets at a time, rather than reading it all
+        into memory at once.
+
+        Parameters
+        ----------
+        symbol : `str`
+            symbol name for the item
+        date_range : `date.DateRange`
+            Returns ticks in the specified DateRange
+        columns : `list` of `str`
+            Columns (fields) to return from the tickstore, by default the ones found in each group of buckets
+        include_images : `bool`
+            Should images (/snapshots) be included in the read, before the ticks of their buckets as in read
+        allow_secondary : `bool` or `None`
+            Override the default behavior for allowing reads from secondary members of a cluster:
+            `None` : use the settings from the top-level `Arctic` object used to query this version store.
+            `True` : allow reads from secondary members
+            `False` : only allow reads from primary members
+        rows_per_batch : `int`
+            Number of rows from which a group of consecutive buckets is read. The buckets being read whole,
+            groups are usually a bit larger.
+        workers : `int`
+            Number of threads decoding the buckets of each group, 1 meaning serially
+
+        Returns
+        -------
+        Generator of pandas.DataFrame of data, in time order
+        """
+        if not isinstance(symbol, string_types):
+            raise ValueError("Can only iterate over the data of a single symbol: {}".format(symbol))
+        if rows_per_batch < 1:
+            raise ValueError("rows_per_batch must be positive: {}".format(rows_per_batch))
+
+        date_range = to_pandas_closed_closed(date_range)
+        query, projection = self._read_query(symbol, date_range, columns)
+
+        buckets = []
+        ticks_read = 0
+        found = False
+        pool = _get_pool(workers)
+        data_coll = self._collection.with_options(read_preference=self._read_preference(allow_secondary))
+        cursor = data_coll.find(query, projection=projection).sort([(START, pymongo.ASCENDING)],)
+        for b, union_mask, masks, image in self._read_bucket_rows(cursor, include_images, pool, workers):
+            found = True
+            buckets.append((b, union_mask, masks, image, ticks_read))
+            ticks_read += np.count_nonzero(union_mask) + (image is not None)
+            if ticks_read >= rows_per_batch:
+                rtn = self._buckets_to_dataframe(buckets, ticks_read, columns, False, date_range, pool)
+                buckets = []
+                ticks_read = 0
+                # The buckets at the ends of date_range may have no ticks in it
+                if len(rtn):
+                    yield rtn
+
+        if not found:
+            raise NoDataFoundException("No Data found for {} in range: {}".format(symbol, date_range))
+        if buckets:
+            rtn = self._buckets_to_dataframe(buckets, ticks_read, columns, False, date_range, pool)
+            if len(rtn):
+                yield rtn
+
+    def _read_query(self, symbol, date_range, columns):
         query = self._symbol_query(symbol)
         query.update(self._mongo_date_range_query(symbol, date_range))
 
@@ -297,46 +403,34 @@ class TickStore(object):
                                (INDEX, 1),
                                (START, 1),
                                (VERSION, 1),
+                               (COUNT, 1),
                                (IMAGE_DOC, 1)] +
                               [(COLUMNS + '.%s' % c, 1) for c in columns])
-            column_set.update([c for c in columns if c != 'SYMBOL'])
         else:
             projection = dict([(SYMBOL, 1),
                                (INDEX, 1),
                                (START, 1),
                                (VERSION, 1),
+                               (COUNT, 1),
                                (COLUMNS, 1),
                                (IMAGE_DOC, 1)])
+        return query, projection
 
-        column_dtypes = {}
-        ticks_read = 0
-        data_coll = self._collection.with_options(read_preference=self._read_preference(allow_secondary))
-        for b in data_coll.find(query, projection=projection).sort([(START, pymongo.ASCENDING)],):
-            data = self._read_bucket(b, column_set, column_dtypes,
-                                     multiple_symbols or (columns is not None and 'SYMBOL' in columns),
-                                     include_images, columns)
-            for k, v in iteritems(data):
-                try:
-                    rtn[k].append(v)
-                except KeyError:
-                    rtn[k] = [v]
-            # For testing
-            ticks_read += len(data[INDEX])
-            if _target_tick_count and ticks_read > _target_tick_count:
-                break
-
-        if not rtn:
-            raise NoDataFoundException("No Data found for {} in range: {}".format(symbol, date_range))
-        rtn = self._pad_and_fix_dtypes(rtn, column_dtypes)
+    def _buckets_to_dataframe(self, buckets, length, columns, multiple_symbols, date_range, pool=None,
+                              perf_start=None):
+        perf_start = perf_start or dt.now()
+        # The buckets decoded straight into their rows of the columns
+        include_symbol = multiple_symbols or (columns is not None and 'SYMBOL' in columns)
+        names, rtn = self._read_buckets(buckets, length, columns, include_symbol, pool)
 
-        index = pd.to_datetime(np.concatenate(rtn[INDEX]), utc=True, unit='ms')
+        index = pd.to_datetime(rtn[INDEX], utc=True, unit='ms')
         if columns is None:
-            columns = [x for x in rtn.keys() if x not in (INDEX, 'SYMBOL')]
+            columns = names
         if multiple_symbols and 'SYMBOL' not in columns:
             columns = ['SYMBOL', ] + columns
 
         if len(index) > 0:
-            arrays = [np.concatenate(rtn[k]) for k in columns]
+            arrays = [rtn[k] for k in columns]
         else:
             arrays = [[] for _ in columns]
 
@@ -379,116 +473,140 @@ class TickStore(object):
         """
         return self._metadata.find_one({SYMBOL: symbol})[META]
 
-    def _pad_and_fix_dtypes(self, cols, column_dtypes):
-        # Pad out Nones with empty arrays of appropriate dtypes
-        rtn = {}
-        index = cols[INDEX]
-        full_length = len(index)
-        for k, v in iteritems(cols):
-            if k != INDEX and k != 'SYMBOL':
-                col_len = len(v)
-                if col_len < full_length:
-                    v = ([None, ] * (full_length - col_len)) + v
-                    assert len(v) == full_length
-                for i, arr in enumerate(v):
-                    if arr is None:
-                        #  Replace Nones with appropriate-length empty arrays
-                        v[i] = self._empty(len(index[i]), column_dtypes.get(k))
-                    else:
-                        # Promote to appropriate dtype only if we can safely cast all the values
-                        # This avoids the case with strings where None is cast as 'None'.
-                        # Casting the object to a string is not worthwhile anyway as Pandas changes the
-                        # dtype back to objectS
-                        if (i == 0 or v[i].dtype != v[i - 1].dtype) and np.can_cast(v[i].dtype, column_dtypes[k],
-                                                                                    casting='safe'):
-                            v[i] = v[i].astype(column_dtypes[k], casting='safe')
-
-            rtn[k] = v
-        return rtn
+    @staticmethod
+    def _read_mask(rowmask, length):
+        # unpackbits makes a copy of the read-only array created by frombuffer, of 0s and 1s viewed as booleans
+        return np.unpackbits(np.frombuffer(lz4_decompress(rowmask), dtype='uint8'))[:length].view('bool')
 
-    def _set_or_promote_dtype(self, column_dtypes, c, dtype):
-        existing_dtype = column_dtypes.get(c)
-        if existing_dtype is None or existing_dtype != dtype:
-            # Promote ints to floats - as we can't easily represent NaNs
-            if np.issubdtype(dtype, int):
-                dtype = np.dtype('f8')
-            column_dtypes[c] = np.promote_types(column_dtypes.get(c, dtype), dtype)
-
-    def _prepend_image(self, document, im, rtn_length, column_dtypes, column_set, columns):
-        image = im[IMAGE]
-        first_dt = im[IMAGE_TIME]
-        if not first_dt.tzinfo:
-            first_dt = first_dt.replace(tzinfo=mktz('UTC'))
-        document[INDEX] = np.insert(document[INDEX], 0, np.uint64(datetime_to_ms(first_dt)))
-        for field in image:
-            if field == INDEX:
-                continue
-            if columns and field not in columns:
-                continue
-            if field not in document or document[field] is None:
-                col_dtype = np.dtype(str if isinstance(image[field], string_types) else 'f8')
-                document[field] = self._empty(rtn_length, dtype=col_dtype)
-                column_dtypes[field] = col_dtype
-                column_set.add(field)
-            val = image[field]
-            document[field] = np.insert(document[field], 0, document[field].dtype.type(val))
-        # Now insert rows for fields in document that are not in the image
-        for field in set(document).difference(set(image)):
-            if field == INDEX:
-                continue
-            logger.debug("Field %s is missing from image!" % field)
-            if document[field] is not None:
-                val = np.nan
-                document[field] = np.insert(document[field], 0, document[field].dtype.type(val))
-        return document
-
-    def _read_bucket(self, doc, column_set, column_dtypes, include_symbol, include_images, columns):
-        rtn = {}
+    def _bucket_rows(self, doc, include_images):
+        """
+        The rows read from a bucket: the mask of its ticks with a value in any of the columns read (the union of
+        their row masks, the bucket's COUNT sparing decompressing its index), the masks of the columns with gaps
+        in these rows, kept to decode the columns without decompressing them again, and its image document
+        if prepended.
+        """
         if doc[VERSION] != 3:
             raise ArcticException("Unhandled document version: %s" % doc[VERSION])
-        # np.cumsum copies the read-only array created with frombuffer
-        rtn[INDEX] = np.cumsum(np.frombuffer(lz4_decompress(doc[INDEX]), dtype='uint64'))
-        doc_length = len(rtn[INDEX])
-        column_set.update(doc[COLUMNS].keys())
-
-        # get the mask for the columns we're about to load
-        union_mask = np.zeros((doc_length + 7) // 8, dtype='uint8')
-        for c in column_set:
-            try:
-                coldata = doc[COLUMNS][c]
-                # the or below will make a copy of this read-only array
-                mask = np.frombuffer(lz4_decompress(coldata[ROWMASK]), dtype='uint8')
-                union_mask = union_mask | mask
-            except KeyError:
-                rtn[c] = None
-        union_mask = np.unpackbits(union_mask)[:doc_length].astype('bool')
-        rtn_length = np.sum(union_mask)
-
-        rtn[INDEX] = rtn[INDEX][union_mask]
-        if include_symbol:
-            rtn['SYMBOL'] = [doc[SYMBOL], ] * rtn_length
+        doc_length = doc[COUNT] if COUNT in doc else len(lz4_decompress(doc[INDEX])) // 8
+        masks = dict((c, self._read_mask(coldata[ROWMASK], doc_length)) for c, coldata in iteritems(doc[COLUMNS]))
+        union_mask = np.zeros(doc_length, dtype='bool')
+        for mask in masks.values():
+            union_mask |= mask
+        length = np.count_nonzero(union_mask)
+        masks = dict((c, mask) for c, mask in iteritems(masks) if np.count_nonzero(mask) != length)
+        image = doc[IMAGE_DOC] if include_images and doc.get(IMAGE_DOC, {}).get(IMAGE, {}) else None
+        return union_mask, masks, image
+
+    def _read_bucket_rows(self, cursor, include_images, pool=None, workers=1):
+        """
+        Generator of the buckets of cursor with the rows read from them (see _bucket_rows), in order. With a pool,
+        the row masks are decoded across its threads while the next buckets are fetched, up to _BUCKETS_AHEAD
+        buckets per worker ahead of the ones returned.
+        """
+        if pool is None:
+            for doc in cursor:
+                yield (doc,) + self._bucket_rows(doc, include_images)
+            return
+        pending = deque()
+        for doc in cursor:
+            pending.append((doc, pool.apply_async(self._bucket_rows, (doc, include_images))))
+            while pending and (pending[0][1].ready() or len(pending) > _BUCKETS_AHEAD * workers):
+                ready, rows = pending.popleft()
+                yield (ready,) + rows.get()
+        for doc, rows in pending:
+            yield (doc,) + rows.get()
 
-        # Unpack each requested column in turn
-        for c in column_set:
-            try:
-                coldata = doc[COLUMNS][c]
+    @staticmethod
+    def _image_fields(image, columns):
+        # The image's own time is the time of its row
+        return dict((field, val) for field, val in iteritems(image[IMAGE])
+                    if field not in (INDEX, 'index') and (not columns or field in columns))
+
+    def _read_buckets(self, buckets, length, columns, include_symbol, pool=None):
+        """
+        Decode the buckets (with the rows read from them, see _bucket_rows, and their offsets) straight into
+        columns of length rows, preallocated with their final dtypes: float64 for numbers (ints, uints and
+        floats), object for anything else (strings, holding None in their gaps, booleans, bytes, non-numeric
+        image values) and for the columns requested but not found.
+        The buckets are decoded across the threads of pool, if any.
+
+        Returns the names of the columns, in the order they're found, and the dict of the columns by name.
+        """
+        names = [c for c in columns if c != 'SYMBOL'] if columns else []
+        found = set(names)
+        kinds = {}  # dtype kinds of the values, by column
+        for doc, union_mask, masks, image, _ in buckets:
+            image_fields = self._image_fields(image, columns) if image is not None else {}
+            for c in list(doc[COLUMNS]) + list(image_fields):
+                if c not in found:
+                    found.add(c)
+                    names.append(c)
+            for c, coldata in iteritems(doc[COLUMNS]):
                 dtype = np.dtype(coldata[DTYPE])
-                # values ends up being copied by pandas before being returned to the user. However, we
-                # copy it into a bytearray here for safety.
-                values = np.frombuffer(bytearray(lz4_decompress(coldata[DATA])), dtype=dtype)
-                self._set_or_promote_dtype(column_dtypes, c, dtype)
-                rtn[c] = self._empty(rtn_length, dtype=column_dtypes[c])
-                # unpackbits will make a copy of the read-only array created by frombuffer
-                rowmask = np.unpackbits(np.frombuffer(lz4_decompress(coldata[ROWMASK]),
-                                        dtype='uint8'))[:doc_length].astype('bool')
-                rowmask = rowmask[union_mask]
-                rtn[c][rowmask] = values
-            except KeyError:
-                rtn[c] = None
-
-        if include_images and doc.get(IMAGE_DOC, {}).get(IMAGE, {}):
-            rtn = self._prepend_image(rtn, doc[IMAGE_DOC], rtn_length, column_dtypes, column_set, columns)
-        return rtn
+                kinds.setdefault(c, set()).add(dtype.kind)
+            for c, val in iteritems(image_fields):
+                if isinstance(val, numbers.Real) and not isinstance(val, bool):
+                    kinds.setdefault(c, set()).add('f')
+                else:
+                    kinds.setdefault(c, set()).add('O')
+
+        rtn = {INDEX: np.empty(length, dtype='uint64')}
+        if include_symbol:
+            rtn['SYMBOL'] = np.empty(length, dtype=np.object_)
+        for c in names:
+            if c in kinds and kinds[c] <= set('iuf'):
+                # Ints are read as floats, to represent missing values as NaNs
+                rtn[c] = self._empty(length, dtype=np.float64)
+            else:
+                rtn[c] = self._empty(length, dtype=np.object_)
+
+        def read_bucket(bucket):
+            doc, union_mask, masks, image, offset = bucket
+            self._read_bucket(doc, union_mask, masks, image, rtn, offset, include_symbol, columns)
+
+        if pool is not None:
+            # Each bucket is decoded into rows of its own, lz4 and numpy releasing the GIL
+            pool.map(read_bucket, buckets)
+        else:
+            for bucket in buckets:
+                read_bucket(bucket)
+        return names, rtn
+
+    def _read_bucket(self, doc, union_mask, masks, image, rtn, offset, include_symbol, columns):
+        """
+        Decode the bucket into the rows of the columns rtn from offset: its image first, if prepended,
+        then the ticks of union_mask, scattering the columns with gaps by their masks.
+        """
+        pos = offset
+        if image is not None:
+            first_dt = image[IMAGE_TIME]
+            if not first_dt.tzinfo:
+                first_dt = first_dt.replace(tzinfo=mktz('UTC'))
+            rtn[INDEX][pos] = datetime_to_ms(first_dt)
+            image_fields = self._image_fields(image, columns)
+            for field, val in iteritems(image_fields):
+                rtn[field][pos] = val
+            # The fields of the bucket missing from the image are NaNs
+            for c in doc[COLUMNS]:
+                if c not in image_fields:
+                    logger.debug("Field %s is missing from image!" % c)
+                    rtn[c][pos] = np.nan
+            pos += 1
+
+        index = np.cumsum(np.frombuffer(lz4_decompress(doc[INDEX]), dtype='uint64'))
+        length = np.count_nonzero(union_mask)
+        every_tick = length == len(index)
+        rtn[INDEX][pos:pos + length] = index if every_tick else index[union_mask]
+        if include_symbol:
+            rtn['SYMBOL'][offset:pos + length] = doc[SYMBOL]
+
+        for c, coldata in iteritems(doc[COLUMNS]):
+            values = np.frombuffer(lz4_decompress(coldata[DATA]), dtype=np.dtype(coldata[DTYPE]))
+            rows = rtn[c][pos:pos + length]
+            if c not in masks:
+                rows[:] = values
+            else:
+                rows[masks[c] if every_tick else masks[c][union_mask]] = values
 
     def _empty(self, length, dtype):
         if dtype is not None and dtype == np.float64:
@@ -717,42 +835,55 @@ class TickStore(object):
                      recs[index_name].astype('datetime64[ms]').view('uint64')))).tostring()))
         return rtn, final_image
 
+    @staticmethod
+    def _ticks_to_ms(index):
+        """
+        Convert the timestamps of a list of ticks to ms since the epoch, as an array.
+        """
+        if all(isinstance(d, dt) and d.tzinfo for d in index):
+            # Every timestamp is timezone aware: convert them all at once
+            return pd.to_datetime(index, utc=True).values.view('i8') // 1000000
+        return np.array([TickStore._to_ms(d) for d in index], dtype='i8')
+
     @staticmethod
     def _to_bucket(ticks, symbol, initial_image):
         rtn = {SYMBOL: symbol, VERSION: CHUNK_VERSION_NUMBER, COLUMNS: {}, COUNT: len(ticks)}
-        data = {}
-        rowmask = {}
         start = to_dt(ticks[0]['index'])
         end = to_dt(ticks[-1]['index'])
+
+        # The values of the columns, in the order they first appear, and the rows they're in, in one pass
+        index = []
+        data = OrderedDict()
+        rows = {}
         final_image = copy.copy(initial_image) if initial_image else {}
         for i, t in enumerate(ticks):
             if initial_image:
                 final_image.update(t)
             for k, v in iteritems(t):
+                if k == 'index':
+                    index.append(v)
+                    continue
                 try:
-                    if k != 'index':
-                        rowmask[k][i] = 1
-                    else:
-                        v = TickStore._to_ms(v)
-                        if data[k][-1] > v:
-                            raise UnorderedDataException("Timestamps out-of-order: %s > %s" % (
-                                ms_to_datetime(data[k][-1]), t))
                     data[k].append(v)
+                    rows[k].append(i)
                 except KeyError:
-                    if k != 'index':
-                        rowmask[k] = np.zeros(len(ticks), dtype='uint8')
-                        rowmask[k][i] = 1
                     data[k] = [v]
+                    rows[k] = [i]
+
+        index = TickStore._ticks_to_ms(index)
+        unordered = np.flatnonzero(np.diff(index) < 0)
+        if len(unordered):
+            i = unordered[0]
+            raise UnorderedDataException("Timestamps out-of-order: %s > %s" % (
+                ms_to_datetime(int(index[i])), ticks[i + 1]))
 
-        rowmask = dict([(k, Binary(lz4_compressHC(np.packbits(v).tostring())))
-                        for k, v in iteritems(rowmask)])
         for k, v in iteritems(data):
-            if k != 'index':
-                v = np.array(v)
-                v = TickStore._ensure_supported_dtypes(v)
-                rtn[COLUMNS][k] = {DATA: Binary(lz4_compressHC(v.tostring())),
-                                   DTYPE: TickStore._str_dtype(v.dtype),
-                                   ROWMASK: rowmask[k]}
+            rowmask = np.zeros(len(ticks), dtype='uint8')
+            rowmask[rows[k]] = 1
+            v = TickStore._ensure_supported_dtypes(np.array(v))
+            rtn[COLUMNS][k] = {DATA: Binary(lz4_compressHC(v.tostring())),
+                               DTYPE: TickStore._str_dtype(v.dtype),
+                               ROWMASK: Binary(lz4_compressHC(np.packbits(rowmask).tostring()))}
 
         if initial_image:
             image_start = initial_image.get('index', start)
@@ -763,7 +894,7 @@ class TickStore(object):
             rtn[IMAGE_DOC] = {IMAGE_TIME: image_start, IMAGE: initial_image}
         rtn[END] = end
         rtn[START] = start
-        rtn[INDEX] = Binary(lz4_compressHC(np.concatenate(([data['index'][0]], np.diff(data['index']))).tostring()))
+        rtn[INDEX] = Binary(lz4_compressHC(np.concatenate(([index[0]], np.diff(index))).tostring()))
         return rtn, final_image
 
     def max_date(self, symbol):
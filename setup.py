@@ -90,6 +90,7 @@ setup(
                       "tzlocal",
                       "lz4"
                      ],
+    extras_require={"zstd": ["zstandard"]},
     # Note: pytest >= 4.1.0 is not compatible with pytest-cov < 2.6.1.
     tests_require=["mock",
                    "mockextras",
@@ -98,7 +99,8 @@ setup(
                    "pytest-server-fixtures",
                    "pytest-timeout",
                    "pytest-xdist",
-                   "lz4"
+                   "lz4",
+                   "zstandard"
                   ],
     entry_points={'console_scripts': [
                                         'arctic_init_library = arctic.scripts.arctic_init_library:main',
@@ -108,6 +110,7 @@ setup(
                                         'arctic_copy_data = arctic.scripts.arctic_copy_data:main',
                                         'arctic_create_user = arctic.scripts.arctic_create_user:main',
                                         'arctic_prune_versions = arctic.scripts.arctic_prune_versions:main',
+                                        'arctic_compact = arctic.scripts.arctic_compact:main',
                                         'arctic_fsck = arctic.scripts.arctic_fsck:main',
                                         ]
                   },
@@ -0,0 +1,31 @@
+import numpy as np
+from mock import patch, ANY, call
+from numpy.testing import assert_equal
+
+from arctic.auth import Credential
+from arctic.scripts import arctic_compact as mc
+from ...util import run_as_main
+
+
+def test_compact_symbols(mongo_host, library, library_name):
+    with patch('arctic.scripts.arctic_compact.compact', autospec=True) as compact, \
+            patch('arctic.scripts.utils.get_auth', return_value=Credential('admin', 'adminuser', 'adminpwd')), \
+            patch('pymongo.database.Database.authenticate', return_value=True):
+
+        run_as_main(mc.main, '--host', mongo_host, '--library', library_name, '--symbols', 'sym1,sym2',
+                    '--min-appends', '5', '--max-mb-per-sec', '2')
+        compact.assert_has_calls([call(ANY, ['sym1', 'sym2'], 5, 2 * 1024 * 1024)])
+
+
+def test_compact(library):
+    library.write('sym1', np.arange(10))
+    library.write('sym2', np.arange(10))
+    for i in range(3):
+        library.append('sym1', np.arange(10 + i, 11 + i))
+    library.append('sym2', np.arange(10, 11))
+
+    mc.compact(library, None, 2, None)
+
+    assert library._read_metadata('sym1')['append_count'] == 0
+    assert library._read_metadata('sym2')['append_count'] == 1
+    assert_equal(library.read('sym1').data, np.arange(13))
@@ -13,7 +13,7 @@ def test_prune_versions_symbol(mongo_host, library, library_name):
             patch('pymongo.database.Database.authenticate', return_value=True):
 
         run_as_main(mpv.main, '--host', mongo_host, '--library', library_name, '--symbols', 'sym1,sym2')
-        prune_versions.assert_has_calls([call(ANY, ['sym1', 'sym2'], 10)])
+        prune_versions.assert_has_calls([call(ANY, ['sym1', 'sym2'], 10, workers=1)])
 
 
 def test_prune_versions_full(mongo_host, library, library_name):
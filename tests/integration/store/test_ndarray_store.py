@@ -4,11 +4,13 @@ import bson
 import numpy as np
 import pytest
 from mock import patch
+from pymongo.errors import OperationFailure
 from pymongo.server_type import SERVER_TYPE
 
 from arctic._config import FwPointersCfg, FW_POINTERS_REFS_KEY
 from arctic._util import mongo_count
 from arctic.store._ndarray_store import NdarrayStore
+from arctic.store._segment_cache import set_segment_cache, get_segment_cache
 from arctic.store.version_store import register_versioned_storage
 from tests.integration.store.test_version_store import _query, FwPointersCtx
 
@@ -169,3 +171,65 @@ def test_delete_version_shouldnt_break_read(library):
     library.write('symbol', data, prune_previous_version=False)
     library._delete_version('symbol', 1)
     assert repr(library.read('symbol').data) == repr(data)
+
+
+@pytest.mark.parametrize('fw_pointers_cfg', [FwPointersCfg.DISABLED, FwPointersCfg.HYBRID, FwPointersCfg.ENABLED])
+def test_iterator_2darray(library, fw_pointers_cfg):
+    with FwPointersCtx(fw_pointers_cfg):
+        with patch('arctic.store._ndarray_store._CHUNK_SIZE', 1000), \
+                patch('arctic.store._ndarray_store._READ_BATCH_SIZE', 2):
+            ndarr = np.random.rand(100, 3)
+            library.write('MYARR', ndarr)
+            chunks = list(library.iterator('MYARR'))
+            assert [len(c) for c in chunks] == [41, 41, 18]
+            assert chunks[0].flags['WRITEABLE']
+            assert np.all(np.concatenate(chunks) == ndarr)
+            chunks = list(library.iterator('MYARR', chunk_rows=30))
+            assert [len(c) for c in chunks] == [30, 30, 30, 10]
+            assert np.all(np.concatenate(chunks) == ndarr)
+
+
+def test_iterator_missing_segment(library):
+    with patch('arctic.store._ndarray_store._CHUNK_SIZE', 1000):
+        library.write('MYARR', np.random.rand(300))
+    library._collection.delete_one({'symbol': 'MYARR', 'segment': 124})
+    with pytest.raises(OperationFailure):
+        list(library.iterator('MYARR'))
+
+
+def _fw_pointers(library, symbol):
+    return library._versions.find_one({'symbol': symbol}, sort=[('version', -1)])[FW_POINTERS_REFS_KEY]
+
+
+@pytest.mark.parametrize('fw_pointers_cfg', [FwPointersCfg.HYBRID, FwPointersCfg.ENABLED])
+def test_read_with_segment_cache(library, fw_pointers_cfg, tmpdir):
+    try:
+        set_segment_cache(str(tmpdir.join('segments.db')))
+        with FwPointersCtx(fw_pointers_cfg):
+            with patch('arctic.store._ndarray_store._CHUNK_SIZE', 1000):
+                ndarr = np.random.rand(300)
+                library.write('MYARR', ndarr)
+                assert np.all(library.read('MYARR').data == ndarr)
+                assert len(get_segment_cache().get_many(_fw_pointers(library, 'MYARR'))) == 3
+
+                # Only the new segment is fetched from mongo
+                library.append('MYARR', ndarr[:10])
+                library._collection.delete_many({'symbol': 'MYARR', 'segment': {'$lt': 300}})
+                assert np.all(library.read('MYARR').data == np.concatenate([ndarr, ndarr[:10]]))
+
+                # Served entirely from the cache
+                library._collection.delete_many({'symbol': 'MYARR'})
+                assert np.all(library.read('MYARR').data == np.concatenate([ndarr, ndarr[:10]]))
+    finally:
+        set_segment_cache(None)
+
+
+def test_read_without_fw_pointers_bypasses_segment_cache(library, tmpdir):
+    try:
+        set_segment_cache(str(tmpdir.join('segments.db')))
+        with FwPointersCtx(FwPointersCfg.DISABLED):
+            library.write('MYARR', np.arange(10))
+            assert np.all(library.read('MYARR').data == np.arange(10))
+        assert get_segment_cache().get_many([x['sha'] for x in library._collection.find()]) == {}
+    finally:
+        set_segment_cache(None)
@@ -2,6 +2,7 @@ import numpy as np
 from numpy.testing import assert_equal
 import numpy as np
 import pytest
+from mock import patch
 from numpy.testing import assert_equal
 
 from arctic._util import FwPointersCfg
@@ -58,6 +59,30 @@ def test_promote_types_smaller_sizes(library):
     assert np.all(np.ones(200, dtype='int64') == saved_arr)
 
 
+@pytest.mark.parametrize('upcast_on_read', [False, True])
+@pytest.mark.parametrize('fw_pointers_cfg', [FwPointersCfg.DISABLED, FwPointersCfg.HYBRID, FwPointersCfg.ENABLED])
+def test_append_promoting_types_twice(library, fw_pointers_cfg, upcast_on_read):
+    with FwPointersCtx(fw_pointers_cfg):
+        dtype1 = [('a', 'i8')]
+        dtype2 = [('a', 'i8'), ('b', 'f8')]
+        dtype3 = [('a', 'i8'), ('b', 'f8'), ('c', 'i4')]
+        library.write('MYARR', np.array([(i,) for i in range(10)], dtype=dtype1))
+        library.append('MYARR', np.array([(i, i) for i in range(10, 13)], dtype=dtype2),
+                       upcast_on_read=upcast_on_read)
+        # large enough to rewrite the appended rows, the upcast ones with them
+        library.append('MYARR', np.array([(i, i, i) for i in range(13, 200013)], dtype=dtype3),
+                       upcast_on_read=upcast_on_read)
+
+        saved_arr = library.read('MYARR').data
+        assert saved_arr.dtype == np.dtype(dtype3)
+        assert len(saved_arr) == 200013
+        assert_equal(saved_arr['a'], np.arange(200013))
+        assert np.isnan(saved_arr['b'][:10]).all()
+        assert_equal(saved_arr['b'][10:], np.arange(10, 200013))
+        assert_equal(saved_arr['c'][:13], 0)
+        assert_equal(saved_arr['c'][13:], np.arange(13, 200013))
+
+
 def test_promote_types_larger_sizes(library):
     library.write('MYARR', np.ones(100, dtype='int32'))
     library.append('MYARR', np.ones(100, dtype='int64'))
@@ -328,3 +353,69 @@ def test_append_reorder_columns(library):
     library.append('MYARR', foo)
 
     assert np.all(library.read('MYARR').data == np.array([(2, 1), (1, 2)], dtype=[('b', 'u1'), ('a', 'u1')]))
+
+
+@pytest.mark.parametrize('fw_pointers_cfg', [FwPointersCfg.DISABLED, FwPointersCfg.HYBRID, FwPointersCfg.ENABLED])
+def test_append_deferred_compaction(library, fw_pointers_cfg):
+    with FwPointersCtx(fw_pointers_cfg):
+        library.write('MYARR', np.arange(100))
+        for i in range(5):
+            library.append('MYARR', np.arange(100 + 10 * i, 110 + 10 * i), compaction={'deferred': True,
+                                                                                        'append_count': 2})
+        version = library._read_metadata('MYARR')
+        assert version['append_count'] == 5
+        assert 'base_version_id' in version
+
+        library.compact('MYARR')
+        version = library._read_metadata('MYARR')
+        assert version['append_count'] == 0
+        assert version['segment_count'] == 1
+        assert_equal(library.read('MYARR').data, np.arange(150))
+        # nothing left to compact
+        assert library.compact('MYARR').version == version['version']
+
+
+def test_append_compressed_appends(library):
+    library.write('MYARR', np.arange(100))
+    for i in range(3):
+        library.append('MYARR', np.arange(100 + 10 * i, 110 + 10 * i), compaction={'compress_appends': True})
+    segments = list(library._collection.find({'symbol': 'MYARR', 'appended': True}))
+    assert len(segments) == 3
+    assert all(x['compressed'] for x in segments)
+    assert_equal(library.read('MYARR').data, np.arange(130))
+
+    library.compact('MYARR')
+    version = library._read_metadata('MYARR')
+    assert version['segment_count'] == 1
+    assert_equal(library.read('MYARR').data, np.arange(130))
+
+
+def test_append_with_library_compaction_policy(arctic):
+    arctic.initialize_library('compaction_test', compaction={'append_count': 2})
+    library = arctic['compaction_test']
+    library.write('MYARR', np.arange(100))
+    library.append('MYARR', np.arange(100, 110))
+    assert library._read_metadata('MYARR')['append_count'] == 1
+    library.append('MYARR', np.arange(110, 120))
+    assert library._read_metadata('MYARR')['append_count'] == 0
+    assert_equal(library.read('MYARR').data, np.arange(120))
+
+
+def test_unknown_compaction_setting(arctic):
+    with pytest.raises(ValueError):
+        arctic.initialize_library('compaction_test', compaction={'append_rows': 2})
+
+
+def test_compact_all_rate_limited(library):
+    for symbol in ['A', 'B', 'C']:
+        library.write(symbol, np.arange(100))
+        library.append(symbol, np.arange(100, 110))
+    library.delete('C')
+    with patch('arctic.store.version_store.time.sleep') as sleep, \
+            patch('arctic.store.version_store._CHUNK_SIZE', 1000):
+        assert library.compact_all(max_bytes_per_sec=100) == ['A', 'B']
+    # 80 bytes appended to each, rewritten with a chunk of 1000 bytes
+    assert sleep.call_count == 2
+    assert 21.6 >= sleep.call_args_list[1][0][0] > 20
+    assert library._read_metadata('A')['append_count'] == 0
+    assert_equal(library.read('B').data, np.arange(110))
@@ -1,3 +1,4 @@
+import hashlib
 import itertools
 import string
 from datetime import datetime as dt, timedelta as dtd
@@ -12,10 +13,12 @@ from pandas.tseries.offsets import DateOffset
 from pandas.util.testing import assert_frame_equal, assert_series_equal
 from six import StringIO
 
-from arctic._compression import decompress
+from arctic._compression import lz4_decompress, decompress_array_async
 from arctic.date import DateRange, mktz
+from arctic.exceptions import ArcticException
 # Do not remove PandasStore, used in global scope
 from arctic.store._pandas_ndarray_store import PandasDataFrameStore, PandasSeriesStore, PandasStore
+from arctic.store._where import Where
 from arctic.store.version_store import register_versioned_storage
 
 register_versioned_storage(PandasDataFrameStore)
@@ -459,6 +462,54 @@ def test_dataframe_append_should_add_new_columns_and_reorder(library):
     assert_frame_equal(expected, actual)
 
 
+def test_dataframe_append_promoting_dtype_keeps_previous_segments(library):
+    df = DataFrame({'a': np.arange(100), 'b': [b'x'] * 100},
+                   index=date_range('2017-01-01', periods=100, freq='T', name='date'), columns=list('ab'))
+    df2 = DataFrame({'a': np.arange(100, 110) + 0.5, 'b': [b'yyy'] * 10, 'c': np.arange(10.)},
+                    index=date_range('2017-01-01 01:40', periods=10, freq='T', name='date'), columns=list('abc'))
+    with patch('arctic.store._ndarray_store._CHUNK_SIZE', 400):
+        library.write('df', df)
+    segments = sorted(x['segment'] for x in library._collection.find({'symbol': 'df'}))
+    library.append('df', df2, upcast_on_read=True)
+
+    # the segments written before the append are left as they are
+    assert sorted(x['segment'] for x in library._collection.find({'symbol': 'df'})) == segments + [109]
+    version = library._read_metadata('df')
+    assert [x['up_to'] for x in version['dtype_history']] == [100]
+    expected = pd.concat([df, df2])[list('abc')]
+    expected['b'] = expected['b'].astype('S3')
+    assert_frame_equal(library.read('df').data, expected)
+    assert_frame_equal(library.read('df', columns=['c']).data, expected[['c']])
+    dr = DateRange(df.index[90], df2.index[2])
+    assert_frame_equal(library.read('df', date_range=dr).data, expected[90:103])
+    assert_frame_equal(pd.concat(library.iterator('df')), expected)
+
+    # compacting the appended rows rewrites the last segments only, in the new dtype
+    df3 = DataFrame({'a': [110.5], 'b': [b'z'], 'c': [10.]},
+                    index=date_range('2017-01-01 01:50', periods=1, name='date'), columns=list('abc'))
+    with patch('arctic.store._ndarray_store._APPEND_COUNT', 1):
+        library.append('df', df3, upcast_on_read=True)
+    version = library._read_metadata('df')
+    assert [x['up_to'] for x in version['dtype_history']] == [segments[-2] + 1]
+    expected = pd.concat([expected, df3])
+    expected['b'] = expected['b'].astype('S3')
+    assert_frame_equal(library.read('df').data, expected)
+
+
+
+def test_dataframe_append_promoting_dtype_rewrites_by_default(arctic):
+    df = DataFrame({'a': np.arange(10)}, index=date_range('2017-01-01', periods=10, name='date'))
+    df2 = DataFrame({'a': [10.5]}, index=date_range('2017-01-11', periods=1, name='date'))
+    arctic.initialize_library('upcast_default')
+    arctic.initialize_library('upcast_library', upcast_on_read=True)
+    for name, history in [('upcast_default', False), ('upcast_library', True)]:
+        library = arctic[name]
+        library.write('df', df)
+        library.append('df', df2)
+        assert ('dtype_history' in library._read_metadata('df')) == history
+        assert_frame_equal(library.read('df').data, pd.concat([df, df2]))
+
+
 # -- auto generated tests --- #
 def dataframe(columns, length, index):
     df = DataFrame(np.ones((length, columns)), columns=list(string.ascii_lowercase[:columns]))
@@ -741,14 +792,14 @@ def test_daterange_end(library):
                    data=np.tile(np.arange(30 * 1024), 100).reshape((-1, 100)))
     df.columns = [str(c) for c in df.columns]
     library.write('MYARR', df)
-    mdecompressALL = Mock(side_effect=decompress)
-    with patch('arctic.store._ndarray_store.decompress', mdecompressALL):
+    mdecompressALL = Mock(side_effect=lz4_decompress)
+    with patch('arctic._compression.lz4_decompress', mdecompressALL):
         library.read('MYARR').data
-    mdecompressLR = Mock(side_effect=decompress)
-    with patch('arctic.store._ndarray_store.decompress', mdecompressLR):
+    mdecompressLR = Mock(side_effect=lz4_decompress)
+    with patch('arctic._compression.lz4_decompress', mdecompressLR):
         result = library.read('MYARR', date_range=DateRange(df.index[-1], df.index[-1])).data
     assert len(result) == 1
-    assert mdecompressLR.call_count < mdecompressALL.call_count
+    assert len(mdecompressLR.call_args_list) < len(mdecompressALL.call_args_list)  # call_count is not thread safe
 
 
 def test_daterange_start(library):
@@ -756,14 +807,14 @@ def test_daterange_start(library):
                    data=np.tile(np.arange(30 * 1024), 100).reshape((-1, 100)))
     df.columns = [str(c) for c in df.columns]
     library.write('MYARR', df)
-    mdecompressALL = Mock(side_effect=decompress)
-    with patch('arctic.store._ndarray_store.decompress', mdecompressALL):
+    mdecompressALL = Mock(side_effect=lz4_decompress)
+    with patch('arctic._compression.lz4_decompress', mdecompressALL):
         library.read('MYARR').data
-    mdecompressLR = Mock(side_effect=decompress)
-    with patch('arctic.store._ndarray_store.decompress', mdecompressLR):
+    mdecompressLR = Mock(side_effect=lz4_decompress)
+    with patch('arctic._compression.lz4_decompress', mdecompressLR):
         result = library.read('MYARR', date_range=DateRange(end=df.index[0])).data
     assert len(result) == 1
-    assert mdecompressLR.call_count < mdecompressALL.call_count
+    assert len(mdecompressLR.call_args_list) < len(mdecompressALL.call_args_list)  # call_count is not thread safe
     end = df.index[0] + dtd(milliseconds=1)
     result = library.read('MYARR', date_range=DateRange(end=end)).data
     assert len(result) == 1
@@ -1014,3 +1065,238 @@ def test_mutable_df(library):
     library.write('pandas', s)
     read_s = library.read('pandas')
     assert read_s.data.__array__().flags['WRITEABLE']
+
+
+def test_write_dataframe_streams_chunks(library):
+    df = DataFrame(np.random.randn(1000, 3), index=date_range('2017-01-01', periods=1000, freq='T', name='date'),
+                   columns=list('abc'))
+    with patch('arctic.store._pandas_ndarray_store._CHUNK_SIZE', 100), \
+            patch('arctic.store._ndarray_store._WRITE_BATCH_SIZE', 3):
+        library.write('df', df)
+    version = library._versions.find_one({'symbol': 'df'})
+    assert version['segment_count'] == 334
+    assert library._collection.count({'symbol': 'df'}) == 334
+    serialized, _ = PandasDataFrameStore.SERIALIZER.serialize(df)
+    assert bytes(version['sha']) == hashlib.sha1(serialized.tostring()).digest()
+    assert_frame_equal(library.read('df').data, df)
+    assert_frame_equal(library.read('df', date_range=DateRange('2017-01-01 10:00', '2017-01-01 11:00')).data,
+                       df['2017-01-01 10:00':'2017-01-01 11:00'])
+
+
+def test_write_dataframe_streamed_with_same_prefix_appends(library):
+    df = DataFrame(np.random.randn(100, 3), index=date_range('2017-01-01', periods=100, freq='T', name='date'),
+                   columns=list('abc'))
+    library.write('df', df[:50])
+    library.write('df', df)
+    # the first 50 rows are reused, only the tail was written
+    assert library._collection.count({'symbol': 'df'}) == 2
+    assert_frame_equal(library.read('df').data, df)
+
+
+def test_iterator_dataframe(library):
+    df = DataFrame(np.random.randn(1000, 3), index=date_range('2017-01-01', periods=1000, freq='T', name='date'),
+                   columns=list('abc'))
+    with patch('arctic.store._pandas_ndarray_store._CHUNK_SIZE', 1000):
+        library.write('df', df)
+    assert library._collection.count({'symbol': 'df'}) == 33
+
+    chunks = list(library.iterator('df'))
+    assert len(chunks) == 33
+    assert_frame_equal(pd.concat(chunks), df)
+
+    chunks = list(library.iterator('df', chunk_rows=300))
+    assert [len(c) for c in chunks] == [300, 300, 300, 100]
+    assert_frame_equal(pd.concat(chunks), df)
+
+
+def test_iterator_dataframe_date_range(library):
+    df = DataFrame(np.random.randn(1000, 3), index=date_range('2017-01-01', periods=1000, freq='T', name='date'),
+                   columns=list('abc'))
+    with patch('arctic.store._pandas_ndarray_store._CHUNK_SIZE', 1000):
+        library.write('df', df)
+    dr = DateRange('2017-01-01 03:00', '2017-01-01 05:00')
+    with patch('arctic.store._ndarray_store._READ_BATCH_SIZE', 2):
+        chunks = list(library.iterator('df', chunk_rows=50, date_range=dr))
+    assert [len(c) for c in chunks] == [50, 50, 21]
+    assert_frame_equal(pd.concat(chunks), df['2017-01-01 03:00':'2017-01-01 05:00'])
+    assert list(library.iterator('df', date_range=DateRange('2018-01-01', '2018-01-02'))) == []
+
+
+def test_iterator_series(library):
+    s = Series(np.arange(1000.), index=date_range('2017-01-01', periods=1000, freq='T', name='date'), name='x')
+    library.write('s', s)
+    chunks = list(library.iterator('s', chunk_rows=400))
+    assert [len(c) for c in chunks] == [400, 400, 200]
+    assert_series_equal(pd.concat(chunks), s)
+
+
+def test_iterator_after_append(library):
+    df = DataFrame(np.random.randn(100, 3), index=date_range('2017-01-01', periods=100, freq='T', name='date'),
+                   columns=list('abc'))
+    library.write('df', df[:40])
+    library.append('df', df[40:70])
+    library.append('df', df[70:])
+    assert_frame_equal(pd.concat(library.iterator('df', chunk_rows=25)), df)
+    assert_frame_equal(pd.concat(library.iterator('df', as_of=2)), df[:70])
+
+
+def test_read_columns(library):
+    df = DataFrame({'a': np.arange(100), 'b': np.arange(100.), 'c': ['x%d' % i for i in range(100)]},
+                   index=date_range('2017-01-01', periods=100, freq='T', name='date'), columns=list('abc'))
+    library.write('df', df)
+    assert_frame_equal(library.read('df', columns=['c', 'a']).data, df[['c', 'a']])
+    assert_frame_equal(library.read('df', columns=['b'], date_range=DateRange('2017-01-01 00:10', '2017-01-01 00:20')).data,
+                       df[['b']]['2017-01-01 00:10':'2017-01-01 00:20'])
+    assert_frame_equal(library.read('df', columns=[]).data, df[[]])
+    assert_frame_equal(pd.concat(library.iterator('df', chunk_rows=30, columns=['b'])), df[['b']])
+    assert_frame_equal(library.read_batch(['df'], columns=['a'])['df'].data, df[['a']])
+    with pytest.raises(KeyError):
+        library.read('df', columns=['d'])
+
+
+def test_read_columns_not_supported(library):
+    library.write('s', Series(np.arange(10.), name='x'))
+    with pytest.raises(ArcticException):
+        library.read('s', columns=['x'])
+
+
+def test_write_columnar_layout(library):
+    df = DataFrame({'a': np.arange(1000), 'b': np.arange(1000.), 'c': np.arange(1000, dtype=np.int8)},
+                   index=date_range('2017-01-01', periods=1000, freq='T', name='date'), columns=list('abc'))
+    with patch('arctic.store._pandas_ndarray_store._CHUNK_SIZE', 2000):
+        library.write('df', df, layout='columnar')
+    segments = list(library._collection.find({'symbol': 'df'}))
+    assert len(segments) == 13
+    assert all(len(x['column_offsets']) == 4 for x in segments)
+
+    assert_frame_equal(library.read('df').data, df)
+    assert_frame_equal(library.read('df', columns=['c', 'a']).data, df[['c', 'a']])
+    dr = DateRange('2017-01-01 03:00', '2017-01-01 05:00')
+    assert_frame_equal(library.read('df', date_range=dr, columns=['b']).data, df[['b']][dr.start:dr.end])
+    assert_frame_equal(pd.concat(library.iterator('df', chunk_rows=300, columns=['b'])), df[['b']])
+    assert_frame_equal(library.read_batch(['df'])['df'].data, df)
+
+
+def test_read_columnar_layout_decompresses_requested_columns_only(library):
+    df = DataFrame({'a': np.arange(100), 'b': np.arange(100.)},
+                   index=date_range('2017-01-01', periods=100, freq='T', name='date'), columns=list('ab'))
+    library.write('df', df, layout='columnar')
+    with patch('arctic.store._ndarray_store.decompress_array_async', wraps=decompress_array_async) as decompress:
+        assert_frame_equal(library.read('df', columns=['b']).data, df[['b']])
+    # the index and 'b', both 8 bytes wide, in a single call
+    assert [len(c[0][0]) for c in decompress.call_args_list] == [2]
+
+
+def test_append_to_columnar_layout(library):
+    df = DataFrame({'a': np.arange(100), 'b': np.arange(100.)},
+                   index=date_range('2017-01-01', periods=100, freq='T', name='date'), columns=list('ab'))
+    library.write('df', df[:50], layout='columnar')
+    library.append('df', df[50:70])
+    assert_frame_equal(library.read('df', columns=['b']).data, df[['b']][:70])
+    with patch('arctic.store._ndarray_store._APPEND_COUNT', 1):
+        library.append('df', df[70:])
+    assert all('column_offsets' in x for x in library._collection.find({'symbol': 'df', 'compressed': True}))
+    assert_frame_equal(library.read('df').data, df)
+    # promoting the dtype of a column rewrites the symbol, in the same layout
+    library.append('df', DataFrame({'a': [1.5], 'b': [1.]}, index=date_range('2017-01-02', periods=1, name='date')))
+    assert all('column_offsets' in x for x in library._collection.find({'symbol': 'df', 'compressed': True}))
+    assert library.read('df').data['a'].dtype == np.float64
+
+
+def test_write_unknown_layout(library):
+    with pytest.raises(ValueError):
+        library.write('df', DataFrame({'a': [1, 2]}), layout='diagonal')
+
+
+@pytest.mark.parametrize('layout', ['row', 'columnar'])
+def test_read_where_skips_segments(library, layout):
+    df = DataFrame({'price': np.arange(1000.), 'volume': np.arange(1000) % 7, 'name': ['x'] * 1000},
+                   index=date_range('2017-01-01', periods=1000, freq='T', name='date'),
+                   columns=['price', 'volume', 'name'])
+    df.iloc[500:600, 0] = np.nan
+    # with an object column, the frame is written from a single recarray
+    with patch('arctic.store._ndarray_store._CHUNK_SIZE', 2800):
+        library.write('df', df, layout=layout, segment_stats=True)
+    assert library._collection.count({'symbol': 'df'}) == 10
+
+    with patch.object(Where, 'rows', autospec=True, side_effect=Where.rows) as rows:
+        assert_frame_equal(library.read('df', where='price > 900').data, df[df.price > 900])
+    # only the last segment has prices above 900
+    assert rows.call_count == 1
+    with patch.object(Where, 'rows', autospec=True, side_effect=Where.rows) as rows:
+        assert_frame_equal(library.read('df', where='price == 550').data, df[df.price == 550])
+    # prices in the segment of rows 500 to 599 are all NaNs
+    assert rows.call_count == 0
+    assert_frame_equal(library.read('df', where='(price < 100) & (volume == 0)', columns=['volume']).data,
+                       df[(df.price < 100) & (df.volume == 0)][['volume']])
+    assert_frame_equal(library.read('df', where='price != 1.0 or volume > 5').data,
+                       df[(df.price != 1.0) | (df.volume > 5)])
+    assert_frame_equal(library.read('df', where='not price > 10').data, df[~(df.price > 10)])
+    assert_frame_equal(library.read('df', where='volume > price').data, df[df.volume > df.price])
+    assert_frame_equal(library.read('df', where='price > 2000').data, df[df.price > 2000])
+    assert_frame_equal(pd.concat(library.iterator('df', where='3 >= volume', chunk_rows=100)), df[df.volume <= 3])
+    with pytest.raises(KeyError):
+        library.read('df', where='volume > 0 and size > 0')
+    assert_frame_equal(library.read('df', where='(name == "x") & (volume == 1)').data, df[df.volume == 1])
+    with pytest.raises(ValueError):
+        library.read('df', where='price + 1 > 2')
+
+
+def test_segment_stats_kept_on_append(library):
+    df = DataFrame({'a': np.arange(100), 'b': np.arange(100.)},
+                   index=date_range('2017-01-01', periods=100, freq='T', name='date'), columns=list('ab'))
+    library.write('df', df[:50], segment_stats=True)
+    library.append('df', df[50:70])
+    with patch('arctic.store._ndarray_store._APPEND_COUNT', 1):
+        library.append('df', df[70:90])
+    library.append('df', df[90:])
+    version = library._read_metadata('df')
+    stats = library._read_handler(version, 'df')._read_segment_stats(version)
+    # the first segment is compacted with the appended ones, then comes the last append
+    assert stats['segment'].tolist() == [89, 99]
+    assert stats['min']['a'].tolist() == [0, 90]
+    assert stats['max']['b'].tolist() == [89., 99.]
+    assert_frame_equal(library.read('df', where='a >= 85').data, df[df.a >= 85])
+
+
+def test_read_date_range_decompresses_overlapping_blocks_only(library):
+    df = DataFrame({'price': np.arange(1000.), 'name': ['x'] * 1000},
+                   index=date_range('2017-01-01', periods=1000, freq='T', name='date'), columns=['price', 'name'])
+    # with an object column, the frame is written from a single recarray
+    with patch('arctic.store._ndarray_store._CHUNK_SIZE', 2000):
+        library.write('df', df, block_rows=10)
+    segments = list(library._collection.find({'symbol': 'df'}))
+    assert len(segments) == 10
+    assert all(x['block_ends'] == list(range(10, 101, 10)) for x in segments)
+
+    dr = DateRange(df.index[155], df.index[344])
+    with patch('arctic.store._ndarray_store.decompress_array_async', wraps=decompress_array_async) as decompress:
+        assert_frame_equal(library.read('df', date_range=dr).data, df[155:345])
+    # the last 5 blocks of the first segment, the whole of the second, and the first 5 of the last
+    assert sum(len(c[0][0]) for c in decompress.call_args_list) == 20
+
+    for start, end in [(0, 1000), (0, 5), (95, 105), (100, 101), (199, 200), (990, 1000), (999, 1000)]:
+        dr = DateRange(df.index[start], df.index[end - 1])
+        assert_frame_equal(library.read('df', date_range=dr).data, df[start:end])
+        assert_frame_equal(pd.concat(library.iterator('df', date_range=dr)), df[start:end])
+    assert_frame_equal(library.read('df', date_range=DateRange(None, df.index[15])).data, df[:16])
+    assert_frame_equal(library.read('df', date_range=DateRange(df.index[985], None)).data, df[985:])
+    assert_frame_equal(library.read('df').data, df)
+
+
+def test_append_to_block_rows(library):
+    df = DataFrame({'a': np.arange(100), 'b': np.arange(100.)},
+                   index=date_range('2017-01-01', periods=100, freq='T', name='date'), columns=list('ab'))
+    library.write('df', df[:50], block_rows=8)
+    library.append('df', df[50:70])
+    with patch('arctic.store._ndarray_store._APPEND_COUNT', 1):
+        library.append('df', df[70:])
+    # the appended rows are compacted with the first segment, in blocks of the same size
+    assert library._collection.find_one({'symbol': 'df', 'segment': 99})['block_ends'] == list(range(8, 100, 8)) + [100]
+    assert_frame_equal(library.read('df').data, df)
+    assert_frame_equal(library.read('df', date_range=DateRange(df.index[13], df.index[42])).data, df[13:43])
+
+
+def test_write_invalid_block_rows(library):
+    with pytest.raises(ValueError):
+        library.write('df', DataFrame({'a': [1, 2]}), block_rows=0)
@@ -23,6 +23,7 @@ from arctic.date import DateRange
 from arctic.date._mktz import mktz
 from arctic.exceptions import NoDataFoundException, DuplicateSnapshotException, ArcticException
 from arctic.store import _version_store_utils
+from arctic.store._ndarray_store import NdarrayStore
 from arctic.store import version_store
 from tests.unit.serialization.serialization_test_data import _mixed_test_data
 from ...util import read_str_as_pandas
@@ -374,6 +375,118 @@ def test_query_version_as_of_int(library):
     assert_frame_equal(library.read(symbol).data, ts2)
 
 
+@pytest.mark.parametrize('fw_pointers_cfg', [FwPointersCfg.DISABLED, FwPointersCfg.HYBRID, FwPointersCfg.ENABLED])
+def test_read_batch(library, fw_pointers_cfg):
+    with FwPointersCtx(fw_pointers_cfg):
+        library.write('TS1', ts1)
+        library.write('TS1', ts2, prune_previous_version=False)
+        library.write('TS2', ts1_append)
+        library.write('ARR', np.arange(10))
+        library.write('BLOB', {'a': 1})
+        library.write('DELETED', ts1)
+        library.delete('DELETED')
+
+        items = library.read_batch(['TS1', 'TS2', 'ARR', 'BLOB', 'DELETED', 'MISSING'])
+
+        assert_frame_equal(items['TS1'].data, ts2)
+        assert items['TS1'].version == 2
+        assert_frame_equal(items['TS2'].data, ts1_append)
+        assert np.array_equal(items['ARR'].data, np.arange(10))
+        assert items['BLOB'].data == {'a': 1}
+        assert isinstance(items['DELETED'], NoDataFoundException)
+        assert isinstance(items['MISSING'], NoDataFoundException)
+
+
+@pytest.mark.parametrize('fw_pointers_cfg', [FwPointersCfg.DISABLED, FwPointersCfg.HYBRID, FwPointersCfg.ENABLED])
+def test_read_batch_as_of_and_date_range(library, fw_pointers_cfg):
+    with FwPointersCtx(fw_pointers_cfg):
+        library.write('TS1', ts1)
+        library.write('TS2', ts1)
+        library.snapshot('snap')
+        library.write('TS1', ts2)
+
+        assert_frame_equal(library.read_batch(['TS1'], as_of=1)['TS1'].data, ts1)
+        assert_frame_equal(library.read_batch(['TS1', 'TS2'], as_of='snap')['TS1'].data, ts1)
+
+        dr = DateRange(dt(2012, 10, 1), dt(2012, 10, 30))
+        items = library.read_batch(['TS1', 'TS2'], date_range=dr)
+        assert_frame_equal(items['TS1'].data, library.read('TS1', date_range=dr).data)
+        assert_frame_equal(items['TS2'].data, ts1[1:3])
+
+
+def test_read_batch_symbol_failures(library):
+    library.write('ARR1', np.arange(10))
+    library.write('ARR2', np.arange(20))
+    library.write('ARR3', np.arange(30))
+    library.write('ARR4', np.arange(40))
+    # A corrupt segment fails the decompression of ARR2 only
+    library._collection.update_one({'symbol': 'ARR2'}, {'$set': {'data': bson.Binary(b'corrupt')}})
+
+    index_range = NdarrayStore._index_range
+
+    def _index_range(self, version, symbol, **kwargs):
+        if symbol == 'ARR3':
+            raise ValueError('bad index range')
+        return index_range(self, version, symbol, **kwargs)
+
+    with patch.object(NdarrayStore, '_index_range', autospec=True, side_effect=_index_range):
+        items = library.read_batch(['ARR1', 'ARR2', 'ARR3', 'ARR4'])
+
+    assert np.array_equal(items['ARR1'].data, np.arange(10))
+    assert isinstance(items['ARR2'], Exception)
+    assert isinstance(items['ARR3'], ValueError)
+    assert np.array_equal(items['ARR4'].data, np.arange(40))
+
+
+@pytest.mark.parametrize('fw_pointers_cfg', [FwPointersCfg.DISABLED, FwPointersCfg.HYBRID, FwPointersCfg.ENABLED])
+def test_write_batch(library, fw_pointers_cfg):
+    with FwPointersCtx(fw_pointers_cfg):
+        library.write('TS1', ts1)
+        library.write('ARR', np.arange(5))
+
+        items = library.write_batch({'TS1': ts2, 'TS2': ts1_append, 'ARR': np.arange(10), 'BLOB': {'a': 1}},
+                                    metadata={'TS2': {'a': 'b'}})
+
+        assert items['TS1'].version == 2
+        assert items['TS2'].version == 1
+        assert items['TS2'].metadata == {'a': 'b'}
+        assert items['ARR'].version == 2
+        assert_frame_equal(library.read('TS1').data, ts2)
+        assert_frame_equal(library.read('TS1', as_of=1).data, ts1)
+        assert_frame_equal(library.read('TS2').data, ts1_append)
+        assert library.read('TS2').metadata == {'a': 'b'}
+        assert np.array_equal(library.read('ARR').data, np.arange(10))
+        assert library.read('BLOB').data == {'a': 1}
+
+
+def test_write_batch_bulk_writes(library):
+    library.write('TS1', ts1)
+
+    with patch.object(library._collection, 'bulk_write', autospec=True,
+                      side_effect=library._collection.bulk_write) as bulk_write, \
+            patch.object(library._versions, 'insert_many', autospec=True,
+                         side_effect=library._versions.insert_many) as insert_many:
+        items = library.write_batch({'TS%d' % i: ts1 for i in range(5)}, prune_previous_version=False)
+
+    assert bulk_write.call_count == 1
+    assert insert_many.call_count == 1
+    assert sorted(v.version for v in items.values()) == [1, 1, 1, 1, 2]
+    for i in range(5):
+        assert_frame_equal(library.read('TS%d' % i).data, ts1)
+
+
+def test_write_batch_concurrent_write(library):
+    library.write('TS1', ts1)
+    # Another writer takes the next version number, as if it had been in the midst of a write
+    library._version_nums.update_one({'symbol': 'TS1'}, {'$inc': {'version': 1}})
+    library._versions.insert_one({'symbol': 'TS1', 'version': 3, 'metadata': {'deleted': True}})
+
+    items = library.write_batch({'TS1': ts2})
+
+    assert items['TS1'].version == 4
+    assert_frame_equal(library.read('TS1').data, ts2)
+
+
 @pytest.mark.parametrize('fw_pointers_cfg', [FwPointersCfg.DISABLED, FwPointersCfg.HYBRID, FwPointersCfg.ENABLED])
 def test_list_version(library, fw_pointers_cfg):
     with FwPointersCtx(fw_pointers_cfg):
@@ -1621,6 +1734,93 @@ def test_prune_keeps_version(library, fw_pointers_cfg):
         assert len(library.list_versions(symbol)) == 2
 
 
+@pytest.mark.parametrize('fw_pointers_cfg', [FwPointersCfg.DISABLED, FwPointersCfg.HYBRID, FwPointersCfg.ENABLED])
+def test_prune_all(library, fw_pointers_cfg):
+    with FwPointersCtx(fw_pointers_cfg):
+        coll = library._collection
+        now = dt.utcnow()
+        for j, s in enumerate(['a', 'b', 'c']):
+            for i, data in enumerate([ts1, ts2, ts1]):
+                with patch("bson.ObjectId",
+                           return_value=bson.ObjectId.from_datetime(now - dtd(minutes=125 - i, seconds=j))):
+                    library.write(s, data, prune_previous_version=False)
+            with patch("bson.ObjectId", return_value=bson.ObjectId.from_datetime(now - dtd(minutes=119, seconds=j))):
+                library.write(s, ts2, prune_previous_version=False)
+        library.snapshot('snap', versions={'a': 1})
+        assert mongo_count(coll.versions) == 12
+
+        # Keeps, for every symbol, the most recent version that's older than 120 mins and the more recent ones
+        assert library.prune_all(keep_mins=120, workers=2) == 5
+        assert sorted(x['version'] for x in library.list_versions('a')) == [1, 3, 4]
+        assert sorted(x['version'] for x in library.list_versions('b')) == [3, 4]
+        assert sorted(x['version'] for x in library.list_versions('c')) == [3, 4]
+        assert_frame_equal(library.read('a', as_of='snap').data, ts1)
+        for s in 'abc':
+            assert_frame_equal(library.read(s, as_of=3).data, ts1)
+            assert_frame_equal(library.read(s).data, ts2)
+        assert mongo_count(coll.versions) == 7
+
+        assert library.prune_all(keep_mins=120, symbols=['a', 'b']) == 0
+
+
+@pytest.mark.parametrize('fw_pointers_cfg', [FwPointersCfg.DISABLED, FwPointersCfg.HYBRID, FwPointersCfg.ENABLED])
+def test_prune_all_keeps_base_versions(library, fw_pointers_cfg):
+    with FwPointersCtx(fw_pointers_cfg):
+        now = dt.utcnow()
+        for j, s in enumerate(['a', 'b']):
+            with patch("bson.ObjectId", return_value=bson.ObjectId.from_datetime(now - dtd(minutes=125, seconds=j))):
+                library.write(s, ts1, prune_previous_version=False)
+            with patch("bson.ObjectId", return_value=bson.ObjectId.from_datetime(now - dtd(minutes=124, seconds=j))):
+                if s == 'a':
+                    library.append(s, ts1_append, prune_previous_version=False)
+                else:
+                    library.write(s, ts1, prune_previous_version=False)
+            with patch("bson.ObjectId", return_value=bson.ObjectId.from_datetime(now - dtd(minutes=119, seconds=j))):
+                library.write(s, ts2, prune_previous_version=False)
+        assert library._versions.find_one({'symbol': 'a', 'version': 2})['base_version_id'] == \
+            library._versions.find_one({'symbol': 'a', 'version': 1})['_id']
+
+        # Version 1 of 'a' is the base of the version 2 kept
+        assert library.prune_all(keep_mins=120) == 1
+        assert sorted(x['version'] for x in library.list_versions('a')) == [1, 2, 3]
+        assert sorted(x['version'] for x in library.list_versions('b')) == [2, 3]
+        assert len(library.read('a', as_of=2).data) == len(ts1) + len(ts1_append)
+        assert_frame_equal(library.read('b', as_of=2).data, ts1)
+
+
+@pytest.mark.parametrize('fw_pointers_cfg', [FwPointersCfg.DISABLED, FwPointersCfg.HYBRID, FwPointersCfg.ENABLED])
+def test_async_prune(library, fw_pointers_cfg):
+    with FwPointersCtx(fw_pointers_cfg), patch('arctic.store.version_store.ARCTIC_ASYNC_PRUNE_INTERVAL', 0):
+        now = dt.utcnow()
+        for i, data in enumerate([ts1, ts2, ts1]):
+            with patch("bson.ObjectId", return_value=bson.ObjectId.from_datetime(now - dtd(minutes=125 - i))):
+                library.write(symbol, data, prune_previous_version=False)
+        with patch.object(library, '_prune_previous_versions') as prune:
+            library.write(symbol, ts2, prune_previous_version='async')
+            library.append(symbol, ts1_append, prune_previous_version='async')
+        assert not prune.called
+        assert library.wait_for_prunes(10)
+
+        assert sorted(x['version'] for x in library.list_versions(symbol)) == [3, 4, 5]
+        assert_frame_equal(library.read(symbol, as_of=3).data, ts1)
+        assert_frame_equal(library.read(symbol, as_of=4).data, ts2)
+        assert_frame_equal(library.read(symbol).data, ts2.append(ts1_append))
+
+
+def test_async_prune_library(arctic):
+    arctic.initialize_library('async_prune_test', async_prune=True)
+    library = arctic['async_prune_test']
+    now = dt.utcnow()
+    for i in range(3):
+        with patch("bson.ObjectId", return_value=bson.ObjectId.from_datetime(now - dtd(minutes=125 - i))):
+            library.write(symbol, ts1, prune_previous_version=False)
+    with patch('arctic.store.version_store.ARCTIC_ASYNC_PRUNE_INTERVAL', 0):
+        library.write_metadata(symbol, {'a': 1})
+    assert library.wait_for_prunes(10)
+    assert sorted(x['version'] for x in library.list_versions(symbol)) == [3, 4]
+    assert library.read(symbol).metadata == {'a': 1}
+
+
 def test_empty_string_column_name(library):
     df = pd.DataFrame(data=[0, 1, 2], index=[0, 1, 2])
     df.columns = ['']
@@ -1715,6 +1915,84 @@ def test_handler_check_set_true(arctic):
     assert arctic[lib_name]._with_strict_handler_match is True
 
 
+@pytest.mark.parametrize('compression', ['zstd:9', 'shuffle_lz4', 'shuffle_zstd', 'lz4_frame'])
+def test_write_with_compression_codec(arctic, compression):
+    lib_name = 'compression_test'
+    arctic.initialize_library(lib_name, VERSION_STORE, compression=compression)
+    library = arctic[lib_name]
+    library.write('TS1', ts1)
+    library.append('TS1', ts1_append[len(ts1):])
+    library.write('ARR', np.arange(1000))
+
+    assert_frame_equal(library.read('TS1').data, ts1_append)
+    assert np.array_equal(library.read('ARR').data, np.arange(1000))
+    assert library.read_batch(['TS1'])['TS1'].data.equals(ts1_append)
+    codec = compression.split(':')[0]
+    assert {x.get('codec') for x in library._collection.find({'symbol': 'ARR'})} == {codec}
+
+
+def test_write_with_columnar_layout(arctic):
+    lib_name = 'layout_test'
+    arctic.initialize_library(lib_name, VERSION_STORE, layout='columnar', compression='shuffle_zstd')
+    library = arctic[lib_name]
+    library.write('TS1', ts1)
+    library.write('ARR', np.arange(1000))
+    library.write('TS1_ROWS', ts1, layout='row')
+
+    assert all('column_offsets' in x for x in library._collection.find({'symbol': 'TS1'}))
+    assert not any('column_offsets' in x for x in library._collection.find({'symbol': {'$in': ['ARR', 'TS1_ROWS']}}))
+    assert_frame_equal(library.read('TS1').data, ts1)
+    assert_frame_equal(library.read('TS1_ROWS').data, ts1)
+    assert np.array_equal(library.read('ARR').data, np.arange(1000))
+    assert_frame_equal(library.read_batch(['TS1'], columns=['near'])['TS1'].data, ts1[['near']])
+
+
+def test_initialize_library_with_unknown_layout(arctic):
+    with pytest.raises(ValueError):
+        arctic.initialize_library('layout_test', VERSION_STORE, layout='diagonal')
+
+
+def test_write_with_block_rows(arctic):
+    lib_name = 'block_test'
+    arctic.initialize_library(lib_name, VERSION_STORE, block_rows=2)
+    library = arctic[lib_name]
+    library.write('TS1', ts1)
+    library.write('ARR', np.arange(1000))
+
+    assert all(x['block_ends'][:2] == [2, 4] for x in library._collection.find({'symbol': 'TS1'}))
+    assert all('block_index' not in x for x in library._collection.find({'symbol': 'ARR'}))
+    assert np.array_equal(library.read('ARR').data, np.arange(1000))
+    date_range = DateRange(ts1.index[1], ts1.index[2])
+    assert_frame_equal(library.read('TS1', date_range=date_range).data, ts1[1:3])
+    assert_frame_equal(library.read_batch(['TS1'], date_range=date_range)['TS1'].data, ts1[1:3])
+
+
+def test_initialize_library_with_invalid_block_rows(arctic):
+    with pytest.raises(ValueError):
+        arctic.initialize_library('block_test', VERSION_STORE, block_rows='many')
+
+
+def test_read_segments_written_with_another_codec(arctic):
+    lib_name = 'compression_test'
+    arctic.initialize_library(lib_name, VERSION_STORE)
+    library = arctic[lib_name]
+    library.write('ARR', np.arange(1000))
+    with patch('arctic.store._ndarray_store._APPEND_COUNT', 1):
+        library.append('ARR', np.arange(1000, 1010))
+        library._arctic_lib.set_library_metadata('COMPRESSION', 'shuffle_lz4')
+        library._reset()
+        # compacts the appended segments with the new codec, keeping the LZ4 ones
+        library.append('ARR', np.arange(1010, 1020))
+
+    assert {x.get('codec') for x in library._collection.find({'symbol': 'ARR'})} == {None, 'shuffle_lz4'}
+    assert np.array_equal(library.read('ARR').data, np.arange(1020))
+
+
+def test_initialize_library_unknown_codec(arctic):
+    with pytest.raises(ValueError):
+        arctic.initialize_library('compression_test', VERSION_STORE, compression='foo')
+
+
 def test_write_df_with_objects_in_index(library):
     df = _mixed_test_data()['multiindex_with_object'][0]
     library.write(symbol='symX', data=df)
@@ -1975,3 +2253,65 @@ def test_prune_crossref_fwpointer_configs(library, first_write_cfg, second_write
     library.delete(symbol)
     assert mongo_count(library._versions, {'symbol': symbol}) == 0
     assert mongo_count(library._collection, {'symbol': symbol}) == 0
+
+
+def test_iterator_not_supported_for_pickled_data(library):
+    library.write('pickled', {'a': 1})
+    with pytest.raises(ArcticException):
+        library.iterator('pickled')
+
+
+def test_iterator_deleted_symbol(library):
+    library.write('arr', np.arange(10))
+    library.delete('arr')
+    with pytest.raises(NoDataFoundException):
+        library.iterator('arr')
+
+
+def test_version_cache_serves_latest_version(library):
+    library.set_version_cache(10)
+    library.write('sym', np.arange(10), metadata={'a': 1})
+    assert library.read_metadata('sym').metadata == {'a': 1}
+    # Changed behind the cache's back: still served from memory
+    library._versions.update_one({'symbol': 'sym'}, {'$set': {'metadata': {'a': 2}}})
+    assert library.read('sym').metadata == {'a': 1}
+    assert library.has_symbol('sym')
+    # Reads of older versions aren't cached
+    assert library.read_metadata('sym', as_of=1).metadata == {'a': 2}
+    # has_symbol reads from the database
+    library._versions.delete_many({'symbol': 'sym'})
+    assert library.read_metadata('sym').metadata == {'a': 1}
+    assert not library.has_symbol('sym')
+
+
+def test_version_cache_invalidated_by_writes(library):
+    library.set_version_cache(10)
+    library.write('sym', np.arange(10), metadata={'a': 1})
+    assert library.read('sym').metadata == {'a': 1}
+    library.write('sym', np.arange(5), metadata={'a': 2})
+    item = library.read('sym')
+    assert item.version == 2
+    assert item.metadata == {'a': 2}
+    assert np.all(item.data == np.arange(5))
+    library.append('sym', np.arange(3))
+    assert library.read('sym').version == 3
+    library.write_metadata('sym', {'a': 3})
+    assert library.read_metadata('sym').metadata == {'a': 3}
+    library.write_batch({'sym': np.arange(2)})
+    assert np.all(library.read('sym').data == np.arange(2))
+    library.delete('sym')
+    assert not library.has_symbol('sym')
+
+
+def test_version_cache_without_changes_checks_latest_version(library):
+    library._publish_changes = False
+    library.set_version_cache(10)
+    library.write('sym', np.arange(10), metadata={'a': 1})
+    assert library.read_metadata('sym').metadata == {'a': 1}
+    # another writer, whose change isn't published
+    other = version_store.VersionStore(library._arctic_lib)
+    other._publish_changes = False
+    other.write('sym', np.arange(5), metadata={'a': 2})
+    item = library.read('sym')
+    assert item.metadata == {'a': 2}
+    assert np.all(item.data == np.arange(5))
@@ -126,6 +126,21 @@ def test_read_symbol_as_column(tickstore_lib):
     assert all(df['SYMBOL'].values == ['FEED::SYMBOL'])
 
 
+def test_read_missing_column(tickstore_lib):
+    data = [{'ASK': 1545.25, 'INSTRTYPE': 'FUT',
+             'index': 1185076787070},
+            {'ASK': 1546.25, 'INSTRTYPE': 'FUTURE',
+             'index': 1185141600600}]
+    tickstore_lib.write('FEED::SYMBOL', data)
+
+    df = tickstore_lib.read('FEED::SYMBOL', columns=['ASK', 'INSTRTYPE', 'MISSING'])
+    assert_array_equal(df['ASK'].values, np.array([1545.25, 1546.25]))
+    assert list(df['INSTRTYPE'].values) == ['FUT', 'FUTURE']
+    # a column found in none of the buckets is all Nones
+    assert df['MISSING'].dtype == np.object_
+    assert list(df['MISSING'].values) == [None, None]
+
+
 def test_read_multiple_symbols(tickstore_lib):
     data1 = [{'ASK': 1545.25,
                   'ASKSIZE': 1002.0,
@@ -162,7 +177,8 @@ def test_read_multiple_symbols(tickstore_lib):
 
 
 @pytest.mark.parametrize('chunk_size', [1, 100])
-def test_read_all_cols_all_dtypes(tickstore_lib, chunk_size):
+@pytest.mark.parametrize('workers', [1, 4])
+def test_read_all_cols_all_dtypes(tickstore_lib, chunk_size, workers):
     data = [{'f': 0.1,
             'of': 0.2,
             's': 's',
@@ -182,7 +198,7 @@ def test_read_all_cols_all_dtypes(tickstore_lib, chunk_size):
             ]
     tickstore_lib._chunk_size = chunk_size
     tickstore_lib.write('sym', data)
-    df = tickstore_lib.read('sym', columns=None)
+    df = tickstore_lib.read('sym', columns=None, workers=workers)
 
     assert df.index.tzinfo == mktz()
 
@@ -201,6 +217,8 @@ def test_read_all_cols_all_dtypes(tickstore_lib, chunk_size):
     expected = pd.DataFrame(data, index=index)
     expected = expected[df.columns]
     assert_frame_equal(expected, df, check_names=False)
+    # Strings are read as objects, with or without gaps
+    assert all(df[c].dtype == np.object_ for c in ['s', 'os', 'ns'])
 
 
 DUMMY_DATA = [
@@ -643,6 +661,48 @@ def test_read_with_image(tickstore_lib):
     assert df.index[0] == dt(2013, 1, 1, 10, tzinfo=mktz('Europe/London'))
 
 
+def test_read_workers(tickstore_lib):
+    tickstore_lib._chunk_size = 7
+    index = pd.date_range('2013-01-01', periods=100, freq='min', tz=mktz('UTC')).to_pydatetime()
+    for i, symbol in enumerate(['A', 'B', 'C']):
+        tickstore_lib.write(symbol, [dict({'index': t, 'price': float(j + i)},
+                                          **({'size': j} if j % 3 else {'flag': 'f%d' % j}))
+                                     for j, t in enumerate(index)],
+                            initial_image={'price': 0., 'flag': 'x'})
+    for kwargs in [dict(symbol='A', include_images=True), dict(symbol=['A', 'B', 'C']),
+                   dict(symbol=['C', 'A'], columns=['flag', 'SYMBOL']),
+                   dict(symbol='B', date_range=DateRange(index[10], index[50]), columns=['size'])]:
+        assert_frame_equal(tickstore_lib.read(workers=4, **kwargs), tickstore_lib.read(**kwargs))
+
+
+def test_iterator(tickstore_lib):
+    tickstore_lib._chunk_size = 7
+    index = pd.date_range('2013-01-01', periods=100, freq='min', tz=mktz('UTC')).to_pydatetime()
+    tickstore_lib.write('SYM', [dict({'index': t, 'price': float(j)}, **({'size': j} if j % 3 else {'flag': 'f%d' % j}))
+                                for j, t in enumerate(index)],
+                        initial_image={'price': 0., 'flag': 'x'})
+
+    for kwargs in [dict(), dict(include_images=True), dict(columns=['flag', 'size'], include_images=True),
+                   dict(date_range=DateRange(index[10], index[50]), columns=['size'])]:
+        read = tickstore_lib.read('SYM', **kwargs)
+        for rows_per_batch in [1, 20, 1000]:
+            dfs = list(tickstore_lib.iterator('SYM', rows_per_batch=rows_per_batch, workers=2, **kwargs))
+            assert len(dfs) == (1 if rows_per_batch == 1000 else len(dfs))
+            assert all(len(df) >= min(rows_per_batch, 7) for df in dfs[1:-1])
+            assert_frame_equal(pd.concat(dfs)[read.columns], read)
+    # Whole buckets of 7 ticks, plus their images
+    assert [len(df) for df in tickstore_lib.iterator('SYM', rows_per_batch=10, include_images=True)][:2] == [16, 16]
+
+
+def test_iterator_no_data(tickstore_lib):
+    with pytest.raises(NoDataFoundException):
+        next(tickstore_lib.iterator('SYM'))
+    with pytest.raises(ValueError):
+        next(tickstore_lib.iterator(['SYM', 'SYM2']))
+    with pytest.raises(ValueError):
+        next(tickstore_lib.iterator('SYM', rows_per_batch=0))
+
+
 def test_read_with_metadata(tickstore_lib):
     metadata = {'metadata': 'important data'}
     tickstore_lib.write('test', [{'index': dt(2013, 6, 1, 13, 00, tzinfo=mktz('Europe/London')), 'price': 100.50, 'ticker': 'QQQ'}], metadata=metadata)
@@ -137,3 +137,40 @@ def test_can_convert_to_records_mixed_object_column_string_nan(fast_serializable
         # Do not serialize and force-stringify np.NaN among strings, rather pickle
         df = pd.DataFrame({'a': ['abc', np.NaN, 'def'], 'b': [1.2, 8.0, np.NaN]})
         assert not serializer.can_convert_to_records_without_objects(df, 'my_symbol')
+
+
+def test_project_is_a_view():
+    df = pd.DataFrame({'a': [1, 2, 3], 'b': [1., 2., 3.], 'c': ['x', 'y', 'z']},
+                      index=pd.date_range('2017-01-01', periods=3, name='date'))
+    serializer = anr.DataFrameSerializer()
+    recs, _ = serializer.serialize(df)
+    projected = serializer.project(recs, ['c', 'a'])
+    assert np.may_share_memory(projected, recs)
+    assert projected.dtype.names == ('date', 'c', 'a')
+    assert projected.dtype.metadata['columns'] == ['c', 'a']
+    pd.util.testing.assert_frame_equal(serializer.deserialize(recs, columns=['c', 'a']), df[['c', 'a']])
+
+
+def test_project_multi_column():
+    df = pd.DataFrame(np.arange(6).reshape(3, 2), columns=pd.MultiIndex.from_tuples([('x', '1'), ('y', '2')]))
+    serializer = anr.DataFrameSerializer()
+    recs, _ = serializer.serialize(df)
+    pd.util.testing.assert_frame_equal(serializer.deserialize(recs, columns=[('y', '2')]), df[[('y', '2')]],
+                                       check_names=False)
+
+
+def test_project_missing_column():
+    serializer = anr.DataFrameSerializer()
+    recs, _ = serializer.serialize(pd.DataFrame({'a': [1, 2, 3]}))
+    with pytest.raises(KeyError):
+        serializer.project(recs, ['b'])
+
+
+def test_project_duplicate_columns():
+    df = pd.DataFrame({'a': [1, 2, 3], 'b': [1., 2., 3.]},
+                      index=pd.date_range('2017-01-01', periods=3, name='date'))
+    serializer = anr.DataFrameSerializer()
+    recs, _ = serializer.serialize(df)
+    pd.util.testing.assert_frame_equal(serializer.deserialize(recs, columns=['b', 'a', 'b']), df[['b', 'a', 'b']])
+    with pytest.raises(KeyError):
+        serializer.deserialize(recs, columns=['a', 'a', 'c'])
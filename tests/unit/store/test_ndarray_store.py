@@ -5,8 +5,10 @@ from pymongo.collection import Collection
 from pymongo.results import UpdateResult
 from pytest import raises
 
+from arctic._compression import compress
 from arctic.exceptions import DataIntegrityException
-from arctic.store._ndarray_store import NdarrayStore, _promote_struct_dtypes
+from arctic.store._ndarray_store import NdarrayStore, _promote_struct_dtypes, _read_segments, _compress_blocks, \
+    _rewritten_dtype_history
 
 
 def test_dtype_parsing():
@@ -180,3 +182,55 @@ def test_concat_and_rewrite_checks_fewer_updated():
         NdarrayStore._concat_and_rewrite(self, collection, version, symbol, item, previous_version)
         assert collection.find.call_args_list[1] == call(expected_verify_find_spec)
     assert str(e.value) == 'Symbol: sentinel.symbol:sentinel.version update_many updated 1 segments instead of 2'
+
+
+def test_do_read_assembles_segments_in_order():
+    store = NdarrayStore()
+    collection = create_autospec(Collection)
+    arr = np.arange(10, dtype='float64')
+    version = {'_id': sentinel.id, 'version': 1, 'up_to': 10, 'segment_count': 3, 'dtype': 'float64', 'shape': [-1]}
+    collection.find.return_value = [{'compressed': False, 'segment': 9, 'data': arr[7:].tostring()},
+                                    {'compressed': True, 'segment': 3, 'data': compress(arr[:4].tostring())},
+                                    {'compressed': True, 'segment': 6, 'data': compress(arr[4:7].tostring())}]
+    rtn = store._do_read(collection, version, sentinel.symbol)
+    assert np.array_equal(rtn, arr)
+    assert rtn.dtype == arr.dtype
+
+
+def test_do_read_partial_range():
+    store = NdarrayStore()
+    collection = create_autospec(Collection)
+    arr = np.arange(10, dtype='float64')
+    version = {'_id': sentinel.id, 'version': 1, 'up_to': 10, 'segment_count': 3, 'dtype': 'float64', 'shape': [-1]}
+    collection.find.return_value = [{'compressed': True, 'segment': 6, 'data': compress(arr[4:7].tostring())},
+                                    {'compressed': False, 'segment': 9, 'data': arr[7:].tostring()}]
+    rtn = store._do_read(collection, version, sentinel.symbol, index_range=(4, None))
+    assert np.array_equal(rtn, arr[4:])
+
+
+def test_read_segments_keeps_cursor_order():
+    segments = [{'compressed': i % 3 != 0, 'segment': i,
+                 'data': compress(str(i).encode('ascii')) if i % 3 != 0 else str(i).encode('ascii')} for i in range(20)]
+    assert [(s, d) for s, d in _read_segments(segments)] == [(i, str(i).encode('ascii')) for i in range(20)]
+
+
+def test_read_segments_decompresses_picked_blocks():
+    arr = np.arange(10, dtype='float64')
+    (data, offsets, ends), = _compress_blocks([arr], 4, typesize=8)
+    assert ends == [4, 8, 10]
+    segment = {'compressed': True, 'segment': 19, 'data': data, 'block_offsets': offsets, 'block_ends': ends}
+    segment_id, chunk = next(_read_segments([segment], typesize=8, blocks=lambda x: (1, 2)))
+    # rows 4 to 7 of the segment, of rows 10 to 19
+    assert segment_id == 17
+    assert np.array_equal(np.frombuffer(chunk, dtype='float64'), arr[4:8])
+    segment_id, chunk = next(_read_segments([segment], typesize=8))
+    assert segment_id == 19
+    assert np.array_equal(np.frombuffer(chunk, dtype='float64'), arr)
+
+
+def test_rewritten_dtype_history():
+    history = [{'up_to': 10, 'dtype': 'int32'}, {'up_to': 20, 'dtype': 'int64'}]
+    assert _rewritten_dtype_history(history, 25) == history
+    assert _rewritten_dtype_history(history, 15) == [{'up_to': 10, 'dtype': 'int32'}, {'up_to': 15, 'dtype': 'int64'}]
+    assert _rewritten_dtype_history(history, 10) == [{'up_to': 10, 'dtype': 'int32'}]
+    assert _rewritten_dtype_history(history, 0) == []
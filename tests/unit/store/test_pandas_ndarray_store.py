@@ -2,6 +2,7 @@ import numpy as np
 from mock import Mock, sentinel, patch
 from pytest import raises
 
+from arctic.date import DateRange
 # Do not remove PandasStore
 from arctic.store._pandas_ndarray_store import PandasDataFrameStore, PandasPanelStore, PandasStore
 from tests.util import read_str_as_pandas
@@ -55,3 +56,23 @@ def test_read_multi_index_with_no_ts_info():
     record = np.array(record.tolist(), dtype=np.dtype([('index 1', '<M8[ns]'), ('index 2', '<M8[ns]'), ('SPAM', '<f8')],
                                                       metadata={'index': ['index 1', 'index 2'], 'columns': ['SPAM']}))
     assert store.SERIALIZER._index_from_records(record).equals(df.index)
+
+
+def test_daterange_sorted_is_a_view():
+    recarr = np.array([(np.datetime64('2016-01-0%d' % i, 'ns'), i) for i in range(1, 6)],
+                      dtype=[('index', 'M8[ns]'), ('value', 'i8')])
+    with patch('arctic.store._pandas_ndarray_store._MONOTONIC_BLOCK', 2):
+        res = PandasStore()._daterange(recarr, DateRange('2016-01-02', '2016-01-04'))
+    assert list(res['value']) == [2, 3, 4]
+    assert np.may_share_memory(res, recarr)
+
+
+def test_daterange_unsorted():
+    recarr = np.array([(np.datetime64('2016-01-0%d' % i, 'ns'), i) for i in [3, 1, 5, 2, 4]],
+                      dtype=[('index', 'M8[ns]'), ('value', 'i8')])
+    with patch('arctic.store._pandas_ndarray_store._MONOTONIC_BLOCK', 2):
+        res = PandasStore()._daterange(recarr, DateRange('2016-01-02', '2016-01-04'))
+        assert list(res['value']) == [3, 2, 4]
+        # open ended: the rows before the first one and after the last one are in the range
+        assert list(PandasStore()._daterange(recarr, DateRange(end='2016-01-02'))['value']) == [1, 2]
+        assert list(PandasStore()._daterange(recarr, DateRange(start='2016-01-04'))['value']) == [5, 4]
@@ -0,0 +1,77 @@
+import threading
+
+from mock import Mock
+
+from arctic.store._pruner import Pruner
+
+
+def test_prunes_each_symbol_queued_once_in_batches():
+    pruned = []
+    pruner = Pruner(pruned.append, interval=0.2, batch_size=2)
+    for symbol in ['a', 'b', 'a', 'c', 'b']:
+        pruner.submit(symbol)
+    assert pruner.wait(10)
+    assert pruned == [['a', 'b'], ['c']]
+
+
+def test_wait_for_the_prune_in_progress():
+    started, resume = threading.Event(), threading.Event()
+
+    def prune(symbols):
+        started.set()
+        resume.wait(10)
+
+    pruner = Pruner(prune, interval=0)
+    pruner.submit('a')
+    assert started.wait(10)
+    assert not pruner.wait(0.1)
+    resume.set()
+    assert pruner.wait(10)
+
+
+def test_keeps_pruning_after_a_failure():
+    prune = Mock(side_effect=[Exception('boom'), None])
+    pruner = Pruner(prune, interval=0)
+    pruner.submit('a')
+    assert pruner.wait(10)
+    pruner.submit('b')
+    assert pruner.wait(10)
+    assert prune.call_args_list[-1][0] == (['b'],)
+
+
+def test_queues_again_the_symbols_not_pruned_yet():
+    prune = Mock(side_effect=[['b'], None])
+    pruner = Pruner(prune, interval=0)
+    pruner.submit('a')
+    pruner.submit('b')
+    assert pruner.wait(10)
+    assert [c[0][0] for c in prune.call_args_list] == [['a', 'b'], ['b']]
+
+
+def test_close():
+    prune = Mock(return_value=None)
+    pruner = Pruner(prune, interval=0)
+    pruner.submit('a')
+    assert pruner.wait(10)
+    pruner.close()
+    assert not pruner._thread.is_alive()
+    # submitting again starts it again
+    pruner.submit('b')
+    assert pruner.wait(10)
+    assert prune.call_args_list[-1][0] == (['b'],)
+    pruner.close()
+
+
+def test_closed_with_its_owner():
+    class Owner(object):
+        pass
+
+    owner = Owner()
+    pruner = Pruner(Mock(return_value=None), interval=0)
+    pruner.close_with(owner)
+    pruner.submit('a')
+    assert pruner.wait(10)
+    thread = pruner._thread
+    del owner
+    thread.join(10)
+    assert not thread.is_alive()
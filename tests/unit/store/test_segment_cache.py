@@ -0,0 +1,83 @@
+import hashlib
+
+from bson.binary import Binary
+from mock import patch
+
+from arctic.store import _segment_cache
+from arctic.store._segment_cache import SegmentCache, set_segment_cache, get_segment_cache
+
+
+def _segment(i, size=100):
+    data = (str(i) * size).encode('ascii')[:size]
+    return {'symbol': 'sym', 'segment': i, 'sha': Binary(hashlib.sha1(data).digest()),
+            'data': Binary(data), 'compressed': True, 'parent': ['x']}
+
+
+def test_put_get(tmpdir):
+    cache = SegmentCache(str(tmpdir.join('cache.db')))
+    segments = [_segment(i) for i in range(3)]
+    cache.put_many(segments[:2])
+    rtn = cache.get_many([x['sha'] for x in segments])
+    assert sorted(rtn) == sorted(bytes(x['sha']) for x in segments[:2])
+    doc = rtn[bytes(segments[0]['sha'])]
+    assert doc['segment'] == 0
+    assert bytes(doc['data']) == bytes(segments[0]['data'])
+    assert doc['compressed'] is True
+    assert 'parent' not in doc and 'symbol' not in doc
+
+
+def test_persisted(tmpdir):
+    path = str(tmpdir.join('cache.db'))
+    SegmentCache(path).put_many([_segment(1)])
+    assert list(SegmentCache(path).get_many([_segment(1)['sha']])) == [bytes(_segment(1)['sha'])]
+
+
+def test_evicts_least_recently_used(tmpdir):
+    cache = SegmentCache(str(tmpdir.join('cache.db')), max_size=1000)
+    # further apart than the resolution of the access times
+    times = iter(range(0, 100000, 1000))
+    with patch('arctic.store._segment_cache.time.time', side_effect=lambda: next(times)):
+        # ~270 bytes each, so that 3 segments fit in the cache
+        for i in range(3):
+            cache.put_many([_segment(i, 200)])
+        # touch the first one, so that the second is the least recently used
+        assert cache.get_many([_segment(0, 200)['sha']])
+        for i in range(3, 5):
+            cache.put_many([_segment(i, 200)])
+    rtn = cache.get_many([_segment(i, 200)['sha'] for i in range(5)])
+    assert sorted(x['segment'] for x in rtn.values()) == [0, 3, 4]
+
+
+def test_access_times_updated_once_a_minute(tmpdir):
+    cache = SegmentCache(str(tmpdir.join('cache.db')))
+    sha = _segment(0)['sha']
+    with patch('arctic.store._segment_cache.time.time', return_value=1000.):
+        cache.put_many([_segment(0)])
+    accessed = lambda: cache._conn.execute("SELECT accessed FROM segments").fetchone()[0]
+    with patch('arctic.store._segment_cache.time.time', return_value=1030.):
+        assert cache.get_many([sha])
+    assert accessed() == 1000.
+    with patch('arctic.store._segment_cache.time.time', return_value=1070.):
+        assert cache.get_many([sha])
+    assert accessed() == 1070.
+
+
+def test_size_counts_other_processes_puts(tmpdir):
+    path = str(tmpdir.join('cache.db'))
+    cache = SegmentCache(path, max_size=1000)
+    other = SegmentCache(path, max_size=1000)
+    other.put_many([_segment(i, 200) for i in range(3)])
+    with patch('arctic.store._segment_cache._SIZE_CHECK_EVERY', 1):
+        cache.put_many([_segment(3, 200)])
+    assert len(cache.get_many([_segment(i, 200)['sha'] for i in range(4)])) == 3
+    assert cache._size == other._total_size() <= 1000
+
+
+def test_set_segment_cache(tmpdir):
+    try:
+        set_segment_cache(str(tmpdir.join('cache.db')), max_size=10)
+        assert get_segment_cache().max_size == 10
+        set_segment_cache(None)
+        assert get_segment_cache() is None
+    finally:
+        _segment_cache._segment_cache = None
@@ -0,0 +1,176 @@
+import bson
+from mock import Mock, patch, sentinel
+from pymongo.errors import OperationFailure
+
+from arctic.store._version_cache import VersionCache
+
+
+def _version(symbol, version=1):
+    return {'_id': bson.ObjectId(), 'symbol': symbol, 'version': version, 'metadata': {'a': 1}}
+
+
+def _changes(*batches):
+    """
+    Mock changes collection, whose tailable cursor serves the batches of changes one poll at a time.
+    """
+    cursor = Mock(alive=True)
+    batches = iter(batches)
+    cursor.__iter__ = Mock(side_effect=lambda: iter([{'_id': bson.ObjectId(), 'symbol': s}
+                                                     for s in next(batches, [])]))
+    changes = Mock()
+    changes.find_one.return_value = {'_id': bson.ObjectId()}
+    changes.find.return_value = cursor
+    return changes
+
+
+def test_get_returns_copies():
+    cache = VersionCache(Mock(), _changes())
+    v = _version('a')
+    cache.put('a', v)
+    v['metadata']['a'] = 2
+    rtn = cache.get('a')
+    assert rtn == dict(v, metadata={'a': 1})
+    rtn.pop('metadata')
+    assert cache.get('a')['metadata'] == {'a': 1}
+    assert cache.get('b') is None
+
+
+def test_evicts_least_recently_used():
+    cache = VersionCache(Mock(), _changes(), max_size=2)
+    cache.put('a', _version('a'))
+    cache.put('b', _version('b'))
+    assert cache.get('a')
+    cache.put('c', _version('c'))
+    assert cache.get('b') is None
+    assert cache.get('a') and cache.get('c')
+
+
+def test_expires_after_ttl():
+    cache = VersionCache(Mock(), _changes(), ttl=10)
+    with patch('arctic.store._version_cache.time.time', return_value=100):
+        cache.put('a', _version('a'))
+    with patch('arctic.store._version_cache.time.time', return_value=109):
+        assert cache.get('a')
+    with patch('arctic.store._version_cache.time.time', return_value=111):
+        assert cache.get('a') is None
+
+
+def test_invalidated_by_changes():
+    changes = _changes([], ['a'])
+    cache = VersionCache(Mock(), changes)
+    with patch('arctic.store._version_cache.time.time', return_value=100):
+        cache.put('a', _version('a'))
+        cache.put('b', _version('b'))
+        assert cache.get('a')
+    with patch('arctic.store._version_cache.time.time', return_value=102):
+        assert cache.get('a') is None
+        assert cache.get('b')
+    assert changes.find.call_count == 1
+
+
+def test_changes_not_polled_more_than_every_poll_interval():
+    changes = _changes(['a'], ['a'])
+    cache = VersionCache(Mock(), changes)
+    with patch('arctic.store._version_cache.time.time', return_value=100):
+        assert cache.get('a') is None
+        cache.put('a', _version('a'))
+        assert cache.get('a')
+
+
+def test_dead_changes_cursor_resumed_from_last_change():
+    changes = _changes(['x'], ['a'])
+    cache = VersionCache(Mock(), changes)
+    with patch('arctic.store._version_cache.time.time', return_value=100):
+        cache.get('a')
+        cache.put('a', _version('a'))
+    last_id = cache._last_change_id
+    changes.find.return_value.alive = False
+    with patch('arctic.store._version_cache.time.time', return_value=102):
+        assert cache.get('a') is None
+    # a new tailable cursor is opened on the next poll, from the last change seen
+    with patch('arctic.store._version_cache.time.time', return_value=104):
+        cache.get('a')
+    assert changes.find.call_count == 2
+    resume_from = changes.find.call_args_list[1][0][0]['_id']['$gt']
+    assert resume_from.generation_time < last_id.generation_time
+
+
+def test_failed_changes_cursor_reopened_in_the_same_poll():
+    changes = _changes([], ['a'])
+    cache = VersionCache(Mock(), changes)
+    with patch('arctic.store._version_cache.time.time', return_value=100):
+        cache.put('a', _version('a'))
+        cache.put('b', _version('b'))
+        assert cache.get('a')
+    failed = Mock(alive=True)
+    failed.__iter__ = Mock(side_effect=OperationFailure('cursor not found'))
+    changes.find.side_effect = [failed, changes.find.return_value]
+    cache._tail = None
+    with patch('arctic.store._version_cache.time.time', return_value=102):
+        assert cache.get('a') is None
+        assert cache.get('b')
+    assert changes.find.call_count == 3
+
+
+def test_failed_changes_cursor_drops_all_if_last_change_overwritten():
+    changes = _changes(['x'])
+    cache = VersionCache(Mock(), changes)
+    with patch('arctic.store._version_cache.time.time', return_value=100):
+        cache.get('a')
+        cache.put('a', _version('a'))
+    changes.find.return_value.__iter__ = Mock(side_effect=OperationFailure('capped position lost'))
+    changes.find_one.return_value = None
+    with patch('arctic.store._version_cache.time.time', return_value=102):
+        assert cache.get('a') is None
+        cache.put('a', _version('a'))
+        # until the changes can be read again
+        assert cache.get('a') is None
+
+
+def test_changes_since_empty_changes_cursor_not_skipped():
+    changes = _changes([], ['a', 'b'])
+    changes.find_one.return_value = None
+    cache = VersionCache(Mock(), changes)
+    with patch('arctic.store._version_cache.time.time', return_value=100):
+        cache.put('a', _version('a'))
+        cache.put('b', _version('b'))
+        cache.put('c', _version('c'))
+    # the tailable cursor is closed on the empty collection
+    changes.find.return_value.alive = False
+    with patch('arctic.store._version_cache.time.time', return_value=100):
+        assert cache.get('a')
+    # then a and b are written by another process
+    changes.find.return_value.alive = True
+    with patch('arctic.store._version_cache.time.time', return_value=102):
+        assert cache.get('a') is None
+        assert cache.get('b') is None
+        assert cache.get('c')
+    assert changes.find.call_args_list[1][0][0] == {}
+
+
+def test_without_changes_checks_latest_version():
+    versions = Mock()
+    cache = VersionCache(versions, None)
+    v = _version('a')
+    cache.put('a', v)
+    versions.find_one.return_value = {'_id': v['_id'], 'version': 1}
+    assert cache.get('a')['_id'] == v['_id']
+    versions.find_one.return_value = {'_id': bson.ObjectId(), 'version': 2}
+    assert cache.get('a') is None
+    assert cache.get('a') is None
+    assert versions.find_one.call_count == 2
+
+
+def test_latest_version_checked_outside_of_the_lock():
+    versions = Mock()
+    cache = VersionCache(versions, None)
+    v = _version('a')
+    cache.put('a', v)
+    locked = []
+
+    def find_one(*args, **kwargs):
+        locked.append(cache._lock._is_owned())
+        return {'_id': v['_id'], 'version': 1}
+    versions.find_one.side_effect = find_one
+    assert cache.get('a')
+    assert locked == [False]
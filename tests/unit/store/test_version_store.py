@@ -1,4 +1,5 @@
 import datetime
+import threading
 from datetime import datetime as dt, timedelta as dtd
 
 import bson
@@ -97,7 +98,8 @@ def test_get_version_allow_secondary_True():
                        'symbol': 's', 'version': 10}]
 
     VersionStore.read(vs, "symbol")
-    assert vs._read_metadata.call_args_list == [call('symbol', as_of=None, read_preference=sentinel.read_preference)]
+    assert vs._read_metadata.call_args_list == [call('symbol', as_of=None, read_preference=sentinel.read_preference,
+                                                     cached=True)]
     assert vs._do_read.call_args_list == [call('symbol', vs._read_metadata.return_value, None, 
                                                date_range=None,
                                                read_preference=sentinel.read_preference)]
@@ -113,7 +115,8 @@ def test_get_version_allow_secondary_user_override_False():
                        'symbol': 's', 'version': 10}]
 
     VersionStore.read(vs, "symbol", allow_secondary=False)
-    assert vs._read_metadata.call_args_list == [call('symbol', as_of=None, read_preference=sentinel.read_preference)]
+    assert vs._read_metadata.call_args_list == [call('symbol', as_of=None, read_preference=sentinel.read_preference,
+                                                     cached=True)]
     assert vs._do_read.call_args_list == [call('symbol', vs._read_metadata.return_value, None,
                                                date_range=None, 
                                                read_preference=sentinel.read_preference)]
@@ -152,6 +155,17 @@ def test_read_metadata_no_asof():
                                                          sort=[('version', pymongo.DESCENDING)])]
 
 
+def test_read_metadata_version_cache_only_when_asked():
+    vs = create_autospec(VersionStore, instance=True, _versions=Mock(), _allow_secondary=False,
+                         _version_cache=Mock())
+    vs._version_cache.get.return_value = {'version': 1}
+    vs._versions.with_options.return_value.find_one.return_value = {'version': 2}
+    assert VersionStore._read_metadata(vs, 'symbol', read_preference=ReadPreference.PRIMARY)['version'] == 2
+    assert VersionStore._read_metadata(vs, 'symbol', as_of=2, cached=True)['version'] == 2
+    assert not vs._version_cache.get.called and not vs._version_cache.put.called
+    assert VersionStore._read_metadata(vs, 'symbol', cached=True)['version'] == 1
+
+
 def test_write_check_quota():
     write_handler = Mock(write=Mock(__name__=""))
     vs = create_autospec(VersionStore, instance=True,
@@ -609,3 +623,13 @@ def test_append_insert_version_operror():
     assert read_handler.append.call_count == 1
     assert vs._versions.insert_one.call_count == 2
     assert vs._publish_change.call_count == 1
+
+
+def test_prune_queued_leaves_the_symbols_being_written():
+    vs = create_autospec(VersionStore, instance=True, _writes={}, _writes_lock=threading.Lock())
+    with VersionStore._writing(vs, ['a']):
+        assert VersionStore._prune_queued(vs, ['a', 'b']) == ['a']
+    assert vs.prune_all.call_args_list == [call(symbols=['b'])]
+    assert VersionStore._prune_queued(vs, ['a']) == []
+    assert vs.prune_all.call_args_list[-1] == call(symbols=['a'])
+    assert vs._writes == {}
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from arctic.store._ndarray_store import _stats_dtype, _chunk_stats
+from arctic.store._where import Where
+
+
+def _stats(*chunks):
+    dtype = chunks[0].dtype
+    stats_dtype = _stats_dtype(dtype)
+    return np.concatenate([_chunk_stats(chunk, i, stats_dtype) for i, chunk in enumerate(chunks)])
+
+
+def _chunk(a, b):
+    return np.array(list(zip(a, b)), dtype=[('a', 'i8'), ('b', 'f8')])
+
+
+def test_columns():
+    assert Where('(a > 1) & ((b == 2) | ~(c < a))').columns == ['a', 'b', 'c']
+
+
+@pytest.mark.parametrize('expression', ['a +', 'a + 1 > 2', 'f(a) > 1', 'a > b.c', 'a in (1, 2)'])
+def test_unsupported(expression):
+    with pytest.raises(ValueError):
+        Where(expression)
+
+
+def test_rows():
+    rows = _chunk([1, 2, 3, 4], [4., np.nan, 2., 1.])
+    assert Where('a > 2').rows(rows).tolist() == [False, False, True, True]
+    assert Where('2 < a <= 3').rows(rows).tolist() == [False, False, True, False]
+    assert Where('b != 2').rows(rows).tolist() == [True, True, False, True]
+    assert Where('a >= b or a == 1').rows(rows).tolist() == [True, False, True, True]
+    assert Where('not a > 2').rows(rows).tolist() == [True, True, False, False]
+
+
+def test_segments():
+    stats = _stats(_chunk([1, 2], [1., 2.]), _chunk([3, 4], [np.nan, np.nan]), _chunk([5, 5], [3., np.nan]))
+    assert Where('a > 2').segments(stats).tolist() == [False, True, True]
+    assert Where('3 >= a').segments(stats).tolist() == [True, True, False]
+    assert Where('a == 5').segments(stats).tolist() == [False, False, True]
+    assert Where('a != 5').segments(stats).tolist() == [True, True, False]
+    assert Where('b != 3').segments(stats).tolist() == [True, True, True]
+    assert Where('b < 10').segments(stats).tolist() == [True, False, True]
+    assert Where('(a > 2) & (b < 10)').segments(stats).tolist() == [False, False, True]
+    assert Where('(a > 4) | (b < 2)').segments(stats).tolist() == [True, False, True]
+    # can't be ruled out from the statistics
+    assert Where('not a > 2').segments(stats).tolist() == [True, True, True]
+    assert Where('a > b').segments(stats).tolist() == [True, True, True]
@@ -1,6 +1,13 @@
+import threading
+import time
+
+import numpy as np
+import pytest
 from mock import patch, Mock
 
-from arctic._compression import compress, compress_array, decompress, decompress_array, enable_parallel_lz4
+from arctic._compression import compress, compress_array, decompress, decompress_array, enable_parallel_lz4, \
+    decompress_array_async, parse_codec, _CODECS, CompressionPolicy, AdaptiveCompressionPolicy, \
+    compression_policy, get_compression_policy
 
 
 def test_compress():
@@ -62,3 +69,118 @@ def test_enable_parallel_lz4():
 
 def test_compress_empty_string():
     assert(decompress(compress(b'')) == b'')
+
+
+def test_decompress_array_async():
+    ll = [('foo%s' % i).encode('ascii') for i in range(100)]
+    with patch('arctic._compression.ENABLE_PARALLEL', True):
+        parallel = decompress_array_async(compress_array(ll))
+    with patch('arctic._compression.ENABLE_PARALLEL', False):
+        serial = decompress_array_async(compress_array(ll))
+    assert parallel() == serial() == ll
+
+
+@pytest.mark.parametrize('codec', sorted(_CODECS))
+def test_codec_roundtrip(codec):
+    ll = [np.arange(i, i + 1000, dtype='f8').tostring() + b'x' for i in range(20)]
+    compressed = compress_array(ll, codec=codec, typesize=8)
+    assert compressed != ll
+    assert decompress_array(compressed, codec=codec, typesize=8) == ll
+    assert decompress_array_async(compressed, codec=codec, typesize=8)() == ll
+
+
+def test_shuffle_compresses_numeric_data_better():
+    ll = [np.linspace(100, 101, 10000).tostring()]
+    shuffled = compress_array(ll, codec='shuffle_lz4', typesize=8)
+    assert len(shuffled[0]) < len(compress_array(ll)[0])
+
+
+def test_parse_codec():
+    assert parse_codec(None) == (None, None)
+    assert parse_codec('lz4') == ('lz4', None)
+    assert parse_codec('shuffle_lz4:1') == ('shuffle_lz4', 1)
+    with pytest.raises(ValueError):
+        parse_codec('foo')
+
+
+def test_compression_policy_thresholds():
+    policy = CompressionPolicy(parallel=True, workers=2, n_parallel=4, minsz_parallel=100)
+    with patch('arctic._compression._compress_pool_size', 8):
+        assert policy.workers('compress', [b'x' * 101] * 5) == 2
+        assert policy.workers('compress', [b'x' * 100] * 5) == 1
+        assert policy.workers('compress', [b'x' * 101] * 4) == 1
+        assert policy.workers('compress', [b'x' * 101] + [b'x'] * 4) == 2
+        assert policy.workers('compress', [b'x'] * 2, slow=True) == 2
+        assert policy.workers('decompress', [b'x'] * 5) == 2
+        assert policy.workers('decompress', [b'x' * 1000] * 4) == 1
+    assert CompressionPolicy(parallel=False).workers('compress', [b'x'] * 100, slow=True) == 1
+
+
+def test_compression_policy_baseline_rules():
+    policy = CompressionPolicy(n_parallel=4, minsz_parallel=100)
+    with patch('arctic._compression._compress_pool_size', 8), \
+            patch('arctic._compression.ENABLE_PARALLEL', False):
+        # as compress_array always has, large enough chunks are compressed in parallel regardless
+        assert policy.workers('compress', [b'x' * 101] * 5) == 5
+        assert policy.workers('compress', [b'x'] * 2, slow=True) == 1
+        assert policy.workers('decompress', [b'x'] * 5) == 1
+    with patch('arctic._compression.BENCHMARK_MODE', True):
+        assert policy.workers('compress', [b'x'] * 2) > 1
+        assert policy.workers('decompress', [b'x'] * 2) == 1
+
+
+def test_compression_policy_context_is_per_thread():
+    seen = []
+    policy = CompressionPolicy(parallel=False)
+    with compression_policy(policy):
+        assert get_compression_policy() is policy
+        t = threading.Thread(target=lambda: seen.append(get_compression_policy()))
+        t.start()
+        t.join()
+        with compression_policy(parallel=True) as inner:
+            assert get_compression_policy() is inner
+        assert get_compression_policy() is policy
+    assert seen[0] is not policy
+    assert get_compression_policy() is seen[0]
+
+
+def test_compression_policy_used_by_compress_array():
+    ll = [('foo%s' % i).encode('ascii') for i in range(100)]
+    policy = Mock(wraps=CompressionPolicy(parallel=True, workers=3))
+    with patch('arctic._compression._compress_pool_size', 4), compression_policy(policy):
+        assert decompress_array(compress_array(ll)) == ll
+        assert decompress_array_async(compress_array(ll))() == ll
+    assert [c[0][0] for c in policy.workers.call_args_list] == ['compress', 'decompress', 'compress', 'decompress']
+    # small strings: compressed serially, decompressed in parallel
+    assert [c[0][2] for c in policy.record.call_args_list][:2] == [1, 3]
+
+
+def test_adaptive_compression_policy():
+    policy = AdaptiveCompressionPolicy(parallel=True, explore=2, retry_every=10)
+    str_list = [b'x' * 1000] * 8
+    speed = {1: 1., 2: 4., 4: 2.}
+    with patch('arctic._compression._compress_pool_size', 4):
+        tried = []
+        for _ in range(6):
+            workers = policy.workers('compress', str_list)
+            tried.append(workers)
+            policy.record('compress', str_list, workers, 1. / speed[workers])
+        assert sorted(tried) == [1, 1, 2, 2, 4, 4]
+        assert [policy.workers('compress', str_list) for _ in range(3)] == [2, 2, 2]
+        # other chunk sizes are measured separately
+        assert policy.workers('compress', [b'x' * 100000] * 8) == 1
+
+
+def test_adaptive_compression_policy_learns_from_async_decompression():
+    def slow_decompress(_str, typesize):
+        time.sleep(0.02)
+        return _str
+
+    policy = Mock(wraps=AdaptiveCompressionPolicy(parallel=True, explore=1, retry_every=1000))
+    str_list = [b'x' * 1000] * 4
+    with patch.dict('arctic._compression._CODECS', slow=(None, slow_decompress)), \
+            patch('arctic._compression._compress_pool_size', 4), compression_policy(policy):
+        for _ in range(3):
+            assert decompress_array_async(str_list, codec='slow')() == str_list
+        assert sorted(c[0][2] for c in policy.record.call_args_list) == [1, 2, 4]
+        assert policy.workers('decompress', str_list) > 1
@@ -3,17 +3,18 @@ from datetime import datetime as dt
 import numpy as np
 import pandas as pd
 import pytest
+from bson.binary import Binary
 from mock import create_autospec, sentinel, call
 from pymongo import ReadPreference
 from pymongo.collection import Collection
 
-from arctic._compression import decompress
+from arctic._compression import compress, decompress
 from arctic.date import CLOSED_OPEN
 from arctic.date._daterange import DateRange
 from arctic.date._mktz import mktz
 from arctic.exceptions import UnorderedDataException
 from arctic.tickstore.tickstore import TickStore, IMAGE_DOC, IMAGE, START, \
-    DTYPE, END, COUNT, SYMBOL, COLUMNS, ROWMASK, DATA, INDEX, IMAGE_TIME
+    DTYPE, END, COUNT, SYMBOL, COLUMNS, ROWMASK, DATA, INDEX, IMAGE_TIME, VERSION, _get_pool
 
 
 def test_mongo_date_range_query():
@@ -102,6 +103,7 @@ def test_tickstore_to_bucket_with_image():
     assert bucket[IMAGE_DOC][IMAGE] == initial_image
     assert bucket[IMAGE_DOC] == {IMAGE: initial_image,
                                  IMAGE_TIME: initial_image['index']}
+    assert list(bucket[IMAGE_DOC]) == [IMAGE_TIME, IMAGE]
     assert final_image == {'index': data[-1]['index'], 'A': 125, 'B': 27.2, 'C': 'DESC', 'D': 0}
 
 
@@ -124,6 +126,24 @@ def test_tickstore_to_bucket_always_forwards_image():
         TickStore._to_bucket(data, symbol, initial_image)
 
 
+def test_tickstore_to_bucket_sparse_ms_index():
+    data = [{'index': 1388534460000, 'A': 124, 'C': 'a'},
+            {'index': 1388534520000, 'B': 27.2},
+            {'index': 1388534580000, 'A': 126, 'B': 28.2}]
+    bucket, final_image = TickStore._to_bucket(data, 'SYM', {'A': 123, 'D': 0})
+    assert list(np.cumsum(np.frombuffer(decompress(bucket[INDEX]), dtype='uint64'))) == [i['index'] for i in data]
+    assert get_coldata(bucket[COLUMNS]['A']) == ([124, 126], [1, 0, 1, 0, 0, 0, 0, 0])
+    assert get_coldata(bucket[COLUMNS]['B']) == ([27.2, 28.2], [0, 1, 1, 0, 0, 0, 0, 0])
+    assert get_coldata(bucket[COLUMNS]['C']) == (['a'], [1, 0, 0, 0, 0, 0, 0, 0])
+    assert final_image == {'index': 1388534580000, 'A': 126, 'B': 28.2, 'C': 'a', 'D': 0}
+    # updated with the ticks in turn
+    assert list(final_image) == ['A', 'D', 'index', 'C', 'B']
+
+    data[2]['index'] = 1388534500000
+    with pytest.raises(UnorderedDataException):
+        TickStore._to_bucket(data, 'SYM', None)
+
+
 def get_coldata(coldata):
     """ return values and rowmask """
     dtype = np.dtype(coldata[DTYPE])
@@ -167,6 +187,82 @@ def test_tickstore_pandas_to_bucket_image():
                                  IMAGE_TIME: initial_image['index']}
 
 
+def test_tickstore_read_buckets():
+    data = [{'index': dt(2014, 1, 1, 0, 1, tzinfo=mktz('UTC')), 'A': 124, 'C': 'a'},
+            {'index': dt(2014, 1, 1, 0, 2, tzinfo=mktz('UTC')), 'A': 125, 'B': 27.2, 'C': 'bc'},
+            {'index': dt(2014, 1, 1, 0, 3, tzinfo=mktz('UTC')), 'B': 28.2, 'C': 'd', 'D': 'e'}]
+    bucket, _ = TickStore._to_bucket(data, 'SYM', None)
+    bucket[VERSION] = 3
+    self = TickStore.__new__(TickStore)
+
+    union_mask, masks, image = self._bucket_rows(bucket, False)
+    assert list(union_mask) == [True, True, True] and image is None
+    # the masks of the columns with gaps, decompressed once
+    assert sorted(masks) == ['A', 'B', 'D'] and list(masks['D']) == [False, False, True]
+    names, rtn = self._read_buckets([(bucket, union_mask, masks, image, 0)], 3, None, False)
+    assert sorted(names) == ['A', 'B', 'C', 'D']
+    assert list(rtn[INDEX]) == [1388534460000, 1388534520000, 1388534580000]
+    # preallocated with their final dtypes
+    assert rtn['A'].dtype == np.float64 and np.array_equal(rtn['A'][:2], [124, 125]) and np.isnan(rtn['A'][2])
+    assert rtn['B'].dtype == np.float64 and np.isnan(rtn['B'][0]) and list(rtn['B'][1:]) == [27.2, 28.2]
+    assert rtn['C'].dtype == np.object_ and list(rtn['C']) == ['a', 'bc', 'd']
+    assert rtn['D'].dtype == np.object_ and list(rtn['D']) == [None, None, 'e']
+
+    # only the rows with a value in the columns read (projected), after the image
+    bucket[COLUMNS] = {'D': bucket[COLUMNS]['D']}
+    bucket[IMAGE_DOC] = {IMAGE_TIME: dt(2014, 1, 1, 0, 0), IMAGE: {'D': 'i', 'E': 1.}}
+    union_mask, masks, image = self._bucket_rows(bucket, True)
+    assert list(union_mask) == [False, False, True] and not masks and image is bucket[IMAGE_DOC]
+    names, rtn = self._read_buckets([(bucket, union_mask, masks, image, 1)], 3, ['D', 'SYMBOL'], True)
+    assert names == ['D']
+    assert list(rtn[INDEX][1:]) == [1388534400000, 1388534580000]
+    assert list(rtn['D'][1:]) == ['i', 'e']
+    assert list(rtn['SYMBOL'][1:]) == ['SYM', 'SYM']
+
+
+def test_tickstore_read_buckets_dtypes():
+    data = [{'index': dt(2014, 1, 1, 0, 1, tzinfo=mktz('UTC')), 'A': 1},
+            {'index': dt(2014, 1, 1, 0, 2, tzinfo=mktz('UTC')), 'A': 2}]
+    bucket, _ = TickStore._to_bucket(data, 'SYM', None)
+    bucket[VERSION] = 3
+    rowmask = bucket[COLUMNS]['A'][ROWMASK]
+    # bool and bytes columns, which aren't written but may be found in buckets
+    bucket[COLUMNS]['B'] = {DATA: Binary(compress(np.array([True, False]).tostring())), DTYPE: '|b1',
+                            ROWMASK: rowmask}
+    bucket[COLUMNS]['C'] = {DATA: Binary(compress(np.array([b'ab', b'c']).tostring())), DTYPE: '|S2',
+                            ROWMASK: rowmask}
+    bucket[IMAGE_DOC] = {IMAGE_TIME: dt(2014, 1, 1, 0, 0), IMAGE: {'D': True, 'E': 3, 'F': b'x'}}
+    self = TickStore.__new__(TickStore)
+    union_mask, masks, image = self._bucket_rows(bucket, True)
+    names, rtn = self._read_buckets([(bucket, union_mask, masks, image, 0)], 3, None, False)
+    assert sorted(names) == ['A', 'B', 'C', 'D', 'E', 'F']
+    assert rtn['A'].dtype == np.float64 and np.isnan(rtn['A'][0]) and list(rtn['A'][1:]) == [1., 2.]
+    assert rtn['B'].dtype == np.object_ and list(rtn['B'][1:]) == [True, False]
+    assert rtn['C'].dtype == np.object_ and list(rtn['C'][1:]) == [b'ab', b'c']
+    assert rtn['D'].dtype == np.object_ and list(rtn['D']) == [True, None, None]
+    assert rtn['E'].dtype == np.float64 and rtn['E'][0] == 3. and np.isnan(rtn['E'][1:]).all()
+    assert rtn['F'].dtype == np.object_ and list(rtn['F']) == [b'x', None, None]
+
+
+def test_tickstore_read_bucket_rows_in_pool():
+    buckets = []
+    for i in range(20):
+        bucket, _ = TickStore._to_bucket([{'index': dt(2014, 1, 1, 0, i, tzinfo=mktz('UTC')), 'A': i}], 'SYM', None)
+        bucket[VERSION] = 3
+        buckets.append(bucket)
+    self = TickStore.__new__(TickStore)
+    serial = list(self._read_bucket_rows(iter(buckets), False))
+    parallel = list(self._read_bucket_rows(iter(buckets), False, _get_pool(2), 2))
+    assert [x[0] for x in parallel] == [x[0] for x in serial] == buckets
+    assert all(list(x[1]) == list(y[1]) for x, y in zip(parallel, serial))
+
+
+def test_tickstore_pools_shared():
+    assert _get_pool(1) is None
+    assert _get_pool(3) is _get_pool(3)
+    assert _get_pool(2) is not _get_pool(3)
+
+
 def test__read_preference__allow_secondary_true():
     self = create_autospec(TickStore)
     assert TickStore._read_preference(self, True) == ReadPreference.NEAREST